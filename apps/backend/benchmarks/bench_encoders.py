@@ -0,0 +1,87 @@
+"""
+Compare cutout output encoders
+
+Cuts out every sample image once, then reports encode time and output size for
+each encoder option: PNG at several compress levels, lossless WebP, and the
+alpha-only mask PNG.
+
+Usage (from apps/backend):
+    python benchmarks/bench_encoders.py [--images uploads] [--repeat 3]
+"""
+import sys
+import time
+import argparse
+import statistics
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import cutout_engine  # noqa: E402
+from services.image_encoding import encode_image  # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# (label, output_format, options)
+ENCODERS = [
+    ("png level 0", "png", {"compress_level": 0}),
+    ("png level 1", "png", {"compress_level": 1}),
+    ("png level 3", "png", {"compress_level": 3}),
+    ("png level 6 (Pillow default)", "png", {"compress_level": 6}),
+    ("png level 9", "png", {"compress_level": 9}),
+    ("webp lossless method 0", "webp", {"webp_method": 0}),
+    ("webp lossless method 4", "webp", {"webp_method": 4}),
+    ("mask png level 1", "mask", {"compress_level": 1}),
+    ("mask png level 6", "mask", {"compress_level": 6}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="uploads", help="Directory of sample images")
+    parser.add_argument("--repeat", type=int, default=3, help="Encodes per image and option (median is reported)")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        print(f"No images found in {args.images}")
+        return 1
+
+    print(f"Cutting out {len(paths)} images "
+          f"({'rembg' if cutout_engine.REMBG_AVAILABLE else 'fallback remover'})...")
+    cutouts = []
+    for path in paths:
+        with Image.open(path) as image:
+            cutouts.append(cutout_engine.remove_background(image.copy()))
+    megapixels = sum(c.width * c.height for c in cutouts) / 1e6
+
+    print(f"\n{'encoder':<30} {'total s':>9} {'MP/s':>8} {'total MB':>9} {'vs default':>11}")
+    results = []
+    for label, output_format, options in ENCODERS:
+        total_time = 0.0
+        total_bytes = 0
+        for cutout in cutouts:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = encode_image(cutout, output_format, **options)
+                timings.append(time.perf_counter() - start)
+            total_time += statistics.median(timings)
+            total_bytes += len(data)
+        results.append((label, total_time, total_bytes))
+
+    default_bytes = next(b for label, _, b in results if "default" in label)
+    for label, total_time, total_bytes in results:
+        print(f"{label:<30} {total_time:>9.3f} {megapixels / total_time:>8.1f} "
+              f"{total_bytes / 1e6:>9.2f} {total_bytes / default_bytes:>10.2f}x")
+
+    # Make sure every encoder produced something decodable
+    for label, output_format, options in ENCODERS:
+        Image.open(BytesIO(encode_image(cutouts[0], output_format, **options))).load()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Measure the local tiled upscaler's throughput and memory against image size
+
+Upscales synthetic images (or a sample image resized) of increasing size with
+the tiled, memory-mapped engine and with a plain whole-image Lanczos resize +
+PNG save for comparison. Reports output megapixels per second and peak Python
+heap use (tracemalloc, which includes NumPy and Pillow buffers).
+
+Usage (from apps/backend):
+    python benchmarks/bench_local_upscale.py [--sizes 256,512,1024,2048] [--scale 4] [--image test_image.jpg]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import local_upscaler  # noqa: E402
+
+
+def sample_image(size: int, source: str = None) -> Image.Image:
+    """A square test image: the given file resized, or smooth gradients plus noise and hard edges"""
+    if source:
+        with Image.open(source) as image:
+            return image.convert("RGB").resize((size, size), Image.LANCZOS)
+    rng = np.random.default_rng(size)
+    y, x = np.mgrid[0:size, 0:size] / size
+    pixels = np.stack([x * 255, y * 255, (x + y) * 127], axis=-1)
+    pixels += rng.normal(0, 8, pixels.shape)
+    pixels[(np.floor(x * 16) + np.floor(y * 16)) % 2 == 0] *= 0.6
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="RGB")
+
+
+def memory_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _child(fn, queue):
+    baseline = memory_kb("VmRSS")
+    start = time.perf_counter()
+    fn()
+    queue.put((time.perf_counter() - start, (memory_kb("VmHWM") - baseline) * 1024))
+
+
+def measure(fn):
+    """Run fn in a forked process, returns (seconds, peak resident bytes above its starting point)"""
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(fn, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="256,512,1024,2048", help="Comma-separated input sizes (square, pixels)")
+    parser.add_argument("--scale", type=int, default=4, help="Scale factor")
+    parser.add_argument("--tile", type=int, default=local_upscaler.LOCAL_UPSCALE_TILE_SIZE, help="Tile size")
+    parser.add_argument("--image", default=None, help="Sample image to resize instead of a synthetic one")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the whole-image resize comparison")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    workdir = tempfile.mkdtemp(prefix="bench-upscale-")
+    print(f"{args.scale}x upscale, tile {args.tile}, scratch in {workdir}")
+    print(f"\n{'input':>11} {'output MP':>10} {'engine':<10} {'seconds':>8} {'out MP/s':>9} {'peak RSS MB':>12} {'file MB':>8}")
+
+    for size in sizes:
+        image = sample_image(size, args.image)
+        output_mp = (size * args.scale) ** 2 / 1e6
+        runs = [("tiled", lambda path: local_upscaler.upscale_image(image, path, args.scale, tile_size=args.tile))]
+        if not args.no_baseline:
+            runs.append((
+                "whole",
+                lambda path: image.resize((size * args.scale, size * args.scale), Image.LANCZOS).save(
+                    path, format="PNG", compress_level=local_upscaler.LOCAL_UPSCALE_PNG_LEVEL
+                ),
+            ))
+
+        for label, run in runs:
+            path = os.path.join(workdir, f"{label}-{size}.png")
+            elapsed, peak = measure(lambda: run(path))
+            print(f"{size:>5}x{size:<5} {output_mp:>10.1f} {label:<10} {elapsed:>8.2f} "
+                  f"{output_mp / elapsed:>9.1f} {peak / 1e6:>12.1f} {os.path.getsize(path) / 1e6:>8.1f}")
+            os.unlink(path)
+    os.rmdir(workdir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
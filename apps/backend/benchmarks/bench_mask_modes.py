@@ -0,0 +1,94 @@
+"""
+Compare the "full" and "fast" cutout mask modes
+
+Runs every sample image through both paths and reports latency plus how far the
+fast mask drifts from the full one, overall (IoU) and inside the edge band
+(mean absolute alpha error, 0-255).
+
+Usage (from apps/backend):
+    python benchmarks/bench_mask_modes.py [--images uploads] [--repeat 3] [--model u2net]
+"""
+import sys
+import time
+import argparse
+import statistics
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import cutout_engine  # noqa: E402
+from services.mask_refine import edge_band  # noqa: E402
+from services.rembg_sessions import get_session  # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def alpha_of(png_data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(BytesIO(png_data)).convert("RGBA").getchannel("A"), dtype=np.float32)
+
+
+def time_call(fn, *args, repeat: int = 3):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="uploads", help="Directory of sample images")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image and mode (median is reported)")
+    parser.add_argument("--model", default=cutout_engine.DEFAULT_MODEL, help="rembg model name")
+    args = parser.parse_args()
+
+    if not cutout_engine.REMBG_AVAILABLE:
+        print("rembg is not installed, nothing to compare (the fallback remover has no mask modes)")
+        return 1
+
+    paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        print(f"No images found in {args.images}")
+        return 1
+
+    # Load the session up front so model loading is not timed
+    get_session(args.model)
+
+    print(f"{'image':<44} {'size':>11} {'full s':>8} {'fast s':>8} {'speedup':>8} {'IoU':>7} {'edge MAE':>9}")
+    speedups = []
+    for path in paths:
+        image_data = path.read_bytes()
+        with Image.open(BytesIO(image_data)) as probe:
+            size = f"{probe.width}x{probe.height}"
+
+        full_png, full_time = time_call(cutout_engine.cutout_encoded, image_data, args.model, repeat=args.repeat)
+        fast_png, fast_time = time_call(cutout_engine.lowres_cutout_encoded, image_data, args.model, repeat=args.repeat)
+
+        full_alpha = alpha_of(full_png)
+        fast_alpha = alpha_of(fast_png)
+
+        full_fg = full_alpha > 127
+        fast_fg = fast_alpha > 127
+        union = np.logical_or(full_fg, fast_fg).sum()
+        iou = np.logical_and(full_fg, fast_fg).sum() / union if union else 1.0
+
+        band = np.asarray(edge_band(Image.fromarray(full_alpha.astype(np.uint8), mode="L"), dilate=3)) > 0
+        edge_mae = float(np.abs(full_alpha - fast_alpha)[band].mean()) if band.any() else 0.0
+
+        speedup = full_time / fast_time if fast_time else 0.0
+        speedups.append(speedup)
+        print(f"{path.name[:44]:<44} {size:>11} {full_time:>8.3f} {fast_time:>8.3f} {speedup:>7.2f}x {iou:>7.4f} {edge_mae:>9.2f}")
+
+    print(f"\nMedian speedup: {statistics.median(speedups):.2f}x over {len(paths)} images "
+          f"(fast mode max side {cutout_engine.FAST_MASK_MAX_SIDE}px)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
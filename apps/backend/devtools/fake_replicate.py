@@ -0,0 +1,361 @@
+"""
+Local stand-in for the Replicate and Cloudinary APIs, for testing without network or credits
+
+Implements the prediction endpoints the backend uses. Predictions finish after
+a run time drawn from --delay with a generated PNG served from this server, and
+predictions created with a webhook get a signed completion callback, like the
+real API. Cloudinary image uploads are kept in memory and served back.
+
+Latencies take a distribution: a number of seconds (fixed), "uniform:LOW,HIGH",
+"normal:MEAN,STDDEV", "lognormal:MEDIAN,SIGMA" or "exp:MEAN". Besides failed
+predictions (--fail-rate), API calls can be answered with 429s and 5xxs.
+
+Usage (from apps/backend):
+    python devtools/fake_replicate.py [--port 8765] [--delay lognormal:2,0.5] [--fail-rate 0]
+        [--api-latency 0.05] [--error-rate 0] [--throttle-rate 0]
+        [--upload-latency uniform:0.2,0.6] [--upload-error-rate 0]
+
+Then run the backend with:
+    REPLICATE_BASE_URL=http://127.0.0.1:8765
+    REPLICATE_API_TOKEN=r8_fake
+    REPLICATE_WEBHOOK_BASE_URL=http://127.0.0.1:8000
+    REPLICATE_WEBHOOK_SECRET=<printed on startup>
+    CLOUDINARY_CLOUD_NAME=fake CLOUDINARY_API_KEY=fake CLOUDINARY_API_SECRET=fake
+    CLOUDINARY_UPLOAD_PREFIX=http://127.0.0.1:8765
+    INPUT_FETCH_ALLOWED_HOSTS=127.0.0.1:8765
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import base64
+import hashlib
+from io import BytesIO
+from pathlib import Path
+from datetime import datetime, timezone
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.replicate_webhooks import sign  # noqa: E402
+
+DEFAULT_SECRET = "whsec_" + base64.b64encode(b"fake-replicate-local-secret").decode()
+
+# Uploaded images kept in memory, oldest dropped first
+MAX_UPLOADS = 2000
+
+
+class Latency:
+    """A latency distribution in seconds, parsed from "fixed:S", "uniform:LOW,HIGH", "normal:MEAN,STDDEV",
+    "lognormal:MEDIAN,SIGMA", "exp:MEAN" or a plain number"""
+
+    KINDS = {
+        "fixed": (1, lambda s: s[0]),
+        "uniform": (2, lambda s: random.uniform(s[0], s[1])),
+        "normal": (2, lambda s: random.gauss(s[0], s[1])),
+        "lognormal": (2, lambda s: s[0] * random.lognormvariate(0, s[1])),
+        "exp": (1, lambda s: random.expovariate(1 / s[0]) if s[0] > 0 else 0.0),
+    }
+
+    def __init__(self, spec: Union[str, float]):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(":") if ":" in self.spec else ("fixed", "", self.spec)
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r}, use one of {', '.join(self.KINDS)}")
+        count, self._draw = self.KINDS[kind]
+        self._params = [float(p) for p in params.split(",") if p.strip()]
+        if len(self._params) != count:
+            raise ValueError(f"{kind} latency takes {count} parameter(s): {self.spec!r}")
+
+    def sample(self) -> float:
+        return max(0.0, self._draw(self._params))
+
+    def __repr__(self) -> str:
+        return self.spec
+
+
+def _sample(latency: Union[Latency, float]) -> float:
+    """Seconds from a distribution, plain numbers are fixed latencies"""
+    return latency.sample() if isinstance(latency, Latency) else float(latency)
+
+
+app = FastAPI(title="Fake Replicate")
+app.state.delay = 2.0
+app.state.fail_rate = 0.0
+app.state.api_latency = 0.0
+app.state.error_rate = 0.0
+app.state.throttle_rate = 0.0
+app.state.upload_latency = 0.0
+app.state.upload_error_rate = 0.0
+app.state.secret = DEFAULT_SECRET
+app.state.base_url = "http://127.0.0.1:8765"
+
+predictions = {}
+uploads = OrderedDict()
+
+
+def _injected_error(throttle_rate: float, error_rate: float) -> Optional[Response]:
+    """A Replicate-style 429 or 5xx response at the configured rates, None otherwise"""
+    roll = random.random()
+    if roll < throttle_rate:
+        return JSONResponse(
+            {"detail": "Request was throttled. Expected available in 1 second.", "status": 429},
+            status_code=429, headers={"retry-after": "1"},
+        )
+    if roll < throttle_rate + error_rate:
+        status = random.choice([500, 502, 503])
+        return JSONResponse({"detail": "Fake upstream error", "status": status}, status_code=status)
+    return None
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next: Callable):
+    """API latency and error injection for the Replicate (/v1) and Cloudinary (/v1_1) endpoints"""
+    path = request.url.path
+    if path.startswith("/v1_1/"):
+        await asyncio.sleep(_sample(app.state.upload_latency))
+        error = None
+        if random.random() < app.state.upload_error_rate:
+            # Cloudinary's error shape
+            error = JSONResponse({"error": {"message": "Fake upstream error"}}, status_code=random.choice([500, 502, 503]))
+    elif path.startswith("/v1/"):
+        await asyncio.sleep(_sample(app.state.api_latency))
+        error = _injected_error(app.state.throttle_rate, app.state.error_rate)
+    else:
+        error = None
+    return error or await call_next(request)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _view(prediction: dict) -> dict:
+    """Advance the prediction if its time is up, and return it in API form"""
+    if prediction["status"] == "processing" and time.time() >= prediction["finish_at"]:
+        if random.random() < app.state.fail_rate:
+            prediction.update(status="failed", error="Fake failure")
+        else:
+            prediction.update(status="succeeded", output=f"{app.state.base_url}/outputs/{prediction['id']}.png")
+        prediction["completed_at"] = _now()
+
+    return {key: value for key, value in prediction.items() if key != "finish_at"}
+
+
+async def _create(body: dict, model: str, version: str) -> dict:
+    prediction = {
+        "id": uuid.uuid4().hex,
+        "model": model,
+        "version": version,
+        "input": body.get("input", {}),
+        "output": None,
+        "error": None,
+        "logs": "",
+        "status": "processing",
+        "created_at": _now(),
+        "completed_at": None,
+        "urls": {},
+        "webhook": body.get("webhook"),
+        "finish_at": time.time() + _sample(app.state.delay),
+    }
+    predictions[prediction["id"]] = prediction
+    prediction["urls"] = {
+        "get": f"{app.state.base_url}/v1/predictions/{prediction['id']}",
+        "cancel": f"{app.state.base_url}/v1/predictions/{prediction['id']}/cancel",
+    }
+
+    if prediction["webhook"]:
+        asyncio.ensure_future(_fire_webhook(prediction))
+    return _view(prediction)
+
+
+async def _fire_webhook(prediction: dict):
+    """Post the finished prediction to its webhook, signed like Replicate does"""
+    await asyncio.sleep(max(0.0, prediction["finish_at"] - time.time()))
+    body = json.dumps(_view(prediction)).encode()
+    webhook_id = f"msg_{uuid.uuid4().hex}"
+    timestamp = str(int(time.time()))
+    headers = {
+        "content-type": "application/json",
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": sign(app.state.secret, webhook_id, timestamp, body),
+    }
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.post(prediction["webhook"], content=body, headers=headers)
+        print(f"webhook {prediction['id']} -> {response.status_code}")
+    except httpx.HTTPError as e:
+        print(f"webhook {prediction['id']} failed: {e}")
+
+
+@app.post("/v1/predictions", status_code=201)
+async def create_prediction(request: Request):
+    body = await request.json()
+    return await _create(body, "", body.get("version", ""))
+
+
+@app.post("/v1/models/{owner}/{name}/predictions", status_code=201)
+async def create_model_prediction(owner: str, name: str, request: Request):
+    return await _create(await request.json(), f"{owner}/{name}", "")
+
+
+@app.get("/v1/predictions/{prediction_id}")
+async def get_prediction(prediction_id: str):
+    if prediction_id not in predictions:
+        raise HTTPException(status_code=404, detail="Not found")
+    return _view(predictions[prediction_id])
+
+
+@app.post("/v1/predictions/{prediction_id}/cancel")
+async def cancel_prediction(prediction_id: str):
+    if prediction_id not in predictions:
+        raise HTTPException(status_code=404, detail="Not found")
+    prediction = predictions[prediction_id]
+    if prediction["status"] == "processing":
+        prediction.update(status="canceled", completed_at=_now())
+    return _view(prediction)
+
+
+@app.get("/v1/webhooks/default/secret")
+async def webhook_secret():
+    return {"key": app.state.secret}
+
+
+@app.get("/outputs/{prediction_id}.png")
+async def prediction_output(prediction_id: str):
+    if prediction_id not in predictions:
+        raise HTTPException(status_code=404, detail="Not found")
+    # Same gradient for every prediction, with a transparent edge like a cutout
+    gradient = Image.linear_gradient("L").resize((512, 512))
+    image = Image.merge("RGBA", (gradient, gradient.rotate(90), Image.new("L", (512, 512), 128), gradient.rotate(180)))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return Response(buffer.getvalue(), media_type="image/png")
+
+
+@app.post("/v1_1/{cloud_name}/image/upload")
+async def cloudinary_upload(cloud_name: str, request: Request):
+    """Cloudinary's upload API: a multipart form with the image in "file" (or a URL to fetch)"""
+    form = await request.form()
+    upload = form.get("file")
+    if upload is None:
+        return JSONResponse({"error": {"message": "Missing required parameter - file"}}, status_code=400)
+    if isinstance(upload, str):
+        if upload.startswith("data:"):
+            data = base64.b64decode(upload.split(",", 1)[1])
+        else:
+            async with httpx.AsyncClient(timeout=30) as client:
+                response = await client.get(upload)
+            data = response.content
+    else:
+        data = await upload.read()
+    try:
+        with Image.open(BytesIO(data)) as image:
+            width, height, image_format = image.width, image.height, (image.format or "png").lower()
+    except Exception:
+        return JSONResponse({"error": {"message": "Invalid image file"}}, status_code=400)
+
+    public_id = str(form.get("public_id") or uuid.uuid4().hex)
+    folder = str(form.get("folder") or "")
+    if folder and not public_id.startswith(folder + "/"):
+        public_id = f"{folder}/{public_id}"
+    image_format = "jpg" if image_format == "jpeg" else image_format
+    path = f"{cloud_name}/image/upload/{public_id}.{image_format}"
+    uploads[path] = (data, f"image/{'jpeg' if image_format == 'jpg' else image_format}")
+    uploads.move_to_end(path)
+    while len(uploads) > MAX_UPLOADS:
+        uploads.popitem(last=False)
+
+    url = f"{app.state.base_url}/cloudinary/{path}"
+    return {
+        "asset_id": uuid.uuid4().hex,
+        "public_id": public_id,
+        "version": int(time.time()),
+        "signature": hashlib.sha1(data).hexdigest(),
+        "width": width,
+        "height": height,
+        "format": image_format,
+        "resource_type": "image",
+        "created_at": _now(),
+        "bytes": len(data),
+        "type": "upload",
+        "url": url,
+        "secure_url": url,
+    }
+
+
+@app.get("/cloudinary/{path:path}")
+async def cloudinary_asset(path: str):
+    if path not in uploads:
+        raise HTTPException(status_code=404, detail="Not found")
+    data, media_type = uploads[path]
+    return Response(data, media_type=media_type)
+
+
+@app.get("/samples/{name}.png")
+async def sample_image(name: str):
+    """A small input image whose colours depend on the name, so distinct names miss the result cache"""
+    seed = int(hashlib.sha256(name.encode()).hexdigest()[:6], 16)
+    color = ((seed >> 16) & 255, (seed >> 8) & 255, seed & 255)
+    image = Image.new("RGB", (256, 256), color)
+    image.paste(Image.linear_gradient("L").resize((128, 128)).convert("RGB"), (64, 64))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return Response(buffer.getvalue(), media_type="image/png")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=Latency, default=Latency("2"), help="Prediction run time distribution")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of predictions that fail (0-1)")
+    parser.add_argument("--api-latency", type=Latency, default=Latency("0"),
+                        help="Latency distribution of each Replicate API call")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of Replicate API calls answered with a 500/502/503 (0-1)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of Replicate API calls answered with a 429 (0-1)")
+    parser.add_argument("--upload-latency", type=Latency, default=Latency("0"),
+                        help="Latency distribution of each Cloudinary upload")
+    parser.add_argument("--upload-error-rate", type=float, default=0.0,
+                        help="Fraction of Cloudinary uploads answered with a 5xx (0-1)")
+    parser.add_argument("--secret", default=DEFAULT_SECRET, help="Webhook signing secret")
+    args = parser.parse_args()
+
+    app.state.delay = args.delay
+    app.state.fail_rate = args.fail_rate
+    app.state.api_latency = args.api_latency
+    app.state.error_rate = args.error_rate
+    app.state.throttle_rate = args.throttle_rate
+    app.state.upload_latency = args.upload_latency
+    app.state.upload_error_rate = args.upload_error_rate
+    app.state.secret = args.secret
+    app.state.base_url = f"http://{args.host}:{args.port}"
+
+    print(f"Fake Replicate and Cloudinary on {app.state.base_url}")
+    print(f"  prediction time {args.delay}, fail rate {args.fail_rate}, API latency {args.api_latency}, "
+          f"error rate {args.error_rate}, throttle rate {args.throttle_rate}")
+    print(f"  upload latency {args.upload_latency}, upload error rate {args.upload_error_rate}")
+    print(f"REPLICATE_BASE_URL={app.state.base_url}")
+    print(f"REPLICATE_WEBHOOK_SECRET={args.secret}")
+    print(f"CLOUDINARY_UPLOAD_PREFIX={app.state.base_url}")
+    print(f"INPUT_FETCH_ALLOWED_HOSTS={args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
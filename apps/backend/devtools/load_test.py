@@ -0,0 +1,256 @@
+"""
+Drive the API at a target request rate and report latency, throughput and error rates
+
+Requests start on schedule whatever the response times (open loop), so an
+overloaded server shows up as growing latency and errors, not as a lower
+request rate. The rate is shared between routes by the weights in --mix:
+
+    upscale     POST /upscale, then long-polls /upscale/status/{task_id} until done
+    remove-bg   POST /api/remove-bg, then long-polls /api/remove-bg/status/{task_id}
+    watermark   POST /api/watermark-remover with --image (waits for the result)
+    upload      POST /upload with --image
+
+Latency is end to end, including the polling for the asynchronous routes.
+Image URLs point at --input-url, a unique name per request unless
+--repeat-input is given (then every request after the first is a cache hit).
+
+Usage (from apps/backend), with the backend wired to devtools/fake_replicate.py:
+    python devtools/load_test.py [--base-url http://127.0.0.1:8000] [--rps 5] [--duration 30]
+        [--mix upscale=1,remove-bg=1,watermark=1,upload=1] [--image test_image.jpg]
+        [--input-url http://127.0.0.1:8765/samples] [--json results.json]
+"""
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROUTES = ("upscale", "remove-bg", "watermark", "upload")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+# Seconds each status long-poll is held server side
+POLL_WAIT = 20
+
+
+class Outcome:
+    """How one request went: its route, end-to-end seconds and "ok" or an error label"""
+
+    def __init__(self, route: str, seconds: float, result: str):
+        self.route = route
+        self.seconds = seconds
+        self.result = result
+
+    @property
+    def ok(self) -> bool:
+        return self.result == "ok"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """"upscale=2,upload=1" -> {"upscale": 2.0, "upload": 1.0}, a bare name has weight 1"""
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route {name!r}, use one of {', '.join(ROUTES)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("--mix needs at least one route with a positive weight")
+    return mix
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of unsorted values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1
+    return ordered[rank]
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.image = Path(args.image).read_bytes()
+        self.image_name = Path(args.image).name
+        self.outcomes: List[Outcome] = []
+        self.dropped: Dict[str, int] = {route: 0 for route in ROUTES}
+        self.in_flight = 0
+        self.client = httpx.AsyncClient(
+            base_url=args.base_url,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight),
+        )
+
+    def input_url(self) -> str:
+        name = "load-test" if self.args.repeat_input else uuid.uuid4().hex
+        return f"{self.args.input_url.rstrip('/')}/{name}.png"
+
+    async def poll(self, path: str, task: dict) -> str:
+        """Long-poll a task's status until it finishes, returns "ok" or the failure"""
+        while task["status"] not in TERMINAL_STATUSES:
+            response = await self.client.get(path, params={"wait": POLL_WAIT, "since": task["status"]})
+            if response.status_code != 200:
+                return f"poll HTTP {response.status_code}"
+            task = response.json()
+        return "ok" if task["status"] == "completed" else f"task {task['status']}"
+
+    async def upscale(self) -> str:
+        response = await self.client.post("/upscale", json={
+            "image_url": self.input_url(), "scale_factor": self.args.scale, "engine": self.args.engine,
+        })
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        task = response.json()
+        return await self.poll(f"/upscale/status/{task['task_id']}", task)
+
+    async def remove_bg(self) -> str:
+        response = await self.client.post("/api/remove-bg", json={"image_url": self.input_url()})
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        task = response.json()
+        return await self.poll(f"/api/remove-bg/status/{task['task_id']}", task)
+
+    async def watermark(self) -> str:
+        response = await self.client.post(
+            "/api/watermark-remover", files={"file": (self.image_name, self.image, "image/jpeg")}
+        )
+        return "ok" if response.status_code == 200 else f"HTTP {response.status_code}"
+
+    async def upload(self) -> str:
+        response = await self.client.post("/upload", files={"file": (self.image_name, self.image, "image/jpeg")})
+        return "ok" if response.status_code == 200 else f"HTTP {response.status_code}"
+
+    async def request(self, route: str):
+        handler = {"upscale": self.upscale, "remove-bg": self.remove_bg,
+                   "watermark": self.watermark, "upload": self.upload}[route]
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = await handler()
+        except httpx.TimeoutException:
+            result = "timeout"
+        except httpx.HTTPError as e:
+            result = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        self.outcomes.append(Outcome(route, time.perf_counter() - start, result))
+
+    async def run(self) -> float:
+        """Send requests for --duration seconds, wait for the stragglers, returns the elapsed time"""
+        mix = self.args.mix
+        routes, weights = list(mix), list(mix.values())
+        rng = random.Random(self.args.seed)
+        pending = set()
+        start = time.perf_counter()
+        next_at = start
+        try:
+            while next_at - start < self.args.duration:
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                route = rng.choices(routes, weights)[0]
+                if self.in_flight >= self.args.max_in_flight:
+                    self.dropped[route] += 1
+                else:
+                    task = asyncio.ensure_future(self.request(route))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                gap = rng.expovariate(self.args.rps) if self.args.poisson else 1 / self.args.rps
+                next_at += gap
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            await self.client.aclose()
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> dict:
+        """Per-route and overall counts, throughput, error rate and latency percentiles"""
+        summary = {"elapsed_seconds": round(elapsed, 3), "target_rps": self.args.rps, "routes": {}}
+        groups = [(route, [o for o in self.outcomes if o.route == route]) for route in self.args.mix]
+        groups.append(("all", self.outcomes))
+        for name, outcomes in groups:
+            dropped = sum(self.dropped.values()) if name == "all" else self.dropped[name]
+            latencies = [o.seconds for o in outcomes if o.ok]
+            errors = {}
+            for o in outcomes:
+                if not o.ok:
+                    errors[o.result] = errors.get(o.result, 0) + 1
+            failed = len(outcomes) - len(latencies)
+            summary["routes"][name] = {
+                "requests": len(outcomes),
+                "ok": len(latencies),
+                "errors": errors,
+                "dropped": dropped,
+                "error_rate": round(failed / len(outcomes), 4) if outcomes else 0.0,
+                "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+                "latency_seconds": {
+                    f"p{pct}": None if value is None else round(value, 4)
+                    for pct, value in ((pct, percentile(latencies, pct)) for pct in (50, 95, 99))
+                },
+            }
+        return summary
+
+
+def print_report(summary: dict):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    print(f"\n{summary['elapsed_seconds']:.1f}s at a target of {summary['target_rps']} req/s")
+    print(f"\n{'route':<10} {'requests':>8} {'ok':>6} {'err %':>6} {'dropped':>7} {'ok/s':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, stats in summary["routes"].items():
+        latency = stats["latency_seconds"]
+        print(f"{name:<10} {stats['requests']:>8} {stats['ok']:>6} {stats['error_rate'] * 100:>6.1f} "
+              f"{stats['dropped']:>7} {stats['throughput_rps']:>7.2f} "
+              f"{ms(latency['p50']):>8} {ms(latency['p95']):>8} {ms(latency['p99']):>8}")
+    for name, stats in summary["routes"].items():
+        if name != "all" and stats["errors"]:
+            errors = ", ".join(f"{label} x{count}" for label, count in sorted(stats["errors"].items()))
+            print(f"  {name} errors: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Backend to load")
+    parser.add_argument("--rps", type=float, default=5.0, help="Requests started per second, across all routes")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep sending requests")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(",".join(ROUTES)),
+                        help="Routes and their share of the rate, e.g. upscale=2,upload=1")
+    parser.add_argument("--poisson", action="store_true", help="Exponential gaps between requests instead of even ones")
+    parser.add_argument("--image", default="test_image.jpg", help="Image sent to the upload routes")
+    parser.add_argument("--input-url", default="http://127.0.0.1:8765/samples",
+                        help="Base URL of input images for /upscale and /api/remove-bg")
+    parser.add_argument("--repeat-input", action="store_true", help="Send the same input URL every time")
+    parser.add_argument("--scale", type=int, default=2, help="Upscale factor")
+    parser.add_argument("--engine", default=None, help="Upscale engine (replicate, local or auto)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds before a request counts as timed out")
+    parser.add_argument("--max-in-flight", type=int, default=500,
+                        help="Requests open at once; arrivals beyond this are dropped and counted")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the route choice and arrival gaps")
+    parser.add_argument("--json", default=None, help="Also write the summary to this file")
+    args = parser.parse_args()
+    if args.rps <= 0 or args.duration <= 0:
+        parser.error("--rps and --duration must be positive")
+
+    load_test = LoadTest(args)
+    mix = ", ".join(f"{route}={weight:g}" for route, weight in args.mix.items())
+    print(f"Loading {args.base_url} at {args.rps} req/s for {args.duration}s ({mix})")
+    elapsed = asyncio.run(load_test.run())
+    summary = load_test.report(elapsed)
+    print_report(summary)
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2))
+        print(f"\nSummary written to {args.json}")
+    all_stats = summary["routes"]["all"]
+    return 0 if all_stats["requests"] and all_stats["ok"] == all_stats["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 # Gunicorn configuration file
+import os
+import shutil
 import multiprocessing
 
 # Server socket
@@ -22,6 +24,24 @@ errorlog = "-"
 loglevel = "info"
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 
+# Prometheus multiprocess mode: every worker writes its metrics to files here and
+# /metrics adds them up. Set before the workers import prometheus_client.
+prometheus_multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or "/tmp/static-ads-prometheus"
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = prometheus_multiproc_dir
+
+def on_starting(server):
+    # Files from an earlier run would be counted again
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    # Drop the worker's live gauges (in-flight requests), its counters and histograms are kept
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
 # Process naming
 proc_name = "static-ads-generator-api"
 
@@ -41,7 +41,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Import routers
-from routers import remove_bg, remove_bg_replicate, design_card, health, upscale, upload, watermark_remover, blog
+from routers import remove_bg, remove_bg_replicate, design_card, health, upscale, upload, watermark_remover, blog, replicate_webhook, tasks, metrics
+from services.metrics import PrometheusMiddleware
 
 # Get environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
@@ -126,6 +127,9 @@ app.add_middleware(
     max_age=3600,
 )
 
+# Latency and in-flight requests per route, served at /metrics
+app.add_middleware(PrometheusMiddleware)
+
 # Include routers
 app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(remove_bg.router, prefix="/remove-bg", tags=["remove-bg"])
@@ -135,6 +139,45 @@ app.include_router(upload.router, tags=["file-upload"])
 app.include_router(upscale.router, tags=["image-upscale"])
 app.include_router(watermark_remover.router, prefix="/api", tags=["watermark-remover"])
 app.include_router(blog.router, tags=["blog"])
+app.include_router(replicate_webhook.router, tags=["replicate-webhook"])
+app.include_router(tasks.router, tags=["tasks"])
+app.include_router(metrics.router, tags=["metrics"])
+
+# Load rembg models once per worker so cutout requests reuse a warm session
+from services import rembg_sessions
+from services.inference_executor import inference_executor
+from services.replicate_client import replicate_client
+from services.download_proxy import download_proxy
+from services.input_fetch import input_fetcher
+from services.task_store import task_sweeper
+
+@app.on_event("startup")
+async def warm_rembg_sessions():
+    rembg_sessions.start_warm_up()
+
+@app.on_event("startup")
+async def start_task_sweeper():
+    task_sweeper.start()
+
+@app.on_event("shutdown")
+async def stop_task_sweeper():
+    task_sweeper.stop()
+
+@app.on_event("shutdown")
+async def stop_inference_executor():
+    inference_executor.shutdown()
+
+@app.on_event("shutdown")
+async def close_replicate_client():
+    await replicate_client.close()
+
+@app.on_event("shutdown")
+async def close_download_proxy():
+    await download_proxy.close()
+
+@app.on_event("shutdown")
+async def close_input_fetcher():
+    await input_fetcher.close()
 
 # Mount static files for uploads
 import os
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
 from PIL import Image, ImageDraw, ImageFont
 import base64
@@ -10,18 +10,26 @@ from services.layout import LayoutService
 from services.color import ColorService
 from services.storage import StorageService
 from models.recipe import ComposeRequest
+from services.image_encoding import encode_image
+from services.image_response import resolve_output_format, image_response, Timer, IMAGE_RESPONSES
+from services.inference_executor import inference_executor, InferenceQueueFull
 
 router = APIRouter()
 
 class ComposeResponse(BaseModel):
     png_base64: str
 
-@router.post("/")
-async def compose_image(request: ComposeRequest):
+@router.post("/", responses=IMAGE_RESPONSES)
+async def compose_image(request: ComposeRequest, accept: Optional[str] = Header(None)):
     """
     Compose final ad image with background, product cutout, and text
+    Send Accept: image/png or image/webp to get raw image bytes instead of base64 JSON
     """
     try:
+        timer = Timer()
+        # Before any work, so an unacceptable Accept header is a quick 406
+        output_format, send_bytes = resolve_output_format(accept)
+        
         # Initialize services
         storage_service = StorageService()
         
@@ -59,13 +67,20 @@ async def compose_image(request: ComposeRequest):
                 request.palette
             )
         
-        # Convert to base64
-        buffer = io.BytesIO()
-        composition.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        timer.mark("compose")
+        
+        # Encoding (WebP especially) is CPU work, keep it off the event loop
+        image_bytes = await inference_executor.run(encode_image, composition, output_format)
+        if send_bytes:
+            timer.mark("encode")
+            return image_response(image_bytes, output_format, timer.finish())
         
-        return ComposeResponse(png_base64=img_str)
+        return ComposeResponse(png_base64=base64.b64encode(image_bytes).decode())
         
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Image encoding is busy, please retry: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error composing image: {str(e)}")
 
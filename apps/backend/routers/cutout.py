@@ -1,20 +1,30 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from rembg import remove
-from PIL import Image
-import io
-import base64
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException
+from typing import Optional
 import os
 from dotenv import load_dotenv
+from services.cutout_engine import run_cutout, run_cutout_bytes
+from services.image_response import resolve_output_format, image_response, Timer, IMAGE_RESPONSES
+from services.inference_executor import InferenceQueueFull
 
 load_dotenv()
 
 router = APIRouter()
 
-@router.post("/")
-async def remove_background(file: UploadFile = File(...)):
+@router.post("/", responses=IMAGE_RESPONSES)
+async def remove_background(
+    file: UploadFile = File(...),
+    mask_mode: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    accept: Optional[str] = Header(None),
+):
     """
     Remove background from uploaded image using rembg
-    Returns base64 encoded PNG with transparent background
+    Returns base64 encoded PNG with transparent background,
+    or raw bytes when the client sends Accept: image/png or image/webp
+    mask_mode: "full" or "fast" (low-resolution mask refined at full resolution)
+    output_format: "png", "webp" (lossless, raw bytes only) or "mask" (alpha-only PNG)
+    compress_level: PNG zlib level 0-9, lower is faster and larger
     """
     try:
         # Validate file type
@@ -22,18 +32,30 @@ async def remove_background(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="File must be an image")
         
         # Read image data
+        timer = Timer()
         image_data = await file.read()
-        input_image = Image.open(io.BytesIO(image_data))
+        timer.mark("read")
         
-        # Remove background using rembg
-        output_image = remove(input_image)
+        output_format, send_bytes = resolve_output_format(accept, output_format)
+        if send_bytes:
+            image_bytes = await run_cutout_bytes(
+                image_data, mask_mode=mask_mode, output_format=output_format, compress_level=compress_level
+            )
+            timer.mark("cutout")
+            return image_response(image_bytes, output_format, timer.finish())
         
-        # Convert to base64
-        buffer = io.BytesIO()
-        output_image.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        # Remove background and encode on the inference executor
+        img_str = await run_cutout(
+            image_data, mask_mode=mask_mode, output_format=output_format, compress_level=compress_level
+        )
         
         return {"png_base64": img_str}
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Background removal is busy, please retry: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error removing background: {str(e)}")
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
 import base64
-from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import os
+from typing import Optional
 from services.bg_gen import generate_background
 from services.prompt_parse import parse_prompt
 from services.compose import compose_card
+from services.image_encoding import encode_image
+from services.image_response import resolve_output_format, image_response, Timer, IMAGE_RESPONSES
+from services.inference_executor import inference_executor, InferenceQueueFull
 
 router = APIRouter()
 
@@ -18,53 +21,64 @@ class DesignCardRequest(BaseModel):
 class DesignCardResponse(BaseModel):
     image_base64: str
 
-@router.post("/", response_model=DesignCardResponse)
-async def design_card(request: DesignCardRequest):
+@router.post("/", response_model=DesignCardResponse, responses=IMAGE_RESPONSES)
+async def design_card(request: DesignCardRequest, accept: Optional[str] = Header(None)):
     """
     Generate a complete ad design from cutout and prompt
+    Send Accept: image/png or image/webp to get raw image bytes instead of base64 JSON
     """
     try:
+        timer = Timer()
+        # Before any work, so an unacceptable Accept header is a quick 406
+        output_format, send_bytes = resolve_output_format(accept)
+        
         # Check if we should use end-to-end poster mode
         use_end_to_end = os.getenv("USE_END_TO_END_POSTER", "false").lower() == "true"
         
         if use_end_to_end:
             # Mode B: Generate full poster with model
-            return await generate_end_to_end_poster(request)
+            final_image = await generate_end_to_end_poster(request)
         else:
             # Mode A: AI-assisted composition
-            return await generate_ai_composition(request)
+            final_image = await generate_ai_composition(request)
+        timer.mark("design")
+        
+        # Encoding (WebP especially) is CPU work, keep it off the event loop
+        image_bytes = await inference_executor.run(encode_image, final_image, output_format)
+        if send_bytes:
+            timer.mark("encode")
+            return image_response(image_bytes, output_format, timer.finish())
+        
+        return DesignCardResponse(image_base64=base64.b64encode(image_bytes).decode())
             
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Image encoding is busy, please retry: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate design: {str(e)}")
 
-async def generate_ai_composition(request: DesignCardRequest):
+async def generate_ai_composition(request: DesignCardRequest) -> Image.Image:
     """Mode A: Generate background + compose with product and text"""
     try:
         # Parse prompt to extract text and colors
         parsed = parse_prompt(request.prompt)
         
         # Generate background
-        bg_image = generate_background(request.prompt, request.size["w"], request.size["h"])
+        bg_image = await generate_background(request.prompt, request.size["w"], request.size["h"])
         
         # Compose final card
-        final_image = compose_card(
+        return compose_card(
             bg_image=bg_image,
             cutout_base64=request.cutout_base64,
             parsed=parsed,
             size=(request.size["w"], request.size["h"])
         )
         
-        # Convert to base64
-        buffer = BytesIO()
-        final_image.save(buffer, format='PNG')
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return DesignCardResponse(image_base64=image_base64)
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Composition failed: {str(e)}")
 
-async def generate_end_to_end_poster(request: DesignCardRequest):
+async def generate_end_to_end_poster(request: DesignCardRequest) -> Image.Image:
     """Mode B: Generate full poster with model (placeholder)"""
     # For demo purposes, fall back to composition mode
     # In production, this would call the AI model directly
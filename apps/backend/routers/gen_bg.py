@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import replicate
-import requests
+from services.replicate_client import replicate_client
 from PIL import Image, ImageDraw
 import io
 import base64
@@ -69,7 +68,7 @@ async def generate_background(request: GenBgRequest):
         if replicate_token:
             # Use Replicate FLUX for real background generation
             try:
-                output = replicate.run(
+                output = await replicate_client.run(
                     "stability-ai/flux:7c0f25c4c6c8e0b0c0c0c0c0c0c0c0c0c0c0c0c0",
                     input={
                         "prompt": request.prompt,
@@ -81,11 +80,10 @@ async def generate_background(request: GenBgRequest):
                 
                 if output and len(output) > 0:
                     # Download the generated image
-                    response = requests.get(output[0])
-                    if response.status_code == 200:
-                        # Convert to base64
-                        img_str = base64.b64encode(response.content).decode()
-                        return {"image_url": output[0], "image_base64": img_str}
+                    image_data = await replicate_client.download(output[0])
+                    # Convert to base64
+                    img_str = base64.b64encode(image_data).decode()
+                    return {"image_url": output[0], "image_base64": img_str}
                 
             except Exception as e:
                 print(f"Replicate API error: {e}")
@@ -3,6 +3,19 @@ import os
 import time
 from datetime import datetime
 import sys
+from services import rembg_sessions
+from services.inference_executor import inference_executor
+from services.cutout_engine import mask_batcher
+from services.cutout_cache import cutout_cache
+from services.task_store import task_store, task_sweeper
+from services.result_cache import result_cache
+from services.download_proxy import download_proxy
+from services.input_fetch import input_fetcher
+from services.job_scheduler import job_scheduler
+from services.replicate_client import replicate_client
+from services.rate_limiter import replicate_rate_limits
+from services.circuit_breaker import replicate_bg_removal_breaker
+from services.task_events import task_events
 
 # Make psutil optional
 try:
@@ -61,6 +74,18 @@ async def detailed_health_check():
         # Check if critical services are running
         system_info["services"] = {
             "rembg_available": check_rembg_availability(),
+            "rembg_sessions": rembg_sessions.get_status(),
+            "inference_executor": inference_executor.get_stats(),
+            "task_store": await task_store.aget_stats(),
+            "task_sweeper": task_sweeper.get_stats(),
+            "replicate_client": replicate_client.get_stats(),
+            "job_scheduler": job_scheduler.get_stats(),
+            "replicate_rate_limits": replicate_rate_limits.get_stats(),
+            "replicate_bg_removal_breaker": replicate_bg_removal_breaker.get_stats(),
+            "task_events": task_events.get_stats(),
+            "result_cache": await result_cache.aget_stats(),
+            "download_proxy": download_proxy.get_stats(),
+            "input_fetcher": input_fetcher.get_stats(),
             "replicate_configured": bool(os.getenv("REPLICATE_API_TOKEN")),
         }
         
@@ -76,6 +101,7 @@ async def readiness_check():
         # Check if all required services are ready
         checks = {
             "rembg": check_rembg_availability(),
+            "rembg_session": rembg_sessions.is_ready(),
             "environment": bool(os.getenv("ENVIRONMENT")),
             "cors_origins": bool(os.getenv("CORS_ORIGINS")),
         }
@@ -90,6 +116,18 @@ async def readiness_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Readiness check failed: {str(e)}")
 
+@router.get("/inference")
+async def inference_health_check():
+    """Queue depth and in-flight counters for the local inference executor"""
+    return {
+        "ok": True,
+        "timestamp": datetime.utcnow().isoformat(),
+        "executor": inference_executor.get_stats(),
+        "batching": mask_batcher.get_stats(),
+        "cache": cutout_cache.get_stats(),
+        "sessions": rembg_sessions.get_status(),
+    }
+
 def check_rembg_availability():
     """Check if rembg is available and working"""
     try:
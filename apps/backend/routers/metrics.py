@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+from services import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint
+    Sync on purpose: reading every worker's metric files runs on the threadpool.
+    """
+    if not metrics.PROMETHEUS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="prometheus-client is not installed")
+    # Set as a header, media_type would get a second charset appended
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
@@ -1,47 +1,42 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import base64
-from io import BytesIO
-from PIL import Image
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import json
+import os
+import time
+from services.cutout_engine import run_cutout, run_cutout_bytes, MASK_MODES
+from services.image_response import resolve_output_format, image_response, Timer, IMAGE_RESPONSES
+from services.image_encoding import validate_encode_options
+from services.inference_executor import InferenceQueueFull
 
 router = APIRouter()
 
-class RemoveBgResponse(BaseModel):
-    png_base64: str
+UPLOAD_DIR = Path("uploads")
 
-# Try to import rembg, fall back to mock if not available
-try:
-    from rembg import remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
-    print("Warning: rembg not available, using mock background removal")
+# Batch limits
+MAX_BATCH_ITEMS = int(os.getenv("REMOVE_BG_BATCH_MAX_ITEMS", "200"))
+BATCH_CONCURRENCY = int(os.getenv("REMOVE_BG_BATCH_CONCURRENCY", "8"))
 
-def mock_remove_background(input_image: Image.Image) -> Image.Image:
-    """Mock background removal that returns the original image with transparency"""
-    # Convert to RGBA if not already
-    if input_image.mode != 'RGBA':
-        input_image = input_image.convert('RGBA')
-    
-    # Create a simple mock by making white/light pixels transparent
-    data = input_image.getdata()
-    new_data = []
-    
-    for item in data:
-        # If pixel is close to white/light, make it transparent
-        if item[0] > 240 and item[1] > 240 and item[2] > 240:
-            new_data.append((item[0], item[1], item[2], 0))
-        else:
-            new_data.append(item)
-    
-    output_image = Image.new('RGBA', input_image.size)
-    output_image.putdata(new_data)
-    return output_image
+class RemoveBgResponse(BaseModel):
+    png_base64: str
 
-@router.post("/", response_model=RemoveBgResponse)
-async def remove_background(file: UploadFile = File(...)):
+@router.post("/", response_model=RemoveBgResponse, responses=IMAGE_RESPONSES)
+async def remove_background(
+    file: UploadFile = File(...),
+    mask_mode: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    accept: Optional[str] = Header(None),
+):
     """
     Remove background from uploaded image
+    mask_mode: "full" (default) or "fast" (low-resolution mask refined at full resolution)
+    output_format: "png", "webp" (lossless, raw bytes only) or "mask" (alpha-only PNG)
+    compress_level: PNG zlib level 0-9, lower is faster and larger
+    Send Accept: image/png or image/webp to get raw image bytes instead of base64 JSON
     """
     try:
         # Validate file type
@@ -49,21 +44,136 @@ async def remove_background(file: UploadFile = File(...)):
             raise HTTPException(status_code=422, detail="File must be an image")
         
         # Read image
+        timer = Timer()
         image_data = await file.read()
-        input_image = Image.open(BytesIO(image_data))
+        timer.mark("read")
         
-        # Remove background
-        if REMBG_AVAILABLE:
-            output_image = remove(input_image)
-        else:
-            output_image = mock_remove_background(input_image)
+        output_format, send_bytes = resolve_output_format(accept, output_format)
+        if send_bytes:
+            image_bytes = await run_cutout_bytes(
+                image_data, mask_mode=mask_mode, output_format=output_format, compress_level=compress_level
+            )
+            timer.mark("cutout")
+            return image_response(image_bytes, output_format, timer.finish())
         
-        # Convert to base64
-        buffer = BytesIO()
-        output_image.save(buffer, format='PNG')
-        png_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Decode, remove background and encode off the event loop
+        png_base64 = await run_cutout(
+            image_data, mask_mode=mask_mode, output_format=output_format, compress_level=compress_level
+        )
         
         return RemoveBgResponse(png_base64=png_base64)
         
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Background removal is busy, please retry: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=422, detail=f"Failed to remove background: {str(e)}")
+
+@router.post("/batch")
+async def remove_background_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    filenames: Optional[List[str]] = Form(None),
+    mask_mode: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+):
+    """
+    Remove background from many images at once
+    Accepts uploaded files and/or names of files already in uploads/ (from /upload).
+    Streams one NDJSON line per image as soon as it is ready, then a summary line.
+    """
+    items = []
+    
+    for upload in files or []:
+        if not upload.content_type or not upload.content_type.startswith('image/'):
+            raise HTTPException(status_code=422, detail=f"File must be an image: {upload.filename}")
+        # Read now, the request body is gone once streaming starts
+        items.append({"filename": upload.filename, "data": await upload.read()})
+    
+    for filename in filenames or []:
+        # Only plain names inside the uploads directory
+        if Path(filename).name != filename:
+            raise HTTPException(status_code=400, detail=f"Invalid upload filename: {filename}")
+        items.append({"filename": filename, "path": UPLOAD_DIR / filename})
+    
+    if mask_mode and mask_mode not in MASK_MODES:
+        raise HTTPException(status_code=422, detail=f"Unknown mask mode: {mask_mode}. Supported: {', '.join(MASK_MODES)}")
+    if output_format not in (None, "png", "mask"):
+        raise HTTPException(status_code=422, detail="Batch results are base64 JSON, output_format must be png or mask")
+    try:
+        validate_encode_options(output_format, compress_level)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=400, detail="Provide at least one file or upload filename")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch size ({len(items)}) exceeds maximum of {MAX_BATCH_ITEMS} images")
+    
+    return StreamingResponse(
+        stream_batch_results(items, mask_mode, output_format or "png", compress_level),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Batch-Size": str(len(items))}
+    )
+
+async def stream_batch_results(
+    items: List[dict],
+    mask_mode: Optional[str] = None,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+):
+    """
+    Run every item through the cutout engine and yield NDJSON lines in completion order
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    
+    async def process(index: int, item: dict) -> dict:
+        async with semaphore:
+            start_time = time.time()
+            try:
+                image_data = item.get("data")
+                if image_data is None:
+                    if not item["path"].exists():
+                        raise FileNotFoundError("Upload not found")
+                    image_data = await loop.run_in_executor(None, item["path"].read_bytes)
+                
+                png_base64 = await run_cutout(
+                    image_data, mask_mode=mask_mode, output_format=output_format, compress_level=compress_level
+                )
+                return {
+                    "index": index,
+                    "filename": item["filename"],
+                    "status": "completed",
+                    "png_base64": png_base64,
+                    "processing_time": round(time.time() - start_time, 3)
+                }
+            except Exception as e:
+                return {
+                    "index": index,
+                    "filename": item["filename"],
+                    "status": "failed",
+                    "error": str(e)
+                }
+    
+    tasks = [asyncio.ensure_future(process(index, item)) for index, item in enumerate(items)]
+    succeeded = 0
+    
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if result["status"] == "completed":
+                succeeded += 1
+            yield json.dumps(result) + "\n"
+        
+        yield json.dumps({
+            "done": True,
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded
+        }) + "\n"
+    finally:
+        # Client went away or we finished, don't leave work running
+        for task in tasks:
+            if not task.done():
+                task.cancel()
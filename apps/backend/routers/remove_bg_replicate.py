@@ -1,12 +1,24 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel, HttpUrl
-import replicate
-import requests
 import os
+import time
+import asyncio
 import logging
 from typing import Optional
 import uuid
+from functools import partial
 from datetime import datetime
+from services.task_store import task_store
+from services.replicate_client import replicate_client, output_url
+from services import replicate_webhooks, single_flight
+from services.task_events import task_events
+from services.result_cache import result_cache
+from services.input_fetch import input_fetcher
+from services.download_proxy import download_proxy
+from services.job_scheduler import job_scheduler, JobCancelled, PRIORITY_HIGH
+from services.circuit_breaker import replicate_bg_removal_breaker, model_breakers, CLOSED, HALF_OPEN
+from services.cutout_engine import run_cutout_bytes, REMBG_AVAILABLE
+from services.rembg_sessions import DEFAULT_MODEL
 
 logger = logging.getLogger(__name__)
 
@@ -23,35 +35,73 @@ class RemoveBgResponse(BaseModel):
     original_url: str
     created_at: str
     processing_time: Optional[float] = None
+    backend: Optional[str] = None
     replicate_model_info: Optional[dict] = None
 
-# In-memory storage for task status (in production, use Redis or database)
-bg_removal_tasks = {}
+# Task status lives in the shared task store so every worker can answer status polls
+TASK_KIND = "bg_removal"
+BG_REMOVAL_MODEL = "851-labs/background-remover:a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc"
+
+# Which engine produced a result, reported in responses as "backend"
+BACKEND_REPLICATE = "replicate"
+BACKEND_LOCAL = "local"
+# Serve requests with the local rembg engine while Replicate's circuit is open or a call fails
+BG_REMOVAL_LOCAL_FALLBACK = os.getenv("BG_REMOVAL_LOCAL_FALLBACK", "true").lower() == "true"
+# Give up on a Replicate call after this long (counts as a failure for the circuit)
+BG_REMOVAL_REPLICATE_TIMEOUT = float(os.getenv("BG_REMOVAL_REPLICATE_TIMEOUT", "60"))
+
+# Webhook completions of this model's predictions feed the same breaker
+model_breakers[replicate_client.model_name(BG_REMOVAL_MODEL)] = replicate_bg_removal_breaker
+
+# Result cache namespace for local outputs, apart from Replicate's
+LOCAL_MODEL_REF = f"local/rembg:{DEFAULT_MODEL}" if REMBG_AVAILABLE else "local/fallback"
+
+REPLICATE_MODEL_INFO = {
+    "model": "851-labs/background-remover",
+    "version": "a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc",
+    "description": "AI-powered background removal with high accuracy",
+    "output_format": "PNG with transparency"
+}
+LOCAL_MODEL_INFO = {
+    "model": f"rembg/{DEFAULT_MODEL}" if REMBG_AVAILABLE else "colour-based fallback remover",
+    "description": "Background removal on this server, used while Replicate is unavailable",
+    "output_format": "PNG with transparency"
+}
+
+def model_info(backend: Optional[str]) -> dict:
+    return LOCAL_MODEL_INFO if backend == BACKEND_LOCAL else REPLICATE_MODEL_INFO
 
 @router.post("/remove-bg", response_model=RemoveBgResponse)
-async def remove_background(request: RemoveBgRequest, background_tasks: BackgroundTasks):
+async def remove_background(request: RemoveBgRequest):
     """
     Remove background from an image using Replicate's background removal model
     """
     try:
         # Generate unique task ID
         task_id = str(uuid.uuid4())
+        dedupe_key = single_flight.make_key(BG_REMOVAL_MODEL, {"image": str(request.image_url)})
         
         # Initialize task status
-        bg_removal_tasks[task_id] = {
+        task = await task_store.acreate(TASK_KIND, task_id, {
             "status": "processing",
+            "dedupe_key": dedupe_key,
             "original_url": str(request.image_url),
             "created_at": datetime.now().isoformat(),
             "processed_url": None,
             "error": None
-        }
+        })
         
-        # Start background processing
-        background_tasks.add_task(
-            process_background_removal, 
-            task_id, 
-            str(request.image_url)
-        )
+        if not await task_store.run(single_flight.join, dedupe_key, TASK_KIND, task_id):
+            # An identical job is already running, its result completes this task too
+            logger.info(f"Attached background removal task {task_id} to an identical running job")
+        else:
+            # Queue the job with the shared scheduler; it checks the result cache first
+            job_scheduler.submit(
+                TASK_KIND, task_id, BG_REMOVAL_MODEL,
+                partial(process_background_removal, task_id, str(request.image_url),
+                        webhook=replicate_webhooks.webhooks_enabled()),
+                on_success=cache_replicate_output
+            )
         
         logger.info(f"Started background removal task {task_id} for image: {request.image_url}")
         
@@ -60,7 +110,7 @@ async def remove_background(request: RemoveBgRequest, background_tasks: Backgrou
             status="processing",
             message="Background removal started. Use /remove-bg/status/{task_id} to check progress.",
             original_url=str(request.image_url),
-            created_at=bg_removal_tasks[task_id]["created_at"]
+            created_at=task["created_at"]
         )
         
     except Exception as e:
@@ -68,15 +118,28 @@ async def remove_background(request: RemoveBgRequest, background_tasks: Backgrou
         raise HTTPException(status_code=500, detail=f"Failed to start background removal task: {str(e)}")
 
 @router.get("/remove-bg/status/{task_id}", response_model=RemoveBgResponse)
-async def get_bg_removal_status(task_id: str):
+async def get_bg_removal_status(
+    task_id: str,
+    wait: Optional[float] = Query(None, ge=0, description="Seconds to wait for a status change (long-poll)"),
+    since: Optional[str] = Query(None, description="Status the client last saw, defaults to the current one"),
+):
     """
     Get the status of a background removal task
+    With ?wait=N the request is held until the status changes or N seconds
+    pass (capped server side). /tasks/{task_id}/events streams the same changes.
     """
-    if task_id not in bg_removal_tasks:
+    task = await task_store.aget(TASK_KIND, task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = bg_removal_tasks[task_id]
+    task = await replicate_webhooks.reconcile(TASK_KIND, task_id, task)
+    if wait:
+        task = await task_events.wait_for_status(TASK_KIND, task_id, task, since, wait)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
     
+    # Webhook completions don't record a backend, they only come from Replicate
+    backend = task.get("backend") or (BACKEND_REPLICATE if task["status"] == "completed" else None)
     return RemoveBgResponse(
         task_id=task_id,
         status=task["status"],
@@ -84,12 +147,8 @@ async def get_bg_removal_status(task_id: str):
         processed_url=task.get("processed_url"),
         original_url=task["original_url"],
         created_at=task["created_at"],
-        replicate_model_info={
-            "model": "851-labs/background-remover",
-            "version": "a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc",
-            "description": "AI-powered background removal with high accuracy",
-            "output_format": "PNG with transparency"
-        }
+        backend=backend,
+        replicate_model_info=model_info(backend)
     )
 
 @router.post("/remove-bg/sync", response_model=RemoveBgResponse)
@@ -103,8 +162,25 @@ async def remove_background_sync(request: RemoveBgRequest):
         
         logger.info(f"Starting synchronous background removal for image: {request.image_url}")
         
-        # Process background removal synchronously
-        result = await run_bg_removal_sync(str(request.image_url))
+        # Runs through the scheduler like async jobs, ahead of them in the queue
+        await task_store.acreate(TASK_KIND, task_id, {
+            "status": "processing",
+            "original_url": str(request.image_url),
+            "created_at": datetime.now().isoformat(),
+            "processed_url": None,
+            "error": None
+        })
+        task = await job_scheduler.run(
+            TASK_KIND, task_id, BG_REMOVAL_MODEL,
+            partial(process_background_removal, task_id, str(request.image_url)),
+            priority=PRIORITY_HIGH,
+            on_success=cache_replicate_output
+        )
+        result = {
+            "processed_url": task["processed_url"],
+            "processing_time": 0.0 if task.get("cached") else None,
+            "backend": task.get("backend")
+        }
         
         return RemoveBgResponse(
             task_id=task_id,
@@ -114,50 +190,124 @@ async def remove_background_sync(request: RemoveBgRequest):
             original_url=str(request.image_url),
             created_at=datetime.now().isoformat(),
             processing_time=result.get("processing_time"),
+            backend=result["backend"],
             replicate_model_info={
-                "model": "851-labs/background-remover",
-                "version": "a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc",
-                "description": "AI-powered background removal with high accuracy",
-                "output_format": "PNG with transparency",
+                **model_info(result["backend"]),
                 "suitable_for": ["Product photos", "Portraits", "eCommerce", "Social media"]
             }
         )
         
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="Background removal was cancelled")
     except Exception as e:
         logger.error(f"Error in sync background removal: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Background removal failed: {str(e)}")
 
-async def process_background_removal(task_id: str, image_url: str):
+async def start_webhook_task(task_id: str, image_url: str, breaker_trial: bool = False):
+    """
+    Create the prediction with a completion webhook instead of polling it
+    """
+    await replicate_webhooks.start_prediction(
+        BG_REMOVAL_MODEL, {"image": image_url}, TASK_KIND, task_id, "processed_url", breaker_trial=breaker_trial
+    )
+
+async def process_background_removal(task_id: str, image_url: str, webhook: bool = False) -> Optional[dict]:
+    """
+    Scheduler job for a background removal task, returns the fields that complete it
+
+    Served from the result cache when the same image was done before. With
+    webhook, a Replicate prediction is created and the webhook completes the
+    task (returns None).
+    """
+    logger.info(f"Processing background removal task {task_id}")
+    
+    cache_key = await result_cache.input_key(BG_REMOVAL_MODEL, image_url)
+    cached_url = await result_cache.lookup(cache_key)
+    if cached_url:
+        # Same model and image as an earlier job, no Replicate call needed
+        logger.info(f"Served background removal task {task_id} from the result cache")
+        return {"processed_url": cached_url, "backend": BACKEND_REPLICATE, "cached": True}
+    
+    if webhook:
+        await task_store.aupdate(TASK_KIND, task_id, cache_key=cache_key)
+    
+    # Run on Replicate, or locally while it is unavailable
+    result = await run_bg_removal(image_url, webhook_task_id=task_id if webhook else None)
+    if result is None:
+        # Replicate calls /replicate/webhook when done, nothing waits in this worker
+        return None
+    
+    logger.info(f"Completed background removal task {task_id} ({result['backend']})")
+    return {"processed_url": result["processed_url"], "backend": result["backend"], "cache_key": cache_key}
+
+async def cache_replicate_output(fields: dict):
+    """
+    Keep Replicate outputs in the result cache (local outputs are cached under their own key)
+    """
+    if fields.get("backend") == BACKEND_REPLICATE and not fields.get("cached"):
+        await result_cache.store(fields.get("cache_key"), fields["processed_url"])
+
+async def run_bg_removal(image_url: str, webhook_task_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Remove the background on Replicate unless its circuit breaker is open
+
+    Replicate's errors and latency feed the breaker. When the circuit is open
+    or the call fails, the local engine serves the request instead. With
+    webhook_task_id the prediction is only created for that task and None is
+    returned; the webhook records how it went.
+    """
+    if replicate_bg_removal_breaker.allow():
+        trial = replicate_bg_removal_breaker.state == HALF_OPEN
+        started = time.monotonic()
+        try:
+            if webhook_task_id is not None:
+                # A trial stays held until the webhook reports the outcome
+                await start_webhook_task(webhook_task_id, image_url, breaker_trial=trial)
+                return None
+            result = await run_bg_removal_sync(image_url, timeout=BG_REMOVAL_REPLICATE_TIMEOUT)
+        except asyncio.CancelledError:
+            replicate_bg_removal_breaker.release(trial)
+            raise
+        except Exception as e:
+            replicate_bg_removal_breaker.record(time.monotonic() - started, e, trial)
+            if not BG_REMOVAL_LOCAL_FALLBACK:
+                raise
+            logger.warning(f"Replicate background removal failed, using the local engine: {str(e)}")
+        else:
+            replicate_bg_removal_breaker.record(time.monotonic() - started, trial=trial)
+            return {**result, "backend": BACKEND_REPLICATE}
+    elif not BG_REMOVAL_LOCAL_FALLBACK:
+        raise Exception("Background removal failed: Replicate is unavailable (circuit open)")
+    
+    return await run_bg_removal_local(image_url)
+
+async def run_bg_removal_local(image_url: str) -> dict:
     """
-    Background task to process background removal
+    Remove the background on this server with rembg, served from the result cache directory
     """
     try:
-        logger.info(f"Processing background removal task {task_id}")
-        
-        # Update status to processing
-        bg_removal_tasks[task_id]["status"] = "processing"
-        
-        # Run Replicate background removal
-        result = await run_bg_removal_sync(image_url)
+        image_data = await input_fetcher.fetch(image_url)
+        cache_key = result_cache.content_key(LOCAL_MODEL_REF, image_data)
+        processed_url = await result_cache.lookup(cache_key)
+        if processed_url is None:
+            png_data = await run_cutout_bytes(image_data)
+            processed_url = await result_cache.store_bytes(cache_key, png_data, ".png", image_url)
+        if processed_url is None:
+            raise Exception("local output needs the result cache (RESULT_CACHE_DISK_MB > 0) to be served")
         
-        # Update task with results
-        bg_removal_tasks[task_id].update({
-            "status": "completed",
-            "processed_url": result["processed_url"],
-            "completed_at": datetime.now().isoformat()
-        })
+        logger.info(f"Local background removal completed. Result URL: {processed_url}")
         
-        logger.info(f"Completed background removal task {task_id}")
+        return {
+            "processed_url": processed_url,
+            "original_url": image_url,
+            "backend": BACKEND_LOCAL
+        }
         
     except Exception as e:
-        logger.error(f"Error processing background removal task {task_id}: {str(e)}")
-        bg_removal_tasks[task_id].update({
-            "status": "failed",
-            "error": str(e),
-            "completed_at": datetime.now().isoformat()
-        })
+        logger.error(f"Local background removal error: {str(e)}")
+        raise Exception(f"Background removal failed: {str(e)}") from e
 
-async def run_bg_removal_sync(image_url: str):
+async def run_bg_removal_sync(image_url: str, timeout: Optional[float] = None):
     """
     Run the actual background removal using Replicate
     """
@@ -169,30 +319,12 @@ async def run_bg_removal_sync(image_url: str):
         
         logger.info(f"Running Replicate background removal with input: {input_data}")
         
-        # Set Replicate API token from environment
-        api_token = os.getenv("REPLICATE_API_TOKEN")
-        if not api_token:
-            raise Exception("REPLICATE_API_TOKEN environment variable not configured")
-        
-        replicate.api_token = api_token
-        logger.info(f"Replicate token configured: {api_token[:8]}...")
-        
-        # Run the background removal model
-        output = replicate.run(
-            "851-labs/background-remover:a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc",
-            input=input_data
-        )
+        # Run the background removal model (polled without blocking the event loop)
+        output = await replicate_client.run(BG_REMOVAL_MODEL, input=input_data, timeout=timeout)
         logger.info(f"Replicate API call completed successfully")
         
         # Extract the URL from the output
-        if hasattr(output, 'url'):
-            processed_url = output.url()
-        elif isinstance(output, str):
-            processed_url = output
-        elif isinstance(output, list) and len(output) > 0:
-            processed_url = output[0] if isinstance(output[0], str) else output[0].url()
-        else:
-            raise ValueError(f"Unexpected output format from Replicate: {type(output)}")
+        processed_url = output_url(output)
         
         logger.info(f"Background removal completed. Result URL: {processed_url}")
         
@@ -203,7 +335,7 @@ async def run_bg_removal_sync(image_url: str):
         
     except Exception as e:
         logger.error(f"Replicate background removal error: {str(e)}")
-        raise Exception(f"Background removal failed: {str(e)}")
+        raise Exception(f"Background removal failed: {str(e)}") from e
 
 def get_status_message(status: str, error: Optional[str] = None) -> str:
     """
@@ -226,7 +358,8 @@ async def debug_bg_removal_config():
             "replicate_token_configured": bool(os.getenv("REPLICATE_API_TOKEN")),
             "replicate_token_prefix": os.getenv("REPLICATE_API_TOKEN", "")[:8] + "..." if os.getenv("REPLICATE_API_TOKEN") else "Not set",
             "environment": os.getenv("ENVIRONMENT", "unknown"),
-            "bg_removal_tasks_count": len(bg_removal_tasks),
+            "bg_removal_tasks_count": await task_store.acount(TASK_KIND),
+            "task_store": await task_store.aget_stats(),
             "model": "851-labs/background-remover",
             "version": "a029dff38972b5fda4ec5d75d7d1cd25aeff621d2cf4946a41055d7db66b80bc"
         }
@@ -235,13 +368,25 @@ async def debug_bg_removal_config():
         return {"error": str(e)}
 
 @router.get("/remove-bg/tasks")
-async def list_bg_removal_tasks():
+async def list_bg_removal_tasks(
+    status: Optional[str] = Query(None, description="Only tasks with this status"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
     """
-    List all background removal tasks (for debugging/monitoring)
+    List background removal tasks, newest first (for debugging/monitoring)
+    Paginated: pass next_cursor back as ?cursor= until it is null
     """
+    try:
+        tasks, next_cursor = await task_store.alist_page(TASK_KIND, status=status, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     return {
-        "total_tasks": len(bg_removal_tasks),
-        "tasks": bg_removal_tasks
+        "total_tasks": await task_store.acount(TASK_KIND),
+        "counts": await task_store.acounts(TASK_KIND),
+        "tasks": tasks,
+        "next_cursor": next_cursor
     }
 
 @router.delete("/remove-bg/tasks/{task_id}")
@@ -249,46 +394,30 @@ async def delete_bg_removal_task(task_id: str):
     """
     Delete a completed background removal task
     """
-    if task_id not in bg_removal_tasks:
+    if not await task_store.adelete(TASK_KIND, task_id):
         raise HTTPException(status_code=404, detail="Task not found")
     
-    del bg_removal_tasks[task_id]
     return {"message": f"Task {task_id} deleted successfully"}
 
-from fastapi.responses import StreamingResponse
-import io
-
 @router.get("/remove-bg/download/{task_id}")
-async def download_processed_image(task_id: str):
+async def download_processed_image(task_id: str, request: Request):
     """
     Download the processed image with proper headers
+    Streams from the output URL (or the local cache) and supports Range and If-None-Match
     """
     try:
-        if task_id not in bg_removal_tasks:
+        task = await task_store.aget(TASK_KIND, task_id)
+        if task is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        task = bg_removal_tasks[task_id]
         if task["status"] != "completed" or not task.get("processed_url"):
             raise HTTPException(status_code=400, detail="Processed image not available")
         
-        # Fetch the image
-        response = requests.get(task["processed_url"])
-        response.raise_for_status()
-        
         # Generate filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"kraftey_bg_removed_{timestamp}.png"
         
-        # Return as streaming response with download headers
-        return StreamingResponse(
-            io.BytesIO(response.content),
-            media_type="image/png",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Length": str(len(response.content)),
-                "Cache-Control": "no-cache"
-            }
-        )
+        # Stream to the client in chunks without buffering the image
+        return await download_proxy.response(task["processed_url"], request, filename, "image/png")
         
     except HTTPException:
         raise
@@ -302,10 +431,9 @@ async def get_comparison_data(task_id: str):
     Get comparison data for before/after display
     """
     try:
-        if task_id not in bg_removal_tasks:
+        task = await task_store.aget(TASK_KIND, task_id)
+        if task is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        task = bg_removal_tasks[task_id]
         if task["status"] != "completed":
             raise HTTPException(status_code=400, detail="Background removal not completed")
         
@@ -342,14 +470,19 @@ async def bg_removal_health_check():
         # Check if Replicate API token is available
         has_token = bool(os.getenv("REPLICATE_API_TOKEN"))
         
+        circuit = replicate_bg_removal_breaker.get_stats()
+        
         return {
-            "status": "healthy" if has_token else "warning",
+            "status": "healthy" if has_token and circuit["state"] == CLOSED else "warning",
             "service": "background-removal",
             "replicate_configured": has_token,
-            "active_tasks": len([t for t in bg_removal_tasks.values() if t["status"] == "processing"]),
-            "total_tasks": len(bg_removal_tasks),
+            "active_tasks": await task_store.acount(TASK_KIND, "processing"),
+            "total_tasks": await task_store.acount(TASK_KIND),
             "message": "Background removal service is ready" if has_token else "REPLICATE_API_TOKEN not configured",
-            "model": "851-labs/background-remover"
+            "model": "851-labs/background-remover",
+            "circuit": circuit,
+            "local_fallback": BG_REMOVAL_LOCAL_FALLBACK,
+            "local_model": LOCAL_MODEL_INFO["model"]
         }
         
     except Exception as e:
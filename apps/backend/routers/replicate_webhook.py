@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Request
+import json
+import logging
+from services.replicate_webhooks import verify_signature, complete_prediction, WebhookVerificationError, WEBHOOK_PATH
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.post(WEBHOOK_PATH)
+async def replicate_webhook(request: Request):
+    """
+    Completion callback for predictions created with a webhook
+    Verifies the signature, then completes the task linked to the prediction.
+    """
+    body = await request.body()
+    
+    try:
+        verify_signature(request.headers, body)
+    except WebhookVerificationError as e:
+        logger.warning(f"Rejected Replicate webhook: {str(e)}")
+        raise HTTPException(status_code=401, detail=str(e))
+    
+    try:
+        prediction = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    task = await complete_prediction(prediction)
+    
+    # Always 200 for verified calls, so Replicate doesn't retry unknown or duplicate deliveries
+    return {"received": True, "task_updated": task is not None}
@@ -0,0 +1,114 @@
+from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional, Tuple
+import json
+import time
+from services.task_store import task_store
+from services.task_events import task_events, TERMINAL_STATUSES, TASK_EVENTS_MAX_SECONDS, TASK_EVENTS_KEEPALIVE_SECONDS
+from services import replicate_webhooks
+from services.job_scheduler import job_scheduler
+
+router = APIRouter()
+
+# Task kinds served by /tasks/{task_id} (status, cancel and events)
+TASK_KINDS = ("bg_removal", "upscale", "watermark_removal")
+
+async def find_task(task_id: str) -> Tuple[Optional[str], Optional[dict]]:
+    """Look a task id up across the job kinds (ids are UUIDs, so at most one matches)"""
+    for kind in TASK_KINDS:
+        task = await task_store.aget(kind, task_id)
+        if task is not None:
+            return kind, task
+    return None, None
+
+def format_event(event: str, data: dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/tasks/{task_id}")
+async def get_task(
+    task_id: str,
+    wait: Optional[float] = Query(None, ge=0, description="Seconds to wait for a status change (long-poll)"),
+):
+    """
+    Status of any job task (upscale, background removal, watermark removal)
+    """
+    kind, task = await find_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    task = await replicate_webhooks.reconcile(kind, task_id, task)
+    if wait:
+        task = await task_events.wait_for_status(kind, task_id, task, None, wait)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+    return {"task_id": task_id, "kind": kind, **task}
+
+@router.post("/tasks/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """
+    Cancel a queued or running task
+    Stops its Replicate prediction unless an identical request is sharing it.
+    """
+    kind, task = await find_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    cancelled = await job_scheduler.cancel(kind, task_id)
+    if cancelled is None:
+        current = await task_store.aget(kind, task_id) or {}
+        raise HTTPException(status_code=409, detail=f"Task already {current.get('status', 'finished')}")
+    return {"task_id": task_id, "kind": kind, **cancelled}
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request):
+    """
+    Server-Sent Events stream of a task's status
+    Sends the current state, then one "status" event per status change, and
+    closes once the task is completed or failed. Replaces polling the status routes.
+    """
+    kind, task = await find_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return StreamingResponse(
+        task_event_stream(kind, task_id, task, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def task_event_stream(kind: str, task_id: str, task: dict, request: Request):
+    """
+    Yield SSE frames for a task until it finishes, the client leaves or the stream times out
+    """
+    started = time.monotonic()
+    event_id = 0
+
+    # Tell EventSource how long to wait before reconnecting
+    yield "retry: 3000\n\n"
+
+    while True:
+        event_id += 1
+        yield format_event("status", {"task_id": task_id, "kind": kind, **task}, event_id)
+        if task.get("status") in TERMINAL_STATUSES:
+            return
+
+        # Wait for the next status change, sending comments to keep proxies from closing the stream
+        while True:
+            if await request.is_disconnected():
+                return
+            if time.monotonic() - started >= TASK_EVENTS_MAX_SECONDS:
+                yield format_event("timeout", {"task_id": task_id}, event_id + 1)
+                return
+
+            current = await task_events.wait_for_change(kind, task_id, task, TASK_EVENTS_KEEPALIVE_SECONDS)
+            if current is None:
+                yield format_event("deleted", {"task_id": task_id}, event_id + 1)
+                return
+
+            current = await replicate_webhooks.reconcile(kind, task_id, current)
+            if current.get("status") != task.get("status"):
+                task = current
+                break
+            if current == task:
+                yield ": keep-alive\n\n"
+            task = current
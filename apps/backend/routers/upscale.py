@@ -1,13 +1,27 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, HttpUrl
-import replicate
-import requests
 import os
+import asyncio
 import logging
-from typing import Optional
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+from urllib.parse import quote, urlparse
 import tempfile
 import uuid
+from functools import partial
 from datetime import datetime
+from services.task_store import task_store
+from services.replicate_client import replicate_client, output_url
+from services import replicate_webhooks, single_flight
+from services.task_events import task_events
+from services.result_cache import result_cache, SERVER_BASE_URL
+from services.input_fetch import input_fetcher
+from services.download_proxy import download_proxy
+from services.job_scheduler import job_scheduler, JobCancelled, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from services.inference_executor import inference_executor
+from services import local_upscaler
+from services.zip_stream import stream_zip
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +30,7 @@ router = APIRouter()
 class UpscaleRequest(BaseModel):
     image_url: HttpUrl
     scale_factor: Optional[int] = 4  # Default 4x upscale
+    engine: Optional[str] = None  # "replicate" (default), "local", or "auto" (local if Replicate fails)
     
 class UpscaleResponse(BaseModel):
     task_id: str
@@ -29,38 +44,113 @@ class UpscaleResponse(BaseModel):
     original_size: Optional[str] = None
     upscaled_size: Optional[str] = None
     enhancement_details: Optional[dict] = None
+    engine: Optional[str] = None
+
+class UpscaleBatchRequest(BaseModel):
+    image_urls: List[HttpUrl] = []
+    filenames: List[str] = []  # Files already in uploads/ (from /upload)
+    scale_factor: Optional[int] = 4
+    engine: Optional[str] = None
+
+# Task status lives in the shared task store so every worker can answer status polls
+TASK_KIND = "upscale"
+UPSCALE_MODEL = "recraft-ai/recraft-crisp-upscale"
+
+# Engines selectable per request; "auto" runs on Replicate and falls back to the local engine
+ENGINE_REPLICATE = "replicate"
+ENGINE_LOCAL = "local"
+ENGINE_AUTO = "auto"
+ENGINES = (ENGINE_REPLICATE, ENGINE_LOCAL, ENGINE_AUTO)
+UPSCALE_DEFAULT_ENGINE = os.getenv("UPSCALE_DEFAULT_ENGINE", ENGINE_REPLICATE)
+# Scheduler queue for local jobs, so they don't take Replicate's slots
+LOCAL_UPSCALE_MODEL = "local/tiled-lanczos"
+
+# Batches are records listing their items' task ids; items are ordinary upscale tasks
+BATCH_KIND = "upscale_batch"
+UPSCALE_BATCH_MAX_ITEMS = int(os.getenv("UPSCALE_BATCH_MAX_ITEMS", "200"))
+# Items started at once when a batch comes in (the scheduler limits how many run per model)
+UPSCALE_BATCH_START_CONCURRENCY = int(os.getenv("UPSCALE_BATCH_START_CONCURRENCY", "8"))
+UPSCALE_BATCH_TTL_SECONDS = int(os.getenv("UPSCALE_BATCH_TTL_SECONDS", str(24 * 3600)))
+UPLOAD_DIR = Path("uploads")
+
+# Background coroutines starting batch items, kept so they aren't garbage collected
+_batch_starters = set()
+
+def resolve_engine(engine: Optional[str], scale_factor: int) -> str:
+    """Check the requested engine and scale factor, raising 422 for unsupported ones"""
+    engine = engine or UPSCALE_DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise HTTPException(status_code=422, detail=f"Unknown engine: {engine}. Supported: {', '.join(ENGINES)}")
+    if engine == ENGINE_LOCAL and not 2 <= scale_factor <= local_upscaler.LOCAL_UPSCALE_MAX_SCALE:
+        raise HTTPException(
+            status_code=422,
+            detail=f"The local engine supports scale factors 2-{local_upscaler.LOCAL_UPSCALE_MAX_SCALE}"
+        )
+    return engine
 
-# In-memory storage for task status (in production, use Redis or database)
-upscale_tasks = {}
+def local_model_ref(scale_factor: int) -> str:
+    """Result cache and single-flight namespace for local outputs, by scale and settings"""
+    return single_flight.make_key(LOCAL_UPSCALE_MODEL, {"scale": scale_factor, **local_upscaler.get_options()})
+
+async def start_upscale_task(
+    task_id: str,
+    image_url: str,
+    scale_factor: int,
+    engine: str,
+    priority: int = PRIORITY_NORMAL,
+    batch_id: Optional[str] = None,
+) -> dict:
+    """
+    Create an upscale task and start it, returns the task
+
+    The task is attached to an identical running job if there is one, and
+    otherwise queued with the scheduler, whose job checks the result cache
+    before running the model (or, outside batches, starting it with a webhook).
+    """
+    model_ref = local_model_ref(scale_factor) if engine == ENGINE_LOCAL else UPSCALE_MODEL
+    dedupe_key = single_flight.make_key(model_ref, {"image": image_url, "engine": engine})
+    
+    # Initialize task status
+    task = await task_store.acreate(TASK_KIND, task_id, {
+        "status": "processing",
+        "batch_id": batch_id,
+        "dedupe_key": dedupe_key,
+        "original_url": image_url,
+        "scale_factor": scale_factor,
+        "created_at": datetime.now().isoformat(),
+        "upscaled_url": None,
+        "error": None
+    })
+    
+    if not await task_store.run(single_flight.join, dedupe_key, TASK_KIND, task_id):
+        # An identical job is already running, its result completes this task too
+        logger.info(f"Attached upscale task {task_id} to an identical running job")
+    else:
+        # Queue the job with the shared scheduler. Batch items never hand off to a webhook:
+        # they poll their prediction, so each holds a per-model slot until it finishes and
+        # a large batch can't have more predictions running than the model's concurrency.
+        webhook = engine == ENGINE_REPLICATE and replicate_webhooks.webhooks_enabled() and batch_id is None
+        job_scheduler.submit(
+            TASK_KIND, task_id, LOCAL_UPSCALE_MODEL if engine == ENGINE_LOCAL else UPSCALE_MODEL,
+            partial(process_upscale, task_id, image_url, scale_factor, engine, webhook=webhook),
+            priority=priority,
+            on_success=cache_replicate_output
+        )
+    
+    logger.info(f"Started upscale task {task_id} for image: {image_url}")
+    return task
 
 @router.post("/upscale", response_model=UpscaleResponse)
-async def upscale_image(request: UpscaleRequest, background_tasks: BackgroundTasks):
+async def upscale_image(request: UpscaleRequest):
     """
     Upscale an image using Replicate's Recraft AI upscaling model
+    engine: "replicate" (default), "local" (tiled Lanczos on this server, 2-4x), or "auto"
     """
+    engine = resolve_engine(request.engine, request.scale_factor)
     try:
         # Generate unique task ID
         task_id = str(uuid.uuid4())
-        
-        # Initialize task status
-        upscale_tasks[task_id] = {
-            "status": "processing",
-            "original_url": str(request.image_url),
-            "scale_factor": request.scale_factor,
-            "created_at": datetime.now().isoformat(),
-            "upscaled_url": None,
-            "error": None
-        }
-        
-        # Start background processing
-        background_tasks.add_task(
-            process_upscale, 
-            task_id, 
-            str(request.image_url), 
-            request.scale_factor
-        )
-        
-        logger.info(f"Started upscale task {task_id} for image: {request.image_url}")
+        task = await start_upscale_task(task_id, str(request.image_url), request.scale_factor, engine)
         
         return UpscaleResponse(
             task_id=task_id,
@@ -68,22 +158,242 @@ async def upscale_image(request: UpscaleRequest, background_tasks: BackgroundTas
             message="Image upscaling started. Use /upscale/status/{task_id} to check progress.",
             original_url=str(request.image_url),
             scale_factor=request.scale_factor,
-            created_at=upscale_tasks[task_id]["created_at"]
+            created_at=task["created_at"]
         )
         
     except Exception as e:
         logger.error(f"Error starting upscale task: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to start upscale task: {str(e)}")
 
+@router.post("/upscale/batch")
+async def upscale_batch(request: UpscaleBatchRequest):
+    """
+    Upscale many images at once, returns a batch id
+    Accepts image URLs and/or names of files already in uploads/ (from /upload).
+    Items are queued behind single requests and run under the per-model limits.
+    Track them with /upscale/batch/{batch_id} and fetch /upscale/batch/{batch_id}/download when done.
+    """
+    engine = resolve_engine(request.engine, request.scale_factor)
+    
+    image_urls = [str(url) for url in request.image_urls]
+    for filename in request.filenames:
+        # Only plain names inside the uploads directory
+        if Path(filename).name != filename or not (UPLOAD_DIR / filename).is_file():
+            raise HTTPException(status_code=400, detail=f"Invalid upload filename: {filename}")
+        # Replicate downloads this URL; the local engine and the result cache read the file from disk
+        image_urls.append(f"{SERVER_BASE_URL}/uploads/{quote(filename)}")
+    
+    if not image_urls:
+        raise HTTPException(status_code=400, detail="Provide at least one image URL or upload filename")
+    if len(image_urls) > UPSCALE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch size ({len(image_urls)}) exceeds maximum of {UPSCALE_BATCH_MAX_ITEMS} images")
+    
+    try:
+        batch_id = str(uuid.uuid4())
+        items = [{"task_id": str(uuid.uuid4()), "original_url": url} for url in image_urls]
+        batch = await task_store.acreate(BATCH_KIND, batch_id, {
+            "status": "processing",
+            "scale_factor": request.scale_factor,
+            "engine": engine,
+            "items": items,
+            "created_at": datetime.now().isoformat()
+        }, ttl=UPSCALE_BATCH_TTL_SECONDS)
+        
+        # Creating hundreds of tasks takes a while, don't make the client wait for it
+        starter = asyncio.ensure_future(start_batch_items(batch_id, items, request.scale_factor, engine))
+        _batch_starters.add(starter)
+        starter.add_done_callback(_batch_starters.discard)
+        
+        logger.info(f"Started upscale batch {batch_id} with {len(items)} images")
+        
+        return {
+            "batch_id": batch_id,
+            "status": "processing",
+            "total": len(items),
+            "message": "Batch upscaling started. Use /upscale/batch/{batch_id} to check progress.",
+            "created_at": batch["created_at"]
+        }
+        
+    except Exception as e:
+        logger.error(f"Error starting upscale batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to start upscale batch: {str(e)}")
+
+async def start_batch_items(batch_id: str, items: List[dict], scale_factor: int, engine: str):
+    """
+    Create and queue a task for every batch item, a few at a time
+    """
+    semaphore = asyncio.Semaphore(UPSCALE_BATCH_START_CONCURRENCY)
+    
+    async def start(item: dict):
+        async with semaphore:
+            try:
+                await start_upscale_task(
+                    item["task_id"], item["original_url"], scale_factor, engine,
+                    priority=PRIORITY_LOW, batch_id=batch_id
+                )
+            except Exception as e:
+                logger.error(f"Failed to start upscale task {item['task_id']} of batch {batch_id}: {str(e)}")
+                await task_store.acreate(TASK_KIND, item["task_id"], {
+                    "status": "failed",
+                    "batch_id": batch_id,
+                    "original_url": item["original_url"],
+                    "scale_factor": scale_factor,
+                    "created_at": datetime.now().isoformat(),
+                    "completed_at": datetime.now().isoformat(),
+                    "upscaled_url": None,
+                    "error": str(e)
+                })
+    
+    await asyncio.gather(*(start(item) for item in items))
+
+async def get_batch_tasks(batch_id: str):
+    """
+    Load a batch and its items' tasks (None for items not started yet), 404 if unknown
+    """
+    batch = await task_store.aget(BATCH_KIND, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    task_ids = [item["task_id"] for item in batch["items"]]
+    found = await task_store.aget_many(TASK_KIND, task_ids)
+    # Only unfinished tasks can need a check with Replicate
+    processing = [task_id for task_id, task in found.items() if task["status"] == "processing"]
+    reconciled = await asyncio.gather(
+        *(replicate_webhooks.reconcile(TASK_KIND, task_id, found[task_id]) for task_id in processing)
+    )
+    found.update(zip(processing, reconciled))
+    return batch, [found.get(task_id) for task_id in task_ids]
+
+def batch_counts(tasks: List[Optional[dict]]) -> dict:
+    counts = {"pending": 0, "processing": 0, "completed": 0, "failed": 0, "cancelled": 0}
+    for task in tasks:
+        status = task["status"] if task is not None else "pending"
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+@router.get("/upscale/batch/{batch_id}")
+async def get_upscale_batch(
+    batch_id: str,
+    include_items: bool = Query(True, description="List every item's status and URL"),
+):
+    """
+    Get the aggregate progress of an upscale batch
+    status is "processing" until every item has finished, then "completed",
+    "completed_with_errors" or "failed".
+    """
+    batch, tasks = await get_batch_tasks(batch_id)
+    
+    counts = batch_counts(tasks)
+    total = len(tasks)
+    finished = counts["completed"] + counts["failed"] + counts["cancelled"]
+    if finished < total:
+        status = "processing"
+    elif counts["completed"] == total:
+        status = "completed"
+    else:
+        status = "completed_with_errors" if counts["completed"] else "failed"
+    
+    response = {
+        "batch_id": batch_id,
+        "status": status,
+        "total": total,
+        "counts": counts,
+        "progress": round(finished / total, 3) if total else 1.0,
+        "scale_factor": batch["scale_factor"],
+        "engine": batch["engine"],
+        "created_at": batch["created_at"],
+        "download_url": f"/upscale/batch/{batch_id}/download" if counts["completed"] else None
+    }
+    if include_items:
+        response["items"] = [
+            {
+                "task_id": item["task_id"],
+                "original_url": item["original_url"],
+                "status": task["status"] if task is not None else "pending",
+                "upscaled_url": task.get("upscaled_url") if task is not None else None,
+                "error": task.get("error") if task is not None else None
+            }
+            for item, task in zip(batch["items"], tasks)
+        ]
+    return response
+
+@router.get("/upscale/batch/{batch_id}/download")
+async def download_upscale_batch(
+    batch_id: str,
+    partial_results: bool = Query(False, alias="partial", description="Download finished items without waiting for the rest"),
+):
+    """
+    Download every upscaled image of a batch as one ZIP, streamed as it is built
+    Items that failed are listed in errors.txt inside the archive.
+    """
+    batch, tasks = await get_batch_tasks(batch_id)
+    
+    counts = batch_counts(tasks)
+    if (counts["pending"] or counts["processing"]) and not partial_results:
+        finished = len(tasks) - counts["pending"] - counts["processing"]
+        raise HTTPException(
+            status_code=409,
+            detail=f"Batch is still processing ({finished}/{len(tasks)} done), retry later or pass ?partial=true"
+        )
+    if not counts["completed"]:
+        raise HTTPException(status_code=400, detail="No upscaled images available in this batch")
+    
+    filename = f"kraftey_upscaled_batch_{batch_id[:8]}.zip"
+    return StreamingResponse(
+        stream_zip(batch_zip_entries(batch["items"], tasks)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}", "Cache-Control": "no-cache"}
+    )
+
+async def batch_zip_entries(items: List[dict], tasks: List[Optional[dict]]):
+    """
+    ZIP entries for a batch's finished outputs, numbered in submission order
+    """
+    errors = []
+    for index, (item, task) in enumerate(zip(items, tasks), 1):
+        if task is None or task["status"] != "completed" or not task.get("upscaled_url"):
+            if task is not None and task["status"] in ("failed", "cancelled"):
+                errors.append(f"{index:03d} {item['original_url']}: {task.get('error') or task['status']}")
+            continue
+        
+        try:
+            chunks, size = await download_proxy.open_stream(task["upscaled_url"])
+        except Exception as e:
+            logger.warning(f"Failed to fetch {task['upscaled_url']} for the batch ZIP: {str(e)}")
+            errors.append(f"{index:03d} {item['original_url']}: download failed: {str(e)}")
+            continue
+        
+        stem = Path(urlparse(item["original_url"]).path).stem or "image"
+        extension = Path(urlparse(task["upscaled_url"]).path).suffix or ".webp"
+        yield f"{index:03d}_{stem}_{task.get('scale_factor', 4)}x{extension}", chunks, size
+    
+    if errors:
+        report = ("\n".join(errors) + "\n").encode()
+        yield "errors.txt", single_chunk(report), len(report)
+
+async def single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
 @router.get("/upscale/status/{task_id}", response_model=UpscaleResponse)
-async def get_upscale_status(task_id: str):
+async def get_upscale_status(
+    task_id: str,
+    wait: Optional[float] = Query(None, ge=0, description="Seconds to wait for a status change (long-poll)"),
+    since: Optional[str] = Query(None, description="Status the client last saw, defaults to the current one"),
+):
     """
     Get the status of an upscale task
+    With ?wait=N the request is held until the status changes or N seconds
+    pass (capped server side). /tasks/{task_id}/events streams the same changes.
     """
-    if task_id not in upscale_tasks:
+    task = await task_store.aget(TASK_KIND, task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = upscale_tasks[task_id]
+    task = await replicate_webhooks.reconcile(TASK_KIND, task_id, task)
+    if wait:
+        task = await task_events.wait_for_status(TASK_KIND, task_id, task, since, wait)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
     
     return UpscaleResponse(
         task_id=task_id,
@@ -92,7 +402,10 @@ async def get_upscale_status(task_id: str):
         upscaled_url=task.get("upscaled_url"),
         original_url=task["original_url"],
         scale_factor=task["scale_factor"],
-        created_at=task["created_at"]
+        created_at=task["created_at"],
+        original_size=task.get("original_size"),
+        upscaled_size=task.get("upscaled_size"),
+        engine=task.get("engine") or (ENGINE_REPLICATE if task["status"] == "completed" else None)
     )
 
 @router.post("/upscale/sync", response_model=UpscaleResponse)
@@ -100,14 +413,31 @@ async def upscale_image_sync(request: UpscaleRequest):
     """
     Upscale an image synchronously (blocking request)
     Use this for smaller images or when you need immediate results
+    engine: "replicate" (default), "local" (e.g. fast 2x previews) or "auto"
     """
+    engine = resolve_engine(request.engine, request.scale_factor)
     try:
         task_id = str(uuid.uuid4())
         
         logger.info(f"Starting synchronous upscale for image: {request.image_url}")
         
-        # Process upscale synchronously
-        result = await run_upscale_sync(str(request.image_url), request.scale_factor)
+        # Runs through the scheduler like async jobs, ahead of them in the queue
+        await task_store.acreate(TASK_KIND, task_id, {
+            "status": "processing",
+            "original_url": str(request.image_url),
+            "scale_factor": request.scale_factor,
+            "created_at": datetime.now().isoformat(),
+            "upscaled_url": None,
+            "error": None
+        })
+        result = await job_scheduler.run(
+            TASK_KIND, task_id, LOCAL_UPSCALE_MODEL if engine == ENGINE_LOCAL else UPSCALE_MODEL,
+            partial(process_upscale, task_id, str(request.image_url), request.scale_factor, engine),
+            priority=PRIORITY_HIGH,
+            on_success=cache_replicate_output
+        )
+        if result.get("cached"):
+            result["processing_time"] = 0.0
         
         return UpscaleResponse(
             task_id=task_id,
@@ -118,7 +448,10 @@ async def upscale_image_sync(request: UpscaleRequest):
             scale_factor=request.scale_factor,
             created_at=datetime.now().isoformat(),
             processing_time=result.get("processing_time"),
-            enhancement_details={
+            original_size=result.get("original_size"),
+            upscaled_size=result.get("upscaled_size"),
+            engine=result.get("engine"),
+            enhancement_details=LOCAL_ENHANCEMENT_DETAILS if result.get("engine") == ENGINE_LOCAL else {
                 "model": "recraft-ai/recraft-crisp-upscale",
                 "resolution_increase": f"{request.scale_factor}x",
                 "quality_enhancement": "AI-powered detail enhancement",
@@ -127,39 +460,109 @@ async def upscale_image_sync(request: UpscaleRequest):
             }
         )
         
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="Upscale was cancelled")
     except Exception as e:
         logger.error(f"Error in sync upscale: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upscale failed: {str(e)}")
 
-async def process_upscale(task_id: str, image_url: str, scale_factor: int):
+async def start_webhook_task(task_id: str, image_url: str):
     """
-    Background task to process image upscaling
+    Create the prediction with a completion webhook instead of polling it
     """
+    await replicate_webhooks.start_prediction(
+        UPSCALE_MODEL, {"image": image_url}, TASK_KIND, task_id, "upscaled_url"
+    )
+
+async def process_upscale(
+    task_id: str,
+    image_url: str,
+    scale_factor: int,
+    engine: str = ENGINE_REPLICATE,
+    webhook: bool = False,
+) -> Optional[dict]:
+    """
+    Scheduler job for a upscale task, returns the fields that complete it
+
+    Served from the result cache when the same image was done before. With
+    webhook, a Replicate prediction is created and the webhook completes the
+    task (returns None).
+    """
+    logger.info(f"Processing upscale task {task_id} ({engine})")
+    
+    if engine == ENGINE_LOCAL:
+        return await run_upscale_local(image_url, scale_factor)
+    
+    cache_key = await result_cache.input_key(UPSCALE_MODEL, image_url)
+    cached_url = await result_cache.lookup(cache_key)
+    if cached_url:
+        # Same model and image as an earlier job, no Replicate call needed
+        logger.info(f"Served upscale task {task_id} from the result cache")
+        return {"upscaled_url": cached_url, "engine": ENGINE_REPLICATE, "cached": True}
+    
+    if webhook:
+        # Replicate calls /replicate/webhook when done, nothing waits in this worker
+        await task_store.aupdate(TASK_KIND, task_id, cache_key=cache_key)
+        await start_webhook_task(task_id, image_url)
+        return None
+    
+    # Run on Replicate
     try:
-        logger.info(f"Processing upscale task {task_id}")
-        
-        # Update status to processing
-        upscale_tasks[task_id]["status"] = "processing"
-        
-        # Run Replicate upscale
         result = await run_upscale_sync(image_url, scale_factor)
+    except Exception as e:
+        if engine != ENGINE_AUTO:
+            raise
+        logger.warning(f"Replicate upscale failed for task {task_id}, using the local engine: {str(e)}")
+        return await run_upscale_local(image_url, scale_factor)
+    
+    logger.info(f"Completed upscale task {task_id}")
+    return {"upscaled_url": result["upscaled_url"], "engine": ENGINE_REPLICATE, "cache_key": cache_key}
+
+async def cache_replicate_output(fields: dict):
+    """
+    Keep Replicate outputs in the result cache (local outputs are stored there as they are made)
+    """
+    if fields.get("engine") == ENGINE_REPLICATE and not fields.get("cached"):
+        await result_cache.store(fields.get("cache_key"), fields["upscaled_url"])
+
+async def run_upscale_local(image_url: str, scale_factor: int) -> dict:
+    """
+    Upscale on this server with the tiled Lanczos engine, returns the fields that complete the task
+
+    The output is written straight into the result cache directory and served from /uploads.
+    """
+    scale_factor = min(max(scale_factor, 2), local_upscaler.LOCAL_UPSCALE_MAX_SCALE)
+    try:
+        image_data = await input_fetcher.fetch(image_url)
+        cache_key = result_cache.content_key(local_model_ref(scale_factor), image_data)
+        cached_url = await result_cache.lookup(cache_key)
+        if cached_url:
+            return {"upscaled_url": cached_url, "engine": ENGINE_LOCAL, "scale_factor": scale_factor, "cached": True}
+        tmp_path = result_cache.temp_path(".png")
+        try:
+            original_size, upscaled_size = await inference_executor.run(
+                local_upscaler.upscale_bytes, image_data, str(tmp_path), scale_factor
+            )
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        upscaled_url = await result_cache.store_file(cache_key, tmp_path, ".png", image_url)
+        if upscaled_url is None:
+            raise Exception("local output needs the result cache (RESULT_CACHE_DISK_MB > 0) to be served")
+        
+        logger.info(f"Local upscale completed. Result URL: {upscaled_url}")
         
-        # Update task with results
-        upscale_tasks[task_id].update({
-            "status": "completed",
-            "upscaled_url": result["upscaled_url"],
-            "completed_at": datetime.now().isoformat()
-        })
-        
-        logger.info(f"Completed upscale task {task_id}")
+        return {
+            "upscaled_url": upscaled_url,
+            "engine": ENGINE_LOCAL,
+            "scale_factor": scale_factor,
+            "original_size": f"{original_size[0]}x{original_size[1]}",
+            "upscaled_size": f"{upscaled_size[0]}x{upscaled_size[1]}"
+        }
         
     except Exception as e:
-        logger.error(f"Error processing upscale task {task_id}: {str(e)}")
-        upscale_tasks[task_id].update({
-            "status": "failed",
-            "error": str(e),
-            "completed_at": datetime.now().isoformat()
-        })
+        logger.error(f"Local upscale error: {str(e)}")
+        raise Exception(f"Upscaling failed: {str(e)}") from e
 
 async def run_upscale_sync(image_url: str, scale_factor: int):
     """
@@ -177,30 +580,12 @@ async def run_upscale_sync(image_url: str, scale_factor: int):
         
         logger.info(f"Running Replicate upscale with input: {input_data}")
         
-        # Set Replicate API token from environment
-        api_token = os.getenv("REPLICATE_API_TOKEN")
-        if not api_token:
-            raise Exception("REPLICATE_API_TOKEN environment variable not configured")
-        
-        replicate.api_token = api_token
-        logger.info(f"Replicate token configured: {api_token[:8]}...")
-        
-        # Run the upscaling model
-        output = replicate.run(
-            "recraft-ai/recraft-crisp-upscale",
-            input=input_data
-        )
+        # Run the upscaling model (polled without blocking the event loop)
+        output = await replicate_client.run(UPSCALE_MODEL, input=input_data)
         logger.info(f"Replicate API call completed successfully")
         
         # Extract the URL from the output
-        if hasattr(output, 'url'):
-            upscaled_url = output.url()
-        elif isinstance(output, str):
-            upscaled_url = output
-        elif isinstance(output, list) and len(output) > 0:
-            upscaled_url = output[0] if isinstance(output[0], str) else output[0].url()
-        else:
-            raise ValueError(f"Unexpected output format from Replicate: {type(output)}")
+        upscaled_url = output_url(output)
         
         logger.info(f"Upscaling completed. Result URL: {upscaled_url}")
         
@@ -212,7 +597,14 @@ async def run_upscale_sync(image_url: str, scale_factor: int):
         
     except Exception as e:
         logger.error(f"Replicate upscale error: {str(e)}")
-        raise Exception(f"Upscaling failed: {str(e)}")
+        raise Exception(f"Upscaling failed: {str(e)}") from e
+
+LOCAL_ENHANCEMENT_DETAILS = {
+    "model": "tiled Lanczos with edge-aware sharpening (local)",
+    "quality_enhancement": "Resampling only, no AI detail synthesis",
+    "output_format": "PNG",
+    "suitable_for": ["Previews", "Offline use"]
+}
 
 def get_status_message(status: str, error: Optional[str] = None) -> str:
     """
@@ -235,21 +627,37 @@ async def debug_upscale_config():
             "replicate_token_configured": bool(os.getenv("REPLICATE_API_TOKEN")),
             "replicate_token_prefix": os.getenv("REPLICATE_API_TOKEN", "")[:8] + "..." if os.getenv("REPLICATE_API_TOKEN") else "Not set",
             "environment": os.getenv("ENVIRONMENT", "unknown"),
-            "upscale_tasks_count": len(upscale_tasks),
-            "model": "recraft-ai/recraft-crisp-upscale"
+            "upscale_tasks_count": await task_store.acount(TASK_KIND),
+            "task_store": await task_store.aget_stats(),
+            "model": "recraft-ai/recraft-crisp-upscale",
+            "engines": list(ENGINES),
+            "default_engine": UPSCALE_DEFAULT_ENGINE,
+            "local_max_scale": local_upscaler.LOCAL_UPSCALE_MAX_SCALE
         }
         return config
     except Exception as e:
         return {"error": str(e)}
 
 @router.get("/upscale/tasks")
-async def list_upscale_tasks():
+async def list_upscale_tasks(
+    status: Optional[str] = Query(None, description="Only tasks with this status"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
     """
-    List all upscale tasks (for debugging/monitoring)
+    List upscale tasks, newest first (for debugging/monitoring)
+    Paginated: pass next_cursor back as ?cursor= until it is null
     """
+    try:
+        tasks, next_cursor = await task_store.alist_page(TASK_KIND, status=status, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     return {
-        "total_tasks": len(upscale_tasks),
-        "tasks": upscale_tasks
+        "total_tasks": await task_store.acount(TASK_KIND),
+        "counts": await task_store.acounts(TASK_KIND),
+        "tasks": tasks,
+        "next_cursor": next_cursor
     }
 
 @router.delete("/upscale/tasks/{task_id}")
@@ -257,46 +665,35 @@ async def delete_upscale_task(task_id: str):
     """
     Delete a completed upscale task
     """
-    if task_id not in upscale_tasks:
+    if not await task_store.adelete(TASK_KIND, task_id):
         raise HTTPException(status_code=404, detail="Task not found")
     
-    del upscale_tasks[task_id]
     return {"message": f"Task {task_id} deleted successfully"}
 
-from fastapi.responses import StreamingResponse
-import io
-
 @router.get("/upscale/download/{task_id}")
-async def download_upscaled_image(task_id: str):
+async def download_upscaled_image(task_id: str, request: Request):
     """
     Download the upscaled image with proper headers
+    Streams from the output URL (or the local cache) and supports Range and If-None-Match
     """
     try:
-        if task_id not in upscale_tasks:
+        task = await task_store.aget(TASK_KIND, task_id)
+        if task is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        task = upscale_tasks[task_id]
         if task["status"] != "completed" or not task.get("upscaled_url"):
             raise HTTPException(status_code=400, detail="Upscaled image not available")
         
-        # Fetch the image
-        response = requests.get(task["upscaled_url"])
-        response.raise_for_status()
-        
         # Generate filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"kraftey_upscaled_4x_{timestamp}.webp"
+        if task.get("engine") == ENGINE_LOCAL:
+            filename = f"kraftey_upscaled_{task['scale_factor']}x_{timestamp}.png"
+            media_type = "image/png"
+        else:
+            filename = f"kraftey_upscaled_4x_{timestamp}.webp"
+            media_type = "image/webp"
         
-        # Return as streaming response with download headers
-        return StreamingResponse(
-            io.BytesIO(response.content),
-            media_type="image/webp",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Length": str(len(response.content)),
-                "Cache-Control": "no-cache"
-            }
-        )
+        # Stream to the client in chunks without buffering the image
+        return await download_proxy.response(task["upscaled_url"], request, filename, media_type)
         
     except HTTPException:
         raise
@@ -310,10 +707,9 @@ async def get_comparison_data(task_id: str):
     Get comparison data for before/after display
     """
     try:
-        if task_id not in upscale_tasks:
+        task = await task_store.aget(TASK_KIND, task_id)
+        if task is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        task = upscale_tasks[task_id]
         if task["status"] != "completed":
             raise HTTPException(status_code=400, detail="Upscaling not completed")
         
@@ -354,8 +750,8 @@ async def upscale_health_check():
             "status": "healthy" if has_token else "warning",
             "service": "image-upscale",
             "replicate_configured": has_token,
-            "active_tasks": len([t for t in upscale_tasks.values() if t["status"] == "processing"]),
-            "total_tasks": len(upscale_tasks),
+            "active_tasks": await task_store.acount(TASK_KIND, "processing"),
+            "total_tasks": await task_store.acount(TASK_KIND),
             "message": "Upscale service is ready" if has_token else "REPLICATE_API_TOKEN not configured"
         }
         
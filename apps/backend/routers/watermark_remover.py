@@ -1,10 +1,19 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, RedirectResponse
 import replicate
 import os
+import asyncio
+import base64
 import tempfile
 import uuid
+from datetime import datetime
+from functools import partial
 from services.cloud_storage import CloudStorageService
+from services.replicate_client import replicate_client, ReplicateTimeout, output_url
+from services.task_store import task_store
+from services.job_scheduler import job_scheduler, JobCancelled, PRIORITY_HIGH
+from services.download_proxy import download_proxy
+from services.result_cache import SERVER_BASE_URL
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,6 +22,23 @@ router = APIRouter()
 # Initialize cloud storage service
 cloud_storage = CloudStorageService()
 
+TASK_KIND = "watermark_removal"
+WATERMARK_MODEL = "black-forest-labs/flux-kontext-dev"
+# Replicate runs longer than this are cancelled and reported as a 408
+WATERMARK_TIMEOUT = 300
+# Inputs up to this size are sent to Replicate inline as a data URI instead of being
+# uploaded to Cloudinary first (Replicate recommends data URIs for small files)
+WATERMARK_DATA_URI_MAX_BYTES = int(os.getenv("WATERMARK_DATA_URI_MAX_BYTES", str(256 * 1024)))
+# Keep copies of inputs and results in Cloudinary, written after the response is sent
+WATERMARK_ARCHIVE = os.getenv("WATERMARK_ARCHIVE", "1") == "1"
+# Finished tasks are swept after TASK_FINISHED_TTL_SECONDS; a small record pointing at the
+# archived result keeps /watermark-remover/result/{task_id} working for this long
+RESULT_LINK_KIND = "watermark_result"
+WATERMARK_RESULT_TTL_SECONDS = int(os.getenv("WATERMARK_RESULT_TTL_SECONDS", str(365 * 24 * 3600)))
+
+# Archive uploads still running, so they aren't garbage collected mid-way
+_archive_jobs = set()
+
 @router.post("/watermark-remover")
 async def remove_watermark(file: UploadFile = File(...)):
     """
@@ -38,113 +64,71 @@ async def remove_watermark(file: UploadFile = File(...)):
         file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
         unique_filename = f"watermark_input_{uuid.uuid4().hex}.{file_extension}"
         
-        # Upload original image to Cloudinary first
-        logger.info(f"Uploading original image to Cloudinary: {unique_filename}")
-        try:
-            original_image_url = await cloud_storage.upload_image_to_public_url(file_content, unique_filename)
-            logger.info(f"Original image uploaded successfully: {original_image_url}")
-        except Exception as e:
-            logger.error(f"Cloudinary upload failed: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
-        
-        # Use Replicate to remove watermark
-        logger.info("Starting watermark removal with Replicate...")
-        logger.info(f"Using model: black-forest-labs/flux-kontext-dev")
-        logger.info(f"Input image URL: {original_image_url}")
-        
-        try:
-            # Use the simpler replicate.run method with timeout
-            logger.info("Starting Replicate processing...")
-            
-            import asyncio
-            import concurrent.futures
-            
-            def run_replicate():
-                return replicate.run(
-                    "black-forest-labs/flux-kontext-dev",
-                    input={
-                        "prompt": "remove watermark from image",
-                        "go_fast": True,
-                        "guidance": 2.5,
-                        "input_image": original_image_url,
-                        "aspect_ratio": "match_input_image",
-                        "output_format": "jpg",
-                        "output_quality": 80,
-                        "num_inference_steps": 30
-                    }
+        original_image_url = None
+        original_upload = None
+        if len(file_content) <= WATERMARK_DATA_URI_MAX_BYTES:
+            # Small enough to send inline, no upload before the model can start
+            input_image = f"data:{file.content_type};base64,{base64.b64encode(file_content).decode()}"
+            logger.info(f"Sending {len(file_content)} byte input to Replicate as a data URI")
+            if archive_enabled():
+                # The original is archived while the model runs, so its URL is in the response
+                original_upload = asyncio.ensure_future(
+                    cloud_storage.upload_image_to_public_url(file_content, unique_filename)
                 )
-            
-            # Run with timeout
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(run_replicate)
-                try:
-                    # Wait up to 5 minutes for completion
-                    output = future.result(timeout=300)
-                    logger.info("Replicate processing completed successfully")
-                except concurrent.futures.TimeoutError:
-                    logger.error("Replicate processing timed out after 5 minutes")
-                    raise HTTPException(status_code=408, detail="Processing timed out. Please try again with a smaller image.")
-            
-        except Exception as e:
-            logger.error(f"Replicate processing failed: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
-        
-        # Get the processed image data
-        try:
-            logger.info("Getting processed image data...")
-            logger.info(f"Output type: {type(output)}")
-            logger.info(f"Output value: {output}")
-            
-            # Handle different output formats from Replicate
-            if isinstance(output, str):
-                # Output is a URL, download it
-                import requests
-                logger.info(f"Downloading from URL: {output}")
-                response = requests.get(output)
-                response.raise_for_status()
-                processed_image_data = response.content
-            elif hasattr(output, 'read'):
-                # Output is a file-like object
-                processed_image_data = output.read()
-            elif hasattr(output, 'url'):
-                # Output has a url attribute
-                import requests
-                logger.info(f"Downloading from URL: {output.url}")
-                response = requests.get(output.url)
-                response.raise_for_status()
-                processed_image_data = response.content
-            elif isinstance(output, bytes):
-                # Output is already bytes
-                processed_image_data = output
-            else:
-                logger.error(f"Unknown output format: {type(output)}")
-                raise Exception(f"Unknown output format from Replicate: {type(output)}")
-            
-            logger.info(f"Downloaded {len(processed_image_data)} bytes")
-            
-        except Exception as e:
-            logger.error(f"Failed to download processed image: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to download processed image: {str(e)}")
-        
-        # Upload processed image to Cloudinary
-        processed_filename = f"watermark_removed_{uuid.uuid4().hex}.jpg"
-        logger.info(f"Uploading processed image to Cloudinary: {processed_filename}")
+        else:
+            # Upload original image to Cloudinary first
+            logger.info(f"Uploading original image to Cloudinary: {unique_filename}")
+            try:
+                original_image_url = await cloud_storage.upload_image_to_public_url(file_content, unique_filename)
+                logger.info(f"Original image uploaded successfully: {original_image_url}")
+            except Exception as e:
+                logger.error(f"Cloudinary upload failed: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+            input_image = original_image_url
         
+        # Run the Replicate job through the shared scheduler and wait for it
+        task_id = str(uuid.uuid4())
+        await task_store.acreate(TASK_KIND, task_id, {
+            "status": "processing",
+            "original_url": original_image_url,
+            "created_at": datetime.now().isoformat(),
+            "processed_url": None,
+            "archived_url": None,
+            "archive_status": None,
+            "error": None
+        })
+        task = None
         try:
-            processed_image_url = await cloud_storage.upload_image_to_public_url(processed_image_data, processed_filename)
-            logger.info(f"Processed image uploaded successfully: {processed_image_url}")
-            
-        except Exception as e:
-            logger.error(f"Failed to upload processed image: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to upload processed image: {str(e)}")
+            task = await job_scheduler.run(
+                TASK_KIND, task_id, WATERMARK_MODEL,
+                partial(process_watermark_removal, task_id, input_image),
+                priority=PRIORITY_HIGH
+            )
+        except JobCancelled:
+            raise HTTPException(status_code=409, detail="Watermark removal was cancelled")
+        finally:
+            if task is None and original_upload is not None:
+                original_upload.cancel()
         
         logger.info("Watermark removal process completed successfully")
         
+        if original_upload is not None:
+            try:
+                original_image_url = await original_upload
+                await task_store.aupdate(TASK_KIND, task_id, original_url=original_image_url)
+            except Exception as e:
+                logger.warning(f"Archiving the original of watermark removal {task_id} failed: {str(e)}")
+        
+        # The result is served from Replicate's output straight away; its copy goes to Cloudinary afterwards
+        await start_archive(task_id, task["processed_url"])
+        
         return JSONResponse(content={
             "success": True,
             "message": "Watermark removed successfully",
             "original_image": original_image_url,
-            "processed_image": processed_image_url,
+            "processed_image": f"{SERVER_BASE_URL}/api/watermark-remover/result/{task_id}",
+            "output_url": task["processed_url"],
+            "task_id": task_id,
             "processing_time": "AI processing completed"
         })
         
@@ -160,6 +144,120 @@ async def remove_watermark(file: UploadFile = File(...)):
         logger.error(f"Unexpected watermark removal error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process image: {str(e)}")
 
+async def process_watermark_removal(task_id: str, input_image: str) -> dict:
+    """
+    Scheduler job for a watermark removal task, returns the fields that complete it
+    input_image is a public URL or a data URI. The task's processed_url is
+    Replicate's output URL, nothing is downloaded or re-uploaded here.
+    """
+    # Use Replicate to remove watermark
+    logger.info("Starting watermark removal with Replicate...")
+    logger.info(f"Using model: black-forest-labs/flux-kontext-dev")
+    if not input_image.startswith("data:"):
+        logger.info(f"Input image URL: {input_image}")
+    
+    try:
+        logger.info("Starting Replicate processing...")
+        
+        # Wait up to 5 minutes for completion, without blocking the event loop
+        output = await replicate_client.run(
+            WATERMARK_MODEL,
+            input={
+                "prompt": "remove watermark from image",
+                "go_fast": True,
+                "guidance": 2.5,
+                "input_image": input_image,
+                "aspect_ratio": "match_input_image",
+                "output_format": "jpg",
+                "output_quality": 80,
+                "num_inference_steps": 30
+            },
+            timeout=WATERMARK_TIMEOUT
+        )
+        logger.info("Replicate processing completed successfully")
+        
+    except ReplicateTimeout:
+        logger.error("Replicate processing timed out after 5 minutes")
+        raise HTTPException(status_code=408, detail="Processing timed out. Please try again with a smaller image.")
+    except Exception as e:
+        logger.error(f"Replicate processing failed: {str(e)}")
+        # Chained so the scheduler can retry transient errors
+        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}") from e
+    
+    try:
+        processed_image_url = output_url(output)
+    except ValueError as e:
+        logger.error(f"Unknown output format: {type(output)}")
+        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}") from e
+    logger.info(f"Replicate output: {processed_image_url}")
+    
+    return {"processed_url": processed_image_url}
+
+def archive_enabled() -> bool:
+    return WATERMARK_ARCHIVE and cloud_storage.use_cloudinary
+
+async def start_archive(task_id: str, processed_url: str):
+    """Copy a finished task's result to Cloudinary in the background"""
+    if not archive_enabled():
+        await task_store.aupdate(TASK_KIND, task_id, archive_status="skipped")
+        return
+    await task_store.aupdate(TASK_KIND, task_id, archive_status="pending")
+    job = asyncio.ensure_future(archive_watermark_result(task_id, processed_url))
+    _archive_jobs.add(job)
+    job.add_done_callback(archive_done)
+
+def archive_done(job: asyncio.Future):
+    _archive_jobs.discard(job)
+    if not job.cancelled() and job.exception() is not None:
+        logger.error(f"Watermark archive job failed: {job.exception()!r}")
+
+async def archive_watermark_result(task_id: str, processed_url: str):
+    """Upload the archive copy and record its URL (Replicate's output URL expires)"""
+    try:
+        processed_image_data = await replicate_client.download(processed_url)
+        archived_url = await cloud_storage.upload_image_to_public_url(
+            processed_image_data, f"watermark_removed_{task_id}.jpg"
+        )
+        await task_store.aupdate(TASK_KIND, task_id, archived_url=archived_url, archive_status="completed")
+        # Not a terminal status, so the link lives for its TTL rather than TASK_FINISHED_TTL_SECONDS
+        await task_store.acreate(
+            RESULT_LINK_KIND, task_id, {"status": "archived", "archived_url": archived_url},
+            ttl=WATERMARK_RESULT_TTL_SECONDS
+        )
+        logger.info(f"Archived watermark removal {task_id}: {archived_url}")
+    except Exception as e:
+        logger.warning(f"Archiving watermark removal {task_id} failed: {str(e)}")
+        await task_store.aupdate(TASK_KIND, task_id, archive_status="failed", archive_error=str(e))
+
+@router.get("/watermark-remover/result/{task_id}")
+async def watermark_result(task_id: str, request: Request):
+    """
+    The processed image of a finished task
+    Streamed from Replicate's output until the Cloudinary copy exists, then redirected to that.
+    """
+    try:
+        task = await task_store.aget(TASK_KIND, task_id)
+        if task is None:
+            # The task has been swept, the archived copy's link outlives it
+            link = await task_store.aget(RESULT_LINK_KIND, task_id)
+            if link is None:
+                raise HTTPException(status_code=404, detail="Task not found")
+            return RedirectResponse(link["archived_url"])
+        if task.get("archived_url"):
+            return RedirectResponse(task["archived_url"])
+        if task["status"] != "completed" or not task.get("processed_url"):
+            raise HTTPException(status_code=400, detail="Processed image not available")
+        
+        return await download_proxy.response(
+            task["processed_url"], request, f"watermark_removed_{task_id}.jpg", "image/jpeg"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error serving processed image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to download image: {str(e)}")
+
 @router.post("/watermark-remover/test")
 async def test_watermark_endpoint(file: UploadFile = File(...)):
     """
@@ -211,7 +309,10 @@ async def watermark_remover_health():
             "message": "Watermark remover service is ready",
             "model": "black-forest-labs/flux-kontext-dev",
             "replicate_configured": True,
-            "cloudinary_configured": True
+            "cloudinary_configured": True,
+            "data_uri_max_bytes": WATERMARK_DATA_URI_MAX_BYTES,
+            "archive_enabled": WATERMARK_ARCHIVE,
+            "archives_running": len(_archive_jobs)
         })
         
     except Exception as e:
@@ -1,10 +1,11 @@
 import os
-import replicate
+from io import BytesIO
 from PIL import Image, ImageDraw
+from services.replicate_client import replicate_client, output_url
 import random
 import re
 
-def generate_background(prompt: str, width: int, height: int) -> Image.Image:
+async def generate_background(prompt: str, width: int, height: int) -> Image.Image:
     """
     Generate background from prompt using Replicate FLUX or fallback gradient
     """
@@ -13,16 +14,16 @@ def generate_background(prompt: str, width: int, height: int) -> Image.Image:
     
     if api_token:
         try:
-            return generate_with_replicate(prompt, width, height, model_name)
+            return await generate_with_replicate(prompt, width, height, model_name)
         except Exception as e:
             print(f"Replicate generation failed: {e}")
             return generate_gradient_fallback(prompt, width, height)
     else:
         return generate_gradient_fallback(prompt, width, height)
 
-def generate_with_replicate(prompt: str, width: int, height: int, model_name: str) -> Image.Image:
+async def generate_with_replicate(prompt: str, width: int, height: int, model_name: str) -> Image.Image:
     """Generate background using Replicate FLUX"""
-    output = replicate.run(
+    output = await replicate_client.run(
         model_name,
         input={
             "prompt": prompt,
@@ -33,9 +34,8 @@ def generate_with_replicate(prompt: str, width: int, height: int, model_name: st
     )
     
     # Download the generated image
-    import requests
-    response = requests.get(output[0])
-    image = Image.open(requests.get(output[0], stream=True).raw)
+    image_data = await replicate_client.download(output_url(output))
+    image = Image.open(BytesIO(image_data))
     return image.convert('RGBA')
 
 def generate_gradient_fallback(prompt: str, width: int, height: int) -> Image.Image:
@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults for breakers around remote models
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+# Calls slower than this count as failures
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "45"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# A half-open trial with no outcome after this long (e.g. its webhook went to another worker) is let go
+BREAKER_TRIAL_TIMEOUT_SECONDS = float(os.getenv("BREAKER_TRIAL_TIMEOUT_SECONDS", "120"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the error rate and latency of calls to a remote backend
+
+    Outcomes of the last `window` calls are kept; once at least `min_calls`
+    have been seen and the share of failed or slow calls reaches
+    `failure_rate`, the circuit opens and allow() says no. After
+    `open_seconds` a single trial call is let through (half open): success
+    closes the circuit, failure opens it again. The trial is held until its
+    outcome is recorded or released, or for at most `trial_timeout`. State is
+    per worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        trial_timeout: float = BREAKER_TRIAL_TIMEOUT_SECONDS,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.trial_timeout = trial_timeout
+
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._trial_started_at = 0.0
+        self._lock = threading.Lock()
+        self._rejected = 0
+        self._opened = 0
+        self._last_error: Optional[str] = None
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow(self) -> bool:
+        """
+        Whether to call the backend now; in half-open state only one trial call is allowed
+
+        The caller passes trial=True to record() or release() for the trial
+        call, which it can tell by the state being half open right after.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN:
+                now = time.monotonic()
+                if self._trial_running and now - self._trial_started_at >= self.trial_timeout:
+                    logger.warning(f"Circuit {self.name} trial call got no outcome in {self.trial_timeout:.0f}s")
+                    self._trial_running = False
+                if not self._trial_running:
+                    self._state = HALF_OPEN
+                    self._trial_running = True
+                    self._trial_started_at = now
+                    return True
+            self._rejected += 1
+            return False
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._opened += 1
+        logger.warning(f"Circuit {self.name} opened, last error: {self._last_error}")
+
+    def record(self, latency: float, error: Optional[BaseException] = None, trial: bool = False):
+        """Record the outcome of a call that allow() let through"""
+        failed = error is not None or latency >= self.slow_call_seconds
+        with self._lock:
+            if failed:
+                self._last_error = str(error) if error is not None else f"slow call ({latency:.1f}s)"
+
+            if self._state == OPEN:
+                # A call started before the circuit opened, it has nothing left to decide
+                return
+            if self._state == HALF_OPEN:
+                if not trial:
+                    # Started before the circuit opened, only the trial call decides
+                    return
+                self._trial_running = False
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"Circuit {self.name} closed")
+                return
+
+            self._outcomes.append((failed, latency))
+            failures = sum(1 for outcome_failed, _ in self._outcomes if outcome_failed)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._outcomes.clear()
+                self._open()
+
+    def release(self, trial: bool = False):
+        """Forget a call that ended without an outcome (e.g. cancelled), freeing the trial slot if it was the trial"""
+        with self._lock:
+            if trial and self._state == HALF_OPEN:
+                self._trial_running = False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            latencies = [latency for _, latency in self._outcomes]
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            return {
+                "state": self._current_state(),
+                "calls_in_window": len(self._outcomes),
+                "failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0,
+                "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "times_opened": self._opened,
+                "rejected": self._rejected,
+                "last_error": self._last_error,
+            }
+
+
+# Breaker for the Replicate background remover, shared by its routes in this worker
+replicate_bg_removal_breaker = CircuitBreaker("replicate-background-remover")
+
+# Breakers by Replicate model ("owner/name"), fed by webhook completions of their predictions;
+# routers register the models they guard
+model_breakers: Dict[str, CircuitBreaker] = {}
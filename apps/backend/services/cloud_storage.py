@@ -1,4 +1,5 @@
 import requests
+import asyncio
 import base64
 import os
 import logging
@@ -7,6 +8,8 @@ import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 from io import BytesIO
+import time
+from services.metrics import CLOUDINARY_UPLOAD_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,8 @@ class CloudStorageService:
         self.cloudinary_cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME", "")
         self.cloudinary_api_key = os.getenv("CLOUDINARY_API_KEY", "")
         self.cloudinary_api_secret = os.getenv("CLOUDINARY_API_SECRET", "")
+        # API base URL, only set to point uploads at a stand-in (devtools/fake_replicate.py)
+        self.cloudinary_upload_prefix = os.getenv("CLOUDINARY_UPLOAD_PREFIX", "")
         
         self.use_cloudinary = bool(self.cloudinary_cloud_name and self.cloudinary_api_key and self.cloudinary_api_secret)
         
@@ -29,6 +34,8 @@ class CloudStorageService:
                 api_secret=self.cloudinary_api_secret,
                 secure=True
             )
+            if self.cloudinary_upload_prefix:
+                cloudinary.config(upload_prefix=self.cloudinary_upload_prefix)
             logger.info("Cloudinary configured successfully")
         else:
             logger.warning("Cloudinary not configured - file uploads will not work with Replicate")
@@ -54,14 +61,21 @@ class CloudStorageService:
             # Create a BytesIO object from image data
             image_buffer = BytesIO(image_data)
             
-            # Upload to Cloudinary
-            result = cloudinary.uploader.upload(
-                image_buffer,
-                public_id=f"kraftey-upscaler/{filename.split('.')[0]}",
-                folder="kraftey-upscaler",
-                resource_type="image",
-                quality="auto:best"
-            )
+            # Upload to Cloudinary (the SDK is blocking, keep it off the event loop)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await asyncio.to_thread(
+                    cloudinary.uploader.upload,
+                    image_buffer,
+                    public_id=f"kraftey-upscaler/{filename.split('.')[0]}",
+                    folder="kraftey-upscaler",
+                    resource_type="image",
+                    quality="auto:best"
+                )
+                outcome = "ok"
+            finally:
+                CLOUDINARY_UPLOAD_SECONDS.labels(outcome).observe(time.perf_counter() - started)
             
             public_url = result.get('secure_url')
             if not public_url:
@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CutoutCache:
+    """
+    Two-tier cache for cutout results keyed by input content hash
+
+    Tier 1 is an in-memory LRU per worker. Tier 2 is a size-capped directory
+    under uploads/ that every worker on the box shares. Values are the encoded
+    output bytes, so a hit never decodes the input image.
+    """
+
+    def __init__(self, cache_dir: str, memory_max_bytes: int, disk_max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._hits_memory = 0
+        self._hits_disk = 0
+        self._misses = 0
+
+        if self.disk_max_bytes > 0:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_data: bytes, model_name: str, options: Optional[dict] = None) -> str:
+        """SHA-256 of the input bytes combined with the model and output options"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        options_part = json.dumps(options or {}, sort_keys=True)
+        return hashlib.sha256(f"{digest}:{model_name}:{options_part}".encode()).hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look a key up in memory, then on disk (blocking disk read)
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._hits_memory += 1
+                return value
+
+        if self.disk_max_bytes > 0:
+            path = self._path_for(key)
+            try:
+                value = path.read_bytes()
+                # Bump mtime so disk eviction is least-recently-used
+                os.utime(path, None)
+            except FileNotFoundError:
+                value = None
+            except Exception as e:
+                logger.warning(f"Cutout cache read failed for {key}: {str(e)}")
+                value = None
+
+            if value is not None:
+                with self._lock:
+                    self._hits_disk += 1
+                self._put_memory(key, value)
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, value: bytes):
+        """
+        Store a value in both tiers (blocking disk write)
+        """
+        self._put_memory(key, value)
+
+        if self.disk_max_bytes <= 0 or len(value) > self.disk_max_bytes:
+            return
+
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(value)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Cutout cache write failed for {key}: {str(e)}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(value)
+            over_limit = self._disk_bytes > self.disk_max_bytes
+
+        if over_limit:
+            self._evict_disk()
+
+    def _put_memory(self, key: str, value: bytes):
+        if len(value) > self.memory_max_bytes:
+            return
+
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = value
+            self._memory_bytes += len(value)
+
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.cache_dir.glob("*/*.bin"))
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the disk tier is at 90% of its cap"""
+        entries = []
+        for path in self.cache_dir.glob("*/*.bin"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                total -= size
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self._hits_memory + self._hits_disk + self._misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "hits_memory": self._hits_memory,
+                "hits_disk": self._hits_disk,
+                "misses": self._misses,
+                "hit_rate": round((self._hits_memory + self._hits_disk) / lookups, 3) if lookups else 0,
+            }
+
+
+# Shared cache for this worker (the disk tier is shared by all workers)
+cutout_cache = CutoutCache(
+    cache_dir=os.getenv("CUTOUT_CACHE_DIR", "uploads/cutout-cache"),
+    memory_max_bytes=int(os.getenv("CUTOUT_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    disk_max_bytes=int(os.getenv("CUTOUT_CACHE_DISK_MB", "512")) * 1024 * 1024,
+)
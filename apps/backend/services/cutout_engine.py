@@ -0,0 +1,248 @@
+import os
+import base64
+import asyncio
+import logging
+import numpy as np
+from io import BytesIO
+from typing import List, Optional
+from PIL import Image, ImageOps
+from services.rembg_sessions import DEFAULT_MODEL, get_session, is_ready
+from services.inference_executor import inference_executor
+from services.mask_batcher import MaskBatchScheduler
+from services.cutout_cache import cutout_cache
+from services.mask_refine import downscale_for_inference, upsample_and_refine
+from services import fallback_remover
+from services.image_encoding import encode_image, validate_encode_options
+from services.metrics import REMBG_INFERENCE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Try to import rembg, fall back to the colour-based remover if not available
+try:
+    from rembg import remove
+    REMBG_AVAILABLE = True
+except ImportError:
+    REMBG_AVAILABLE = False
+    print("Warning: rembg not available, using fallback background removal")
+
+# Models whose sessions share U2-Net style pre/post-processing: (mean, std, input size)
+BATCHABLE_MODELS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+# "full" predicts the mask on the decoded image as rembg does, "fast" predicts it on a
+# downscaled copy and refines the upsampled edge band against the full-resolution original
+MASK_MODES = ("full", "fast")
+DEFAULT_MASK_MODE = os.getenv("CUTOUT_MASK_MODE", "full")
+FAST_MASK_MAX_SIDE = int(os.getenv("CUTOUT_FAST_MASK_MAX_SIDE", "1024"))
+
+# Models whose ONNX graph rejected a batch larger than one
+_unbatchable_models = set()
+
+
+def remove_background(input_image: Image.Image, model_name: str = DEFAULT_MODEL) -> Image.Image:
+    """Remove background with the shared rembg session, or the fallback remover if rembg is missing"""
+    if REMBG_AVAILABLE:
+        with REMBG_INFERENCE_SECONDS.labels(model_name).time():
+            return remove(input_image, session=get_session(model_name))
+    return fallback_remover.remove_background_fallback(input_image)
+
+
+def decode_image(image_data: bytes) -> Image.Image:
+    """Decode image bytes and apply EXIF orientation, as rembg.remove does"""
+    image = Image.open(BytesIO(image_data))
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def can_batch(model_name: str) -> bool:
+    """Check whether masks for a model can be predicted as one ONNX batch"""
+    if not REMBG_AVAILABLE or model_name not in BATCHABLE_MODELS or model_name in _unbatchable_models:
+        return False
+
+    # Never load a model from here, callers may be on the event loop
+    if not is_ready(model_name):
+        return False
+
+    batch_dim = get_session(model_name).inner_session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim == 1:
+        _unbatchable_models.add(model_name)
+        return False
+    return True
+
+
+def predict_masks(images: List[Image.Image], model_name: str = DEFAULT_MODEL) -> List[Image.Image]:
+    """
+    Predict alpha masks for a list of images, as a single ONNX run when the model allows it
+    """
+    with REMBG_INFERENCE_SECONDS.labels(model_name).time():
+        return _predict_masks(images, model_name)
+
+
+def _predict_masks(images: List[Image.Image], model_name: str) -> List[Image.Image]:
+    session = get_session(model_name)
+
+    if len(images) == 1 or not can_batch(model_name):
+        return [session.predict(image)[0] for image in images]
+
+    mean, std, size = BATCHABLE_MODELS[model_name]
+    input_name = session.inner_session.get_inputs()[0].name
+    batch = np.concatenate(
+        [session.normalize(image, mean, std, size)[input_name] for image in images], axis=0
+    )
+
+    try:
+        ort_outs = session.inner_session.run(None, {input_name: batch})
+    except Exception as e:
+        logger.warning(f"Model {model_name} rejected a batch of {len(images)}, predicting one by one: {str(e)}")
+        _unbatchable_models.add(model_name)
+        return [session.predict(image)[0] for image in images]
+
+    masks = []
+    for image, pred in zip(images, ort_outs[0][:, 0, :, :]):
+        ma = np.max(pred)
+        mi = np.min(pred)
+        pred = (pred - mi) / (ma - mi)
+
+        mask = Image.fromarray((pred * 255).astype("uint8"), mode="L")
+        masks.append(mask.resize(image.size, Image.LANCZOS))
+
+    return masks
+
+
+def apply_mask(image: Image.Image, mask: Image.Image) -> Image.Image:
+    """Cut the image out with the mask as alpha"""
+    empty = Image.new("RGBA", image.size, 0)
+    return Image.composite(image, empty, mask)
+
+
+def cutout_encoded(
+    image_data: bytes,
+    model_name: str = DEFAULT_MODEL,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+) -> bytes:
+    """
+    Decode, cut out and encode an image (blocking, run it on the inference executor)
+    """
+    input_image = Image.open(BytesIO(image_data))
+    if REMBG_AVAILABLE and output_format == "mask":
+        # The mask is all the client needs, skip compositing the cutout
+        with REMBG_INFERENCE_SECONDS.labels(model_name).time():
+            output_image = remove(input_image, session=get_session(model_name), only_mask=True)
+    else:
+        output_image = remove_background(input_image, model_name)
+    return encode_image(output_image, output_format, compress_level)
+
+
+def prepare_image(image_data: bytes, mask_mode: str = "full"):
+    """Decode image bytes and return (full image, image to run mask prediction on)"""
+    image = decode_image(image_data)
+    if mask_mode == "fast":
+        return image, downscale_for_inference(image, FAST_MASK_MAX_SIDE)
+    return image, image
+
+
+def apply_mask_encoded(
+    image: Image.Image,
+    mask: Image.Image,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+) -> bytes:
+    """Apply a mask to the full-resolution image, refining it first if it was predicted smaller"""
+    if mask.size != image.size:
+        mask = upsample_and_refine(image, mask)
+    if output_format == "mask":
+        return encode_image(mask, output_format, compress_level)
+    return encode_image(apply_mask(image, mask), output_format, compress_level)
+
+
+def lowres_cutout_encoded(
+    image_data: bytes,
+    model_name: str = DEFAULT_MODEL,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+) -> bytes:
+    """
+    Predict the mask on a downscaled copy and apply it to the original (blocking)
+    """
+    image, small = prepare_image(image_data, "fast")
+    mask = predict_masks([small], model_name)[0]
+    return apply_mask_encoded(image, mask, output_format, compress_level)
+
+
+# Shared batching scheduler for this worker
+mask_batcher = MaskBatchScheduler(
+    predict_masks,
+    max_batch_size=int(os.getenv("REMBG_BATCH_MAX_SIZE", "4")),
+    window_ms=float(os.getenv("REMBG_BATCH_WINDOW_MS", "10")),
+    can_batch=can_batch,
+)
+
+
+async def run_cutout_bytes(
+    image_data: bytes,
+    model_name: str = DEFAULT_MODEL,
+    mask_mode: Optional[str] = None,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+) -> bytes:
+    """
+    Remove the background from image bytes off the event loop and return encoded bytes
+
+    Results are looked up in the content-hash cache first, so a repeated input
+    skips decoding and inference. On a miss, mask prediction goes through the
+    micro-batching scheduler when batching is enabled.
+    """
+    loop = asyncio.get_running_loop()
+    mask_mode = mask_mode or DEFAULT_MASK_MODE
+    if mask_mode not in MASK_MODES:
+        raise ValueError(f"Unknown mask mode: {mask_mode}. Supported: {', '.join(MASK_MODES)}")
+    validate_encode_options(output_format, compress_level)
+
+    # Keep fallback output apart from real model output in the shared disk tier
+    if REMBG_AVAILABLE:
+        options = {"mask_mode": mask_mode}
+        cache_model = model_name
+    else:
+        options = fallback_remover.get_options()
+        cache_model = "fallback"
+    if output_format != "png":
+        options["output_format"] = output_format
+    if compress_level is not None:
+        options["compress_level"] = compress_level
+    cache_key = cutout_cache.make_key(image_data, cache_model, options)
+
+    cached = await loop.run_in_executor(None, cutout_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    if not REMBG_AVAILABLE or (not mask_batcher.enabled and mask_mode == "full"):
+        data = await inference_executor.run(cutout_encoded, image_data, model_name, output_format, compress_level)
+    elif not mask_batcher.enabled:
+        data = await inference_executor.run(
+            lowres_cutout_encoded, image_data, model_name, output_format, compress_level
+        )
+    else:
+        image, inference_image = await inference_executor.run(prepare_image, image_data, mask_mode)
+        mask = await mask_batcher.predict(inference_image, model_name)
+        data = await inference_executor.run(apply_mask_encoded, image, mask, output_format, compress_level)
+
+    await loop.run_in_executor(None, cutout_cache.put, cache_key, data)
+    return data
+
+
+async def run_cutout(
+    image_data: bytes,
+    model_name: str = DEFAULT_MODEL,
+    mask_mode: Optional[str] = None,
+    output_format: str = "png",
+    compress_level: Optional[int] = None,
+) -> str:
+    """Same as run_cutout_bytes, returning base64 for the JSON responses"""
+    data = await run_cutout_bytes(image_data, model_name, mask_mode, output_format, compress_level)
+    return base64.b64encode(data).decode('utf-8')
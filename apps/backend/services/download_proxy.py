@@ -0,0 +1,348 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+from urllib.parse import unquote
+import anyio
+import httpx
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "50"))
+# Completed downloads are kept here so repeats don't go upstream (0 MB disables)
+DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", "uploads/download-cache")
+DOWNLOAD_CACHE_DISK_MB = int(os.getenv("DOWNLOAD_CACHE_DISK_MB", "512"))
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://staticapi.kraftey.com")
+
+# Upstream headers passed through to the client
+PASSTHROUGH_HEADERS = ("content-length", "content-range", "accept-ranges", "last-modified")
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" range into inclusive offsets
+
+    Returns None when the header is absent or not a single byte range (the
+    whole file is sent), raises ValueError when the range can't be satisfied.
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")]
+
+
+class DownloadProxy:
+    """
+    Stream remote task outputs to clients without buffering them in memory
+
+    One pooled async client keeps connections to Replicate's CDN alive across
+    downloads. Output URLs are immutable, so the ETag is derived from the URL
+    and If-None-Match is answered without going upstream. Full downloads are
+    teed into a size-capped directory, and later requests (including ranges)
+    are served from disk. Outputs already on this server (the result cache)
+    are read straight from uploads/.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 max_connections: int = DOWNLOAD_MAX_CONNECTIONS):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.max_connections = max_connections
+        self._http: Optional[httpx.AsyncClient] = None
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._disk_hits = 0
+        self._upstream = 0
+        self._not_modified = 0
+
+        if self.max_bytes > 0:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _get_http(self) -> httpx.AsyncClient:
+        # Created lazily so it belongs to the worker's running event loop
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+        return self._http
+
+    @staticmethod
+    def etag_for(url: str) -> str:
+        return '"' + hashlib.sha256(url.encode()).hexdigest()[:32] + '"'
+
+    def _cache_path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.bin"
+
+    def _local_path(self, url: str) -> Optional[Path]:
+        """File on this server for a URL, from our own /uploads or the download cache"""
+        prefix = f"{SERVER_BASE_URL}/uploads/"
+        if url.startswith(prefix):
+            # /uploads serves the decoded path, so "%20" in the URL is a space on disk
+            path = Path("uploads") / unquote(url[len(prefix):].split("?", 1)[0])
+            if ".." not in path.parts and path.is_file():
+                return path
+        if self.max_bytes > 0:
+            path = self._cache_path(url)
+            if path.is_file():
+                return path
+        return None
+
+    async def response(self, url: str, request: Request, filename: str, media_type: str) -> Response:
+        """
+        Build the download response for an output URL, honouring Range and If-None-Match
+        """
+        etag = self.etag_for(url)
+        headers = {
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-cache",
+            "ETag": etag,
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            with self._lock:
+                self._not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        path = self._local_path(url)
+        if path is not None:
+            with self._lock:
+                self._disk_hits += 1
+            return self._file_response(path, request.headers.get("range"), headers, media_type)
+
+        return await self._upstream_response(url, request.headers.get("range"), headers, media_type)
+
+    async def open_stream(self, url: str) -> Tuple[AsyncIterator[bytes], Optional[int]]:
+        """
+        Open an output for reading in chunks, from disk when it is local, returns (chunks, size)
+
+        Raises before anything is read when the upstream request fails.
+        """
+        path = self._local_path(url)
+        if path is not None:
+            with self._lock:
+                self._disk_hits += 1
+            size = path.stat().st_size
+            return self._read_file(path, 0, size), size
+
+        http = self._get_http()
+        upstream = await http.send(http.build_request("GET", url), stream=True)
+        if upstream.status_code != 200:
+            await upstream.aclose()
+            upstream.raise_for_status()
+            raise httpx.HTTPStatusError(f"Unexpected upstream status {upstream.status_code}", request=upstream.request, response=upstream)
+        with self._lock:
+            self._upstream += 1
+        length = upstream.headers.get("content-length")
+        return self._iter_upstream(upstream), int(length) if length else None
+
+    async def _iter_upstream(self, upstream: httpx.Response) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in upstream.aiter_bytes(self.chunk_size):
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    def _file_response(self, path: Path, range_header: Optional[str], headers: dict, media_type: str) -> Response:
+        size = path.stat().st_size
+        headers = {**headers, "Accept-Ranges": "bytes"}
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+        # Bump mtime so cache eviction is least-recently-used
+        if self.cache_dir in path.parents:
+            try:
+                os.utime(path, None)
+            except FileNotFoundError:
+                pass
+
+        if byte_range is None:
+            start, end, status_code = 0, size - 1, 200
+        else:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+
+        return StreamingResponse(
+            self._read_file(path, start, end - start + 1),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    async def _read_file(self, path: Path, offset: int, length: int) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(path, "rb") as f:
+            await f.seek(offset)
+            while length > 0:
+                chunk = await f.read(min(self.chunk_size, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+    async def _upstream_response(self, url: str, range_header: Optional[str], headers: dict, media_type: str) -> Response:
+        http = self._get_http()
+        upstream_headers = {"Range": range_header} if range_header else {}
+        upstream = await http.send(http.build_request("GET", url, headers=upstream_headers), stream=True)
+
+        if upstream.status_code not in (200, 206, 416):
+            await upstream.aclose()
+            upstream.raise_for_status()
+            raise httpx.HTTPStatusError(f"Unexpected upstream status {upstream.status_code}", request=upstream.request, response=upstream)
+
+        with self._lock:
+            self._upstream += 1
+        for name in PASSTHROUGH_HEADERS:
+            if name in upstream.headers:
+                headers[name.title()] = upstream.headers[name]
+        upstream_type = upstream.headers.get("content-type", "")
+        if upstream_type.startswith("image/"):
+            media_type = upstream_type
+
+        if upstream.status_code == 416:
+            await upstream.aclose()
+            return Response(status_code=416, headers=headers)
+
+        # Only complete bodies of a known, cacheable size are teed to disk
+        length = int(upstream.headers.get("content-length", "0") or 0)
+        tee_path = None
+        if upstream.status_code == 200 and self.max_bytes > 0 and 0 < length <= self.max_bytes:
+            tee_path = self._cache_path(url)
+
+        return StreamingResponse(
+            self._stream_upstream(upstream, tee_path),
+            status_code=upstream.status_code,
+            media_type=media_type,
+            headers=headers,
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    async def _stream_upstream(self, upstream: httpx.Response, tee_path: Optional[Path]) -> AsyncIterator[bytes]:
+        """Yield upstream chunks as they arrive, copying them to the cache when tee_path is set"""
+        if tee_path is None:
+            async for chunk in upstream.aiter_bytes(self.chunk_size):
+                yield chunk
+            return
+
+        tee_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = tee_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        written = 0
+        completed = False
+        try:
+            async with await anyio.open_file(tmp_path, "wb") as f:
+                async for chunk in upstream.aiter_bytes(self.chunk_size):
+                    await f.write(chunk)
+                    written += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            # A client that disconnects midway leaves a partial file, drop it
+            if completed and written == int(upstream.headers.get("content-length", written)):
+                # Renaming, and on a full cache globbing and unlinking, runs off the event loop
+                await anyio.to_thread.run_sync(self._commit, tmp_path, tee_path, written)
+            else:
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+
+    def _commit(self, tmp_path: Path, tee_path: Path, size: int):
+        os.replace(tmp_path, tee_path)
+        self._account(size)
+
+    def _account(self, size: int):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.bin"))
+            else:
+                self._disk_bytes += size
+            over_limit = self._disk_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files until the cache is at 90% of its cap"""
+        entries = []
+        for path in self.cache_dir.glob("*/*.bin"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._disk_bytes = total
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "disk_hits": self._disk_hits,
+                "upstream": self._upstream,
+                "not_modified": self._not_modified,
+                "cache_bytes": self._disk_bytes,
+                "cache_max_bytes": self.max_bytes,
+                "max_connections": self.max_connections,
+            }
+
+
+# Global instance, one pooled client per worker (the disk cache is shared)
+download_proxy = DownloadProxy(
+    cache_dir=DOWNLOAD_CACHE_DIR,
+    max_bytes=DOWNLOAD_CACHE_DISK_MB * 1024 * 1024,
+)
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from PIL import Image, ImageFilter
+
+# scipy gives an exact connected-component flood fill, otherwise fall back to NumPy
+try:
+    from scipy import ndimage
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Defaults for the no-rembg fallback, overridable per call
+DEFAULT_THRESHOLD = float(os.getenv("FALLBACK_BG_THRESHOLD", "30"))
+DEFAULT_FEATHER = float(os.getenv("FALLBACK_BG_FEATHER", "1.0"))
+DEFAULT_FLOOD_FILL = os.getenv("FALLBACK_BG_FLOOD_FILL", "true").lower() == "true"
+
+# Grid size for the run-based flood fill when scipy is not installed
+FLOOD_FILL_GRID = 512
+
+
+def estimate_background_color(pixels: np.ndarray) -> np.ndarray:
+    """Median colour of the image border, where product shots have their backdrop"""
+    border = np.concatenate([pixels[0, :], pixels[-1, :], pixels[:, 0], pixels[:, -1]])
+    return np.median(border, axis=0)
+
+
+def _border_runs(mask: np.ndarray) -> np.ndarray:
+    """
+    The True cells of mask connected to its border, without scipy
+
+    Each row is split into runs of True cells, and runs that overlap a run in
+    the row above are joined with a union-find. The work grows with the number
+    of runs, not with how far the background winds through the image.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    run_rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    row_offsets = np.searchsorted(run_rows, np.arange(height + 1))
+
+    parent = list(range(len(starts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for row in range(1, height):
+        above = slice(row_offsets[row - 1], row_offsets[row])
+        first, last = row_offsets[row], row_offsets[row + 1]
+        if above.start == above.stop or first == last:
+            continue
+        # Runs above that start before this run ends and end after it starts
+        lo = np.searchsorted(ends[above], starts[first:last], side="right") + above.start
+        hi = np.searchsorted(starts[above], ends[first:last], side="left") + above.start
+        for run, (begin, stop) in enumerate(zip(lo.tolist(), hi.tolist()), first):
+            for other in range(begin, stop):
+                a, b = find(run), find(other)
+                if a != b:
+                    parent[a] = b
+
+    on_border = (run_rows == 0) | (run_rows == height - 1) | (starts == 0) | (ends == width)
+    border_roots = {find(run) for run in np.flatnonzero(on_border).tolist()}
+    keep = np.array([find(run) in border_roots for run in range(len(starts))], dtype=bool)
+
+    # Paint the kept runs back as +1 at their start and -1 at their end
+    delta = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(delta, (run_rows[keep], starts[keep]), 1)
+    np.add.at(delta, (run_rows[keep], ends[keep]), -1)
+    return np.cumsum(delta, axis=1)[:, :width] > 0
+
+
+def _border_connected(candidate: np.ndarray) -> np.ndarray:
+    """Keep only the candidate pixels that are connected to the image border"""
+    if SCIPY_AVAILABLE:
+        labels, _ = ndimage.label(candidate)
+        border_labels = np.unique(np.concatenate([labels[0, :], labels[-1, :], labels[:, 0], labels[:, -1]]))
+        border_labels = border_labels[border_labels != 0]
+        return np.isin(labels, border_labels)
+
+    # Connected runs on a reduced grid, then mapped back to full size
+    height, width = candidate.shape
+    step = max(1, int(np.ceil(max(height, width) / float(FLOOD_FILL_GRID))))
+    small = candidate[::step, ::step]
+    reached = _border_runs(small)
+
+    rows = np.minimum(np.arange(height) // step, small.shape[0] - 1)
+    cols = np.minimum(np.arange(width) // step, small.shape[1] - 1)
+    return reached[rows[:, None], cols[None, :]] & candidate
+
+
+def remove_background_fallback(
+    input_image: Image.Image,
+    threshold: float = DEFAULT_THRESHOLD,
+    flood_fill: bool = DEFAULT_FLOOD_FILL,
+    feather: float = DEFAULT_FEATHER,
+) -> Image.Image:
+    """
+    Remove a flat backdrop without a segmentation model
+
+    Pixels within `threshold` (RGB distance) of the border colour are background
+    candidates. With flood_fill, only candidates connected to the image border
+    are removed, so similar colours inside the product survive. The alpha edge
+    is feathered with a Gaussian of radius `feather` pixels.
+    """
+    rgb = input_image.convert("RGB")
+    pixels = np.asarray(rgb)
+
+    background = estimate_background_color(pixels).astype(np.int16)
+    diff = pixels.astype(np.int16) - background
+    distance_sq = np.einsum("ijk,ijk->ij", diff, diff, dtype=np.int32)
+    candidate = distance_sq <= int(threshold * threshold)
+
+    if flood_fill:
+        candidate = _border_connected(candidate)
+
+    alpha = Image.fromarray(np.where(candidate, 0, 255).astype(np.uint8), mode="L")
+    if feather > 0:
+        alpha = alpha.filter(ImageFilter.GaussianBlur(feather))
+
+    # Keep any existing transparency
+    if input_image.mode == "RGBA":
+        alpha = Image.fromarray(np.minimum(np.asarray(alpha), np.asarray(input_image.getchannel("A"))), mode="L")
+
+    output_image = rgb.convert("RGBA")
+    output_image.putalpha(alpha)
+    return output_image
+
+
+def get_options() -> dict:
+    """Server defaults, used in cache keys so changing them invalidates old results"""
+    return {
+        "threshold": DEFAULT_THRESHOLD,
+        "flood_fill": DEFAULT_FLOOD_FILL,
+        "feather": DEFAULT_FEATHER,
+    }
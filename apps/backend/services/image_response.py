@@ -0,0 +1,129 @@
+import time
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import Response
+from PIL import Image
+from services.image_encoding import OUTPUT_FORMATS, validate_encode_options
+
+# OpenAPI description of the binary alternatives to the JSON body
+IMAGE_RESPONSES = {
+    200: {
+        "content": {media_type: {} for media_type in OUTPUT_FORMATS.values()},
+        "description": "Base64 JSON by default, raw image bytes when Accept asks for image/png or image/webp",
+    }
+}
+
+# Media type -> output format, for Accept header negotiation. Written out rather than
+# inverted from OUTPUT_FORMATS: "mask" is also image/png, and is only ever picked
+# through an explicit output_format.
+_ACCEPTED_MEDIA_TYPES = {"image/png": "png", "image/webp": "webp"}
+# Accept entries that the default base64 JSON body satisfies
+_JSON_MEDIA_TYPES = ("application/json", "application/*", "*/*")
+
+
+def parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """"image/webp;q=0.9, */*;q=0.1" -> [("image/webp", 0.9), ("*/*", 0.1)]"""
+    entries = []
+    for part in accept.split(","):
+        pieces = [p.strip() for p in part.split(";")]
+        if not pieces[0]:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        entries.append((pieces[0].lower(), quality))
+    return entries
+
+
+def negotiate_image_format(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick a binary output format from an Accept header
+
+    Returns "png" or "webp" when the client accepts one of them (image/*
+    means PNG, an exact type wins a tie), or None to keep the default base64
+    JSON response.
+    """
+    if not accept:
+        return None
+
+    best_format = None
+    best_rank = (0.0, False)
+    for media_type, quality in parse_accept(accept):
+        exact = media_type in _ACCEPTED_MEDIA_TYPES
+        output_format = _ACCEPTED_MEDIA_TYPES.get(media_type) or ("png" if media_type == "image/*" else None)
+        if output_format and quality > 0 and (quality, exact) > best_rank:
+            best_format = output_format
+            best_rank = (quality, exact)
+
+    return best_format
+
+
+def resolve_output_format(accept: Optional[str], output_format: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    Decide what to encode and how to send it
+
+    Returns (output format, send raw bytes). An explicit output_format picks the
+    encoder; the Accept header decides between raw bytes and base64 JSON. Raises
+    a 406 HTTPException when Accept rules out both (e.g. only image/jpeg).
+    """
+    validate_encode_options(output_format)
+    binary_format = negotiate_image_format(accept)
+    if binary_format:
+        return output_format or binary_format, True
+    if accept and not accepts_json(accept):
+        raise HTTPException(
+            status_code=406,
+            detail="Send Accept: image/png, image/webp or application/json",
+        )
+
+    output_format = output_format or "png"
+    if output_format == "webp":
+        raise ValueError("WebP output is only sent as raw bytes, request it with Accept: image/webp")
+    return output_format, False
+
+
+def accepts_json(accept: str) -> bool:
+    return any(media_type in _JSON_MEDIA_TYPES and quality > 0 for media_type, quality in parse_accept(accept))
+
+
+def image_response(data: bytes, output_format: str, timings: Optional[Dict[str, float]] = None) -> Response:
+    """
+    Raw image bytes with dimensions and timings (seconds) in headers
+    """
+    # Only the header is parsed here, the pixels are not decoded
+    width, height = Image.open(BytesIO(data)).size
+
+    headers = {
+        "X-Image-Width": str(width),
+        "X-Image-Height": str(height),
+        "Cache-Control": "no-store",
+    }
+    if timings:
+        headers["Server-Timing"] = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+        if "total" in timings:
+            headers["X-Processing-Time"] = f"{timings['total']:.3f}"
+
+    return Response(content=data, media_type=OUTPUT_FORMATS[output_format], headers=headers)
+
+
+class Timer:
+    """Collects named durations for the Server-Timing header"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.timings: Dict[str, float] = {}
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.timings[name] = now - self._last
+        self._last = now
+
+    def finish(self) -> Dict[str, float]:
+        self.timings["total"] = time.perf_counter() - self.started
+        return self.timings
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference executor already has too much queued work"""
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for CPU-bound image work (rembg inference, encoding)
+
+    onnxruntime and Pillow release the GIL while they work, so threads keep the
+    event loop responsive without copying sessions into extra processes.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and await its result
+        """
+        with self._lock:
+            if self.max_queue and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise InferenceQueueFull(f"Inference queue is full ({self._queued} waiting)")
+            self._queued += 1
+
+        future = self._executor.submit(self._call, fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _on_done(self, future):
+        with self._lock:
+            if future.cancelled():
+                # Cancelled before a worker picked it up
+                self._queued -= 1
+            elif future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def get_stats(self) -> dict:
+        """Get queue depth and in-flight counters"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "saturated": self._in_flight >= self.max_workers,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# Shared executor for this worker
+inference_executor = InferenceExecutor(
+    max_workers=int(os.getenv("INFERENCE_WORKERS", "2")),
+    max_queue=int(os.getenv("INFERENCE_MAX_QUEUE", "32")),
+)
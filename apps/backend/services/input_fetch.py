@@ -0,0 +1,220 @@
+import os
+import socket
+import asyncio
+import ipaddress
+import logging
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+import httpx
+import httpcore
+
+logger = logging.getLogger(__name__)
+
+# Limits for fetching user-supplied image URLs on this server (result cache keys, local engines)
+INPUT_FETCH_MAX_MB = int(os.getenv("INPUT_FETCH_MAX_MB", "25"))
+INPUT_FETCH_MAX_REDIRECTS = int(os.getenv("INPUT_FETCH_MAX_REDIRECTS", "3"))
+INPUT_FETCH_TIMEOUT = float(os.getenv("INPUT_FETCH_TIMEOUT", "30"))
+# Hosts (host or host:port) fetched even though they resolve to private or loopback
+# addresses, e.g. 127.0.0.1:8765 for devtools/fake_replicate.py. This server's own
+# SERVER_BASE_URL is always allowed.
+INPUT_FETCH_ALLOWED_HOSTS = os.getenv("INPUT_FETCH_ALLOWED_HOSTS", "")
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://staticapi.kraftey.com")
+# Served at SERVER_BASE_URL/uploads; URLs there are read from disk instead of fetched over HTTP
+UPLOAD_DIR = Path("uploads")
+
+
+class InputFetchError(Exception):
+    """The URL was refused (scheme, private address, too large) or couldn't be fetched"""
+    pass
+
+
+def parse_hosts(value: str) -> List[str]:
+    return [host.strip().lower() for host in value.split(",") if host.strip()]
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address)
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+# (host, addresses) check_url approved for the request in flight, None for allowed hosts
+_pinned: ContextVar[Optional[Tuple[str, List[str]]]] = ContextVar("input_fetch_pinned", default=None)
+
+
+class PinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Connects to the addresses check_url approved instead of resolving the host
+    again, so DNS can't swap in a private address between check and connect.
+    TLS still verifies the certificate against the host name.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend):
+        self._backend = backend
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        pinned = _pinned.get()
+        if pinned is None:
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        pinned_host, addresses = pinned
+        if host != pinned_host:
+            raise httpcore.ConnectError(f"Refusing to connect to unchecked host {host}")
+
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+class InputFetcher:
+    """
+    Downloads images from user-supplied URLs without opening the server up to SSRF
+
+    Only http(s) URLs whose host resolves to public addresses are fetched, each
+    redirect hop is checked the same way, and the body is streamed with a size
+    cap instead of being read whole. Connections go to the checked addresses.
+    This server's own /uploads URLs are read straight from the upload directory.
+    """
+
+    def __init__(self, max_bytes: int, max_redirects: int, timeout: float, allowed_hosts: List[str]):
+        self.max_bytes = max_bytes
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.allowed_hosts = set(allowed_hosts)
+        self.uploads_url = f"{SERVER_BASE_URL}/uploads/"
+        self.upload_dir = UPLOAD_DIR
+        self._http: Optional[httpx.AsyncClient] = None
+        self._fetched = 0
+        self._read_locally = 0
+        self._refused = 0
+
+    async def check_url(self, url: str) -> Optional[List[str]]:
+        """
+        Raise InputFetchError unless url is http(s) on a public (or allowed) host,
+        return the addresses it resolved to (None for allowed hosts)
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise InputFetchError(f"Only http(s) image URLs can be fetched: {url}")
+        host = parsed.hostname.lower()
+        if host in self.allowed_hosts or parsed.netloc.lower() in self.allowed_hosts:
+            return None
+
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, parsed.port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM
+            )
+        except socket.gaierror as e:
+            raise InputFetchError(f"Could not resolve {host}: {str(e)}")
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        for address in addresses:
+            if not is_public_address(address):
+                raise InputFetchError(f"Refusing to fetch {host}, it resolves to a non-public address")
+        return addresses
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            transport = httpx.AsyncHTTPTransport()
+            # httpx has no option for the connection pool's network backend
+            transport._pool._network_backend = PinnedNetworkBackend(transport._pool._network_backend)
+            self._http = httpx.AsyncClient(
+                transport=transport, timeout=httpx.Timeout(self.timeout, connect=10.0), follow_redirects=False
+            )
+        return self._http
+
+    def _upload_path(self, url: str) -> Optional[Path]:
+        """File in the upload directory for one of this server's /uploads URLs"""
+        if not url.startswith(self.uploads_url):
+            return None
+        # /uploads serves the decoded path, so "%20" in the URL is a space on disk
+        path = (self.upload_dir / unquote(url[len(self.uploads_url):].split("?", 1)[0])).resolve()
+        if not path.is_relative_to(self.upload_dir.resolve()) or not path.is_file():
+            return None
+        return path
+
+    def _read_upload(self, path: Path) -> bytes:
+        if path.stat().st_size > self.max_bytes:
+            raise InputFetchError(f"Image is larger than {self.max_bytes} bytes")
+        return path.read_bytes()
+
+    async def fetch(self, url: str) -> bytes:
+        """Download an image, following at most max_redirects checked redirects"""
+        path = self._upload_path(url)
+        if path is not None:
+            try:
+                data = await asyncio.to_thread(self._read_upload, path)
+            except InputFetchError:
+                self._refused += 1
+                raise
+            self._read_locally += 1
+            return data
+
+        http = self._client()
+        token = _pinned.set(None)
+        try:
+            for _ in range(self.max_redirects + 1):
+                addresses = await self.check_url(url)
+                _pinned.set(None if addresses is None else (httpx.URL(url).host, addresses))
+                async with http.stream("GET", url) as response:
+                    if response.is_redirect:
+                        url = urljoin(url, response.headers.get("location", ""))
+                        continue
+                    response.raise_for_status()
+                    data = await self._read_capped(response)
+                    self._fetched += 1
+                    return data
+            raise InputFetchError(f"Too many redirects fetching {url}")
+        except InputFetchError:
+            self._refused += 1
+            raise
+        finally:
+            _pinned.reset(token)
+
+    async def _read_capped(self, response: httpx.Response) -> bytes:
+        length = response.headers.get("content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise InputFetchError(f"Image is larger than {self.max_bytes} bytes")
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise InputFetchError(f"Image is larger than {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def get_stats(self) -> dict:
+        return {
+            "max_bytes": self.max_bytes,
+            "max_redirects": self.max_redirects,
+            "allowed_hosts": sorted(self.allowed_hosts),
+            "fetched": self._fetched,
+            "read_locally": self._read_locally,
+            "refused": self._refused,
+        }
+
+
+# Global fetcher, one per worker
+input_fetcher = InputFetcher(
+    max_bytes=INPUT_FETCH_MAX_MB * 1024 * 1024,
+    max_redirects=INPUT_FETCH_MAX_REDIRECTS,
+    timeout=INPUT_FETCH_TIMEOUT,
+    allowed_hosts=parse_hosts(INPUT_FETCH_ALLOWED_HOSTS) + parse_hosts(urlparse(SERVER_BASE_URL).netloc),
+)
@@ -0,0 +1,342 @@
+import os
+import random
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from replicate.exceptions import ReplicateError
+from services.task_store import task_store
+from services.replicate_client import replicate_client, REPLICATE_CONCURRENCY_PER_MODEL
+from services import single_flight
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first. Interactive requests (sync routes) jump ahead of queued async ones
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Jobs running at once per model in this worker, e.g. "black-forest-labs/flux-kontext-dev=2"
+JOB_CONCURRENCY_PER_MODEL = int(os.getenv("JOB_CONCURRENCY_PER_MODEL", str(REPLICATE_CONCURRENCY_PER_MODEL)))
+JOB_CONCURRENCY_OVERRIDES = os.getenv("JOB_CONCURRENCY_OVERRIDES", "")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "1.0"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "30"))
+# How often running jobs are checked for cancellations made by other workers
+JOB_CANCEL_CHECK_INTERVAL = float(os.getenv("JOB_CANCEL_CHECK_INTERVAL", "1.0"))
+
+# Replicate reports throttling and capacity problems only in the error text
+TRANSIENT_ERROR_MARKERS = ("rate limit", "throttled", "too many requests", "temporarily unavailable",
+                           "please retry", "service unavailable", "bad gateway", "gateway timeout")
+
+
+class JobCancelled(Exception):
+    """The job's task was cancelled before it finished"""
+    pass
+
+
+def is_transient(error: Optional[BaseException]) -> bool:
+    """Errors worth retrying: network failures, throttling and 5xx responses (checked through wrapped causes)"""
+    while error is not None:
+        if isinstance(error, httpx.TransportError):
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        if isinstance(error, ReplicateError):
+            message = str(error).lower()
+            return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+        error = error.__cause__
+    return False
+
+
+def parse_overrides(value: str) -> Dict[str, int]:
+    overrides = {}
+    for item in value.split(","):
+        model, _, limit = item.strip().rpartition("=")
+        if model and limit.isdigit():
+            overrides[model] = int(limit)
+    return overrides
+
+
+class Job:
+    """One queued unit of work for a task in the task store"""
+
+    def __init__(
+        self,
+        kind: str,
+        task_id: str,
+        model: str,
+        fn: Callable[[], Awaitable[dict]],
+        priority: int,
+        on_success: Optional[Callable[[dict], Awaitable[Any]]] = None,
+    ):
+        self.kind = kind
+        self.task_id = task_id
+        self.model = model
+        self.fn = fn
+        self.priority = priority
+        self.on_success = on_success
+        self.attempts = 0
+        self.aborted = False
+        self.runner: Optional[asyncio.Task] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.kind, self.task_id
+
+
+class JobScheduler:
+    """
+    Runs every AI job (upscale, background removal, watermark removal) for this worker
+
+    Each model has a priority queue drained by a fixed number of worker
+    coroutines, so a burst on one model can't starve another and interactive
+    requests go first. A job is an async function returning the fields that
+    complete its task; the scheduler records the outcome in the task store,
+    retries transient errors with exponential backoff (the slot is released
+    while waiting), and supports cancelling queued or running jobs.
+    """
+
+    def __init__(
+        self,
+        concurrency_per_model: int = JOB_CONCURRENCY_PER_MODEL,
+        concurrency_overrides: Optional[Dict[str, int]] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_base_delay: float = JOB_RETRY_BASE_DELAY,
+        retry_max_delay: float = JOB_RETRY_MAX_DELAY,
+        cancel_check_interval: float = JOB_CANCEL_CHECK_INTERVAL,
+    ):
+        self.concurrency_per_model = concurrency_per_model
+        self.concurrency_overrides = concurrency_overrides or {}
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.cancel_check_interval = cancel_check_interval
+
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._workers: Dict[str, List[asyncio.Task]] = {}
+        self._jobs: Dict[Tuple[str, str], Job] = {}
+        self._seq = itertools.count()
+        self._watcher: Optional[asyncio.Task] = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._cancelled = 0
+        self._handed_off = 0
+
+    def concurrency_for(self, model: str) -> int:
+        return self.concurrency_overrides.get(model, self.concurrency_per_model)
+
+    def submit(
+        self,
+        kind: str,
+        task_id: str,
+        model: str,
+        fn: Callable[[], Awaitable[dict]],
+        priority: int = PRIORITY_NORMAL,
+        on_success: Optional[Callable[[dict], Awaitable[Any]]] = None,
+    ) -> Job:
+        """
+        Queue a job for a task that already exists in the task store with status "processing"
+
+        fn returns the fields that complete the task (e.g. {"upscaled_url": ...}),
+        or None when something else will complete it (a prediction with a
+        webhook); on_success runs after the task is marked completed.
+        """
+        model = replicate_client.model_name(model)
+        job = Job(kind, task_id, model, fn, priority, on_success)
+        self._jobs[job.key] = job
+        self._submitted += 1
+        self._enqueue(job)
+        self._ensure_workers(model)
+        return job
+
+    async def run(self, *args, **kwargs) -> dict:
+        """
+        Submit a job and wait for it, returns the completed task
+
+        Raises the job's error if it failed and JobCancelled if it was cancelled.
+        The job keeps running if the caller goes away.
+        """
+        job = self.submit(*args, **kwargs)
+        return await asyncio.shield(job.future)
+
+    async def cancel(self, kind: str, task_id: str) -> Optional[dict]:
+        """
+        Cancel a processing task, wherever its job is running
+
+        Returns the cancelled task, or None if it had already finished. A job
+        shared with other tasks (single flight) keeps running for them.
+        """
+        task = await task_store.atransition(
+            kind, task_id, ("processing",),
+            status="cancelled",
+            completed_at=datetime.now().isoformat()
+        )
+        if task is None:
+            return None
+        logger.info(f"Cancelled {kind} task {task_id}")
+
+        job = self._jobs.get((kind, task_id))
+        if job is not None:
+            await self._abort(job, task)
+        elif task.get("prediction_id") and not await task_store.run(single_flight.has_followers, task, kind, task_id):
+            # Webhook jobs have no local runner, stop the prediction itself
+            try:
+                await replicate_client.cancel_prediction(task["prediction_id"])
+            except Exception as e:
+                logger.warning(f"Failed to cancel prediction {task['prediction_id']}: {str(e)}")
+        return task
+
+    async def _abort(self, job: Job, task: dict):
+        if await task_store.run(single_flight.has_followers, task, job.kind, job.task_id):
+            return
+        job.aborted = True
+        if job.runner is not None:
+            job.runner.cancel()
+
+    def _enqueue(self, job: Job, delay: float = 0):
+        queue = self._queues.get(job.model)
+        if queue is None:
+            queue = self._queues[job.model] = asyncio.PriorityQueue()
+        item = (job.priority, next(self._seq), job)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, queue.put_nowait, item)
+        else:
+            queue.put_nowait(item)
+
+    def _ensure_workers(self, model: str):
+        # Created lazily so they belong to the worker's running event loop
+        workers = [worker for worker in self._workers.get(model, []) if not worker.done()]
+        for _ in range(self.concurrency_for(model) - len(workers)):
+            workers.append(asyncio.create_task(self._worker(model)))
+        self._workers[model] = workers
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_cancellations())
+
+    async def _worker(self, model: str):
+        queue = self._queues[model]
+        while True:
+            _, _, job = await queue.get()
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"Job runner error for {job.kind} task {job.task_id}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def _execute(self, job: Job):
+        task = await task_store.aget(job.kind, job.task_id)
+        if task is None or (task.get("status") != "processing" and not await task_store.run(single_flight.has_followers, task, job.kind, job.task_id)):
+            # Cancelled (or deleted) while queued, and nobody else needs the result
+            self._finish(job, error=JobCancelled(f"Task {job.task_id} was cancelled"))
+            return
+
+        job.attempts += 1
+        if job.attempts > 1:
+            await task_store.aupdate(job.kind, job.task_id, attempts=job.attempts)
+        job.runner = asyncio.ensure_future(job.fn())
+        try:
+            fields = await job.runner
+        except asyncio.CancelledError:
+            if not job.aborted:
+                # The worker itself is shutting down
+                job.runner.cancel()
+                raise
+            self._cancelled += 1
+            self._finish(job, error=JobCancelled(f"Task {job.task_id} was cancelled"))
+            return
+        except Exception as e:
+            if is_transient(e) and job.attempts < self.max_attempts and not job.aborted:
+                delay = min(self.retry_base_delay * 2 ** (job.attempts - 1), self.retry_max_delay)
+                delay *= random.uniform(0.8, 1.2)
+                self._retried += 1
+                logger.warning(f"{job.kind} task {job.task_id} attempt {job.attempts} failed ({str(e)}), retrying in {delay:.1f}s")
+                self._enqueue(job, delay)
+                return
+
+            self._failed += 1
+            logger.error(f"{job.kind} task {job.task_id} failed: {str(e)}")
+            await task_store.run(single_flight.complete_task,
+                job.kind, job.task_id,
+                status="failed",
+                error=getattr(e, "detail", None) or str(e),
+                completed_at=datetime.now().isoformat()
+            )
+            self._finish(job, error=e)
+            return
+        finally:
+            job.runner = None
+
+        if fields is None:
+            # Handed off: something else completes the task (a Replicate webhook)
+            self._handed_off += 1
+            self._finish(job)
+            return
+
+        task = await task_store.run(single_flight.complete_task,
+            job.kind, job.task_id,
+            status="completed",
+            completed_at=datetime.now().isoformat(),
+            **fields
+        )
+        if task is None:
+            # Cancelled while the last attempt was finishing
+            self._finish(job, error=JobCancelled(f"Task {job.task_id} was cancelled"))
+            return
+        self._completed += 1
+        if job.on_success is not None:
+            try:
+                await job.on_success(fields)
+            except Exception as e:
+                logger.warning(f"Post-completion step failed for {job.kind} task {job.task_id}: {str(e)}")
+        self._finish(job, result=task)
+
+    def _finish(self, job: Job, result: Optional[dict] = None, error: Optional[Exception] = None):
+        self._jobs.pop(job.key, None)
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+            # Nobody may be waiting (async routes), don't log "exception never retrieved"
+            job.future.exception()
+        else:
+            job.future.set_result(result)
+
+    async def _watch_cancellations(self):
+        """Abort running jobs whose task another worker cancelled"""
+        while self._jobs:
+            await asyncio.sleep(self.cancel_check_interval)
+            running: Dict[str, List[Job]] = {}
+            for job in self._jobs.values():
+                if job.runner is not None and not job.aborted:
+                    running.setdefault(job.kind, []).append(job)
+            # One store read per kind per tick, however many jobs are running
+            for kind, jobs in running.items():
+                tasks = await task_store.aget_many(kind, [job.task_id for job in jobs])
+                for job in jobs:
+                    task = tasks.get(job.task_id)
+                    if task is not None and task.get("status") == "cancelled" and job.runner is not None:
+                        await self._abort(job, task)
+
+    def get_stats(self) -> dict:
+        return {
+            "queued": {model: queue.qsize() for model, queue in self._queues.items() if queue.qsize()},
+            "running": sum(1 for job in self._jobs.values() if job.runner is not None),
+            "concurrency_per_model": self.concurrency_per_model,
+            "concurrency_overrides": self.concurrency_overrides,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "retried": self._retried,
+            "cancelled": self._cancelled,
+            "handed_off": self._handed_off,
+        }
+
+
+# Global scheduler, one per worker
+job_scheduler = JobScheduler(concurrency_overrides=parse_overrides(JOB_CONCURRENCY_OVERRIDES))
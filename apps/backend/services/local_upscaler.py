@@ -0,0 +1,192 @@
+import os
+import zlib
+import struct
+import tempfile
+from io import BytesIO
+from typing import Iterable, Iterator, Optional, Tuple
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Input is cut into tiles of this many pixels (per side), each upscaled on its own
+LOCAL_UPSCALE_TILE_SIZE = int(os.getenv("LOCAL_UPSCALE_TILE_SIZE", "256"))
+# Input pixels read around each tile so Lanczos and the sharpening blur see their neighbours
+LOCAL_UPSCALE_HALO = int(os.getenv("LOCAL_UPSCALE_HALO", "8"))
+LOCAL_UPSCALE_MAX_SCALE = int(os.getenv("LOCAL_UPSCALE_MAX_SCALE", "4"))
+# Largest output allowed, in megapixels (the memory-mapped scratch file is 3-4 bytes per pixel)
+LOCAL_UPSCALE_MAX_OUTPUT_MP = float(os.getenv("LOCAL_UPSCALE_MAX_OUTPUT_MP", "256"))
+# Edge-aware unsharp mask: strength, blur radius in output pixels, and the gradient
+# (0-255 luma per pixel) at which an edge gets the full strength
+LOCAL_UPSCALE_SHARPEN_AMOUNT = float(os.getenv("LOCAL_UPSCALE_SHARPEN_AMOUNT", "0.8"))
+LOCAL_UPSCALE_SHARPEN_RADIUS = float(os.getenv("LOCAL_UPSCALE_SHARPEN_RADIUS", "1.5"))
+LOCAL_UPSCALE_EDGE_THRESHOLD = float(os.getenv("LOCAL_UPSCALE_EDGE_THRESHOLD", "12"))
+# Scratch files for the memory-mapped output
+LOCAL_UPSCALE_SCRATCH_DIR = os.getenv("LOCAL_UPSCALE_SCRATCH_DIR") or None
+LOCAL_UPSCALE_PNG_LEVEL = int(os.getenv("LOCAL_UPSCALE_PNG_LEVEL", "3"))
+
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Rows of output read back and fed to zlib at a time when writing the PNG
+PNG_BAND_ROWS = 64
+
+
+def validate_scale(scale: int, width: int, height: int):
+    """Raise ValueError when a scale factor or the resulting output size isn't supported"""
+    if scale < 2 or scale > LOCAL_UPSCALE_MAX_SCALE:
+        raise ValueError(f"Local upscaling supports scale factors 2-{LOCAL_UPSCALE_MAX_SCALE}")
+    output_mp = width * scale * height * scale / 1e6
+    if output_mp > LOCAL_UPSCALE_MAX_OUTPUT_MP:
+        raise ValueError(f"Output would be {output_mp:.0f} MP, the local limit is {LOCAL_UPSCALE_MAX_OUTPUT_MP:.0f} MP")
+
+
+def edge_aware_sharpen(
+    image: Image.Image,
+    amount: float = LOCAL_UPSCALE_SHARPEN_AMOUNT,
+    radius: float = LOCAL_UPSCALE_SHARPEN_RADIUS,
+    edge_threshold: float = LOCAL_UPSCALE_EDGE_THRESHOLD,
+) -> np.ndarray:
+    """
+    Unsharp mask weighted by local gradient strength, returns uint8 pixels
+
+    Detail is boosted fully on edges and fades out in flat areas, so
+    resampling softness is undone without amplifying noise or JPEG blocks.
+    Alpha, if present, is left as resampled.
+    """
+    pixels = np.asarray(image, dtype=np.float32).copy()
+    if amount <= 0:
+        return pixels.astype(np.uint8)
+
+    rgb = pixels[..., :3]
+    blurred = np.asarray(image.filter(ImageFilter.GaussianBlur(radius)), dtype=np.float32)[..., :3]
+    gradient_y, gradient_x = np.gradient(blurred @ LUMA_WEIGHTS)
+    weight = np.clip(np.hypot(gradient_x, gradient_y) / edge_threshold, 0, 1)
+
+    rgb += (amount * weight)[..., None] * (rgb - blurred)
+    np.clip(pixels, 0, 255, out=pixels)
+    return pixels.astype(np.uint8)
+
+
+def upscale_tile(
+    image: Image.Image,
+    box: Tuple[int, int, int, int],
+    scale: int,
+    halo: int = LOCAL_UPSCALE_HALO,
+    sharpen: float = LOCAL_UPSCALE_SHARPEN_AMOUNT,
+) -> np.ndarray:
+    """
+    Upscale one input tile (left, top, right, bottom) and return its output pixels
+
+    The tile is resampled together with a halo of neighbouring pixels that is
+    cropped away afterwards. Scale factors are whole numbers, so output pixels
+    line up exactly with a full-image resize and tiles join without seams.
+    """
+    left, top, right, bottom = box
+    crop_left, crop_top = max(left - halo, 0), max(top - halo, 0)
+    crop_right, crop_bottom = min(right + halo, image.width), min(bottom + halo, image.height)
+
+    crop = image.crop((crop_left, crop_top, crop_right, crop_bottom))
+    upscaled = crop.resize(((crop_right - crop_left) * scale, (crop_bottom - crop_top) * scale), Image.LANCZOS)
+    pixels = edge_aware_sharpen(upscaled, amount=sharpen)
+
+    offset_x, offset_y = (left - crop_left) * scale, (top - crop_top) * scale
+    return pixels[offset_y:offset_y + (bottom - top) * scale, offset_x:offset_x + (right - left) * scale]
+
+
+def write_png(path: str, width: int, height: int, channels: int, bands: Iterable[np.ndarray],
+              compress_level: int = LOCAL_UPSCALE_PNG_LEVEL):
+    """
+    Write a PNG from bands of (rows, width * channels) uint8 pixels
+
+    Only one band is in memory at a time. Rows use PNG's Sub filter,
+    computed with NumPy, which compresses photos far better than no filter.
+    """
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    row_bytes = width * channels
+
+    def chunk(f, tag: bytes, data: bytes):
+        f.write(struct.pack(">I", len(data)))
+        f.write(tag)
+        f.write(data)
+        f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+
+    compressor = zlib.compressobj(compress_level)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        for band in bands:
+            rows = np.empty((band.shape[0], row_bytes + 1), dtype=np.uint8)
+            rows[:, 0] = 1  # Sub filter: each byte minus the one a pixel to its left
+            rows[:, 1:channels + 1] = band[:, :channels]
+            np.subtract(band[:, channels:], band[:, :-channels], out=rows[:, channels + 1:])
+            data = compressor.compress(rows.tobytes())
+            if data:
+                chunk(f, b"IDAT", data)
+        chunk(f, b"IDAT", compressor.flush())
+        chunk(f, b"IEND", b"")
+
+
+def read_bands(path: str, height: int, row_bytes: int, band_rows: int = PNG_BAND_ROWS) -> Iterator[np.ndarray]:
+    """Read a raw pixel file back band by band with plain reads (nothing stays mapped)"""
+    with open(path, "rb") as f:
+        for top in range(0, height, band_rows):
+            rows = min(band_rows, height - top)
+            yield np.fromfile(f, dtype=np.uint8, count=rows * row_bytes).reshape(rows, row_bytes)
+
+
+def upscale_image(
+    image: Image.Image,
+    output_path: str,
+    scale: int,
+    tile_size: int = LOCAL_UPSCALE_TILE_SIZE,
+    sharpen: float = LOCAL_UPSCALE_SHARPEN_AMOUNT,
+    scratch_dir: Optional[str] = LOCAL_UPSCALE_SCRATCH_DIR,
+) -> Tuple[int, int]:
+    """
+    Upscale an image tile by tile into a PNG file (blocking), returns the output size
+
+    The output lives in a raw scratch file. Each row of tiles is written
+    through its own memory map, which is unmapped before the next row, and
+    the PNG is then encoded from the file band by band. Memory use depends
+    on the tile size and image width, never on the full output size.
+    """
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    validate_scale(scale, image.width, image.height)
+
+    channels = 4 if has_alpha else 3
+    out_width, out_height = image.width * scale, image.height * scale
+    row_bytes = out_width * channels
+    fd, scratch_path = tempfile.mkstemp(suffix=".upscale", dir=scratch_dir)
+    os.close(fd)
+    try:
+        os.truncate(scratch_path, out_height * row_bytes)
+        for top in range(0, image.height, tile_size):
+            bottom = min(top + tile_size, image.height)
+            band = np.memmap(scratch_path, dtype=np.uint8, mode="r+", offset=top * scale * row_bytes,
+                             shape=((bottom - top) * scale, out_width, channels))
+            for left in range(0, image.width, tile_size):
+                right = min(left + tile_size, image.width)
+                band[:, left * scale:right * scale] = upscale_tile(image, (left, top, right, bottom), scale, sharpen=sharpen)
+            band.flush()
+            del band
+
+        write_png(output_path, out_width, out_height, channels, read_bands(scratch_path, out_height, row_bytes))
+    finally:
+        os.unlink(scratch_path)
+    return out_width, out_height
+
+
+def upscale_bytes(image_data: bytes, output_path: str, scale: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """Decode image bytes and upscale them into output_path, returns (input size, output size)"""
+    image = Image.open(BytesIO(image_data))
+    image.load()
+    out_width, out_height = upscale_image(image, output_path, scale)
+    return (out_width // scale, out_height // scale), (out_width, out_height)
+
+
+def get_options() -> dict:
+    """Settings that change the output, used in cache keys"""
+    return {
+        "halo": LOCAL_UPSCALE_HALO,
+        "sharpen": [LOCAL_UPSCALE_SHARPEN_AMOUNT, LOCAL_UPSCALE_SHARPEN_RADIUS, LOCAL_UPSCALE_EDGE_THRESHOLD],
+    }
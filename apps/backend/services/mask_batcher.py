@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from PIL import Image
+from services.inference_executor import inference_executor
+
+logger = logging.getLogger(__name__)
+
+
+class MaskBatchScheduler:
+    """
+    Micro-batching scheduler in front of the rembg engine
+
+    Concurrent requests for the same model are collected for up to window_ms,
+    or until max_batch_size images are waiting, then run as one ONNX batch on the
+    inference executor. Each waiting handler gets back its own mask.
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[List[Image.Image], str], List[Image.Image]],
+        max_batch_size: int,
+        window_ms: float,
+        can_batch: Optional[Callable[[str], bool]] = None,
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_ms = max(0.0, window_ms)
+        self.can_batch = can_batch or (lambda model_name: True)
+        self._pending: Dict[str, List[Tuple[Image.Image, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._batches = 0
+        self._images = 0
+        self._largest_batch = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    async def predict(self, image: Image.Image, model_name: str) -> Image.Image:
+        """
+        Queue an image for the next batch and wait for its mask
+        """
+        if not self.enabled or not self.can_batch(model_name):
+            masks = await inference_executor.run(self.predict_batch, [image], model_name)
+            self._record(1)
+            return masks[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(model_name, [])
+        pending.append((image, future))
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(model_name)
+        elif len(pending) == 1:
+            self._timers[model_name] = loop.call_later(self.window_ms / 1000.0, self._flush, model_name)
+
+        return await future
+
+    def _flush(self, model_name: str):
+        timer = self._timers.pop(model_name, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(model_name, [])
+        if batch:
+            asyncio.ensure_future(self._run_batch(model_name, batch))
+
+    async def _run_batch(self, model_name: str, batch: List[Tuple[Image.Image, asyncio.Future]]):
+        images = [image for image, _ in batch]
+        try:
+            masks = await inference_executor.run(self.predict_batch, images, model_name)
+        except Exception as e:
+            logger.error(f"Batched mask prediction failed for {len(images)} images: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._record(len(images))
+        for (_, future), mask in zip(batch, masks):
+            if not future.done():
+                future.set_result(mask)
+
+    def _record(self, batch_size: int):
+        self._batches += 1
+        self._images += batch_size
+        self._largest_batch = max(self._largest_batch, batch_size)
+
+    def get_stats(self) -> dict:
+        """Get batching settings and counters"""
+        return {
+            "enabled": self.enabled,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window_ms,
+            "waiting": sum(len(p) for p in self._pending.values()),
+            "batches": self._batches,
+            "images": self._images,
+            "average_batch_size": round(self._images / self._batches, 2) if self._batches else 0,
+            "largest_batch": self._largest_batch,
+        }
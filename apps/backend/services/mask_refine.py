@@ -0,0 +1,117 @@
+import numpy as np
+from typing import Optional, Tuple
+from PIL import Image, ImageFilter
+
+# Mask values strictly between these are treated as uncertain edge pixels
+EDGE_LOW = 8
+EDGE_HIGH = 247
+
+
+def downscale_for_inference(image: Image.Image, max_side: int) -> Image.Image:
+    """
+    Return a copy no larger than max_side on its long edge for mask prediction
+    """
+    if max(image.size) <= max_side:
+        return image
+
+    scale = max_side / float(max(image.size))
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap lets Pillow do a cheap integer reduce before the filtered resize
+    return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def _box_mean(values: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2r+1)x(2r+1) window using an integral image, edges replicated"""
+    window = 2 * radius + 1
+    rows, cols = values.shape
+    padded = np.pad(values, ((radius + 1, radius), (radius + 1, radius)), mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    total = (
+        integral[window:, window:]
+        - integral[:rows, window:]
+        - integral[window:, :cols]
+        + integral[:rows, :cols]
+    )
+    return total / float(window * window)
+
+
+def _guided_filter(guide: np.ndarray, source: np.ndarray, radius: int, eps: float) -> np.ndarray:
+    """Edge-preserving guided filter (He et al.) of source steered by guide"""
+    mean_i = _box_mean(guide, radius)
+    mean_p = _box_mean(source, radius)
+    cov_ip = _box_mean(guide * source, radius) - mean_i * mean_p
+    var_i = _box_mean(guide * guide, radius) - mean_i * mean_i
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return _box_mean(a, radius) * guide + _box_mean(b, radius)
+
+
+def edge_band(mask: Image.Image, dilate: int = 2) -> Image.Image:
+    """Binary mask ('L', 0/255) of uncertain pixels around the object boundary"""
+    values = np.asarray(mask, dtype=np.uint8)
+    band = ((values > EDGE_LOW) & (values < EDGE_HIGH)).astype(np.uint8) * 255
+    band_image = Image.fromarray(band, mode="L")
+    if dilate > 0:
+        band_image = band_image.filter(ImageFilter.MaxFilter(2 * dilate + 1))
+    return band_image
+
+
+def upsample_and_refine(
+    image: Image.Image,
+    small_mask: Image.Image,
+    radius: Optional[int] = None,
+    eps: float = 1e-4,
+    tile_size: int = 512,
+) -> Image.Image:
+    """
+    Upsample a low-resolution mask to the image size and refine only its edge band
+
+    The mask is upsampled bilinearly. Tiles of the full-resolution image that
+    touch the edge band are passed through a guided filter steered by the
+    original pixels, so the boundary follows real image edges. Pixels outside
+    the band keep the upsampled value. The filter radius defaults to about four
+    low-resolution pixels so it spans the blur introduced by upsampling.
+    """
+    if radius is None:
+        scale = max(image.width / float(small_mask.width), image.height / float(small_mask.height))
+        radius = max(4, int(round(4 * scale)))
+
+    mask = small_mask.convert("L").resize(image.size, Image.BILINEAR)
+    band = edge_band(small_mask.convert("L")).resize(image.size, Image.NEAREST)
+
+    upsampled = np.asarray(mask, dtype=np.uint8)
+    alpha = upsampled.copy()
+    band_values = np.asarray(band, dtype=np.uint8)
+    if not band_values.any():
+        return mask
+
+    gray = image.convert("L")
+    height, width = alpha.shape
+
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            bottom = min(top + tile_size, height)
+            right = min(left + tile_size, width)
+            tile_band = band_values[top:bottom, left:right] > 0
+            if not tile_band.any():
+                continue
+
+            # Pad the tile so the filter window sees real neighbours at tile seams
+            box = _padded_box((left, top, right, bottom), radius, (width, height))
+            guide = np.asarray(gray.crop(box), dtype=np.float32) / 255.0
+            source = upsampled[box[1]:box[3], box[0]:box[2]].astype(np.float32) / 255.0
+            refined = _guided_filter(guide, source, radius, eps)
+
+            inner = refined[top - box[1]:bottom - box[1], left - box[0]:right - box[0]]
+            inner = np.clip(inner * 255.0 + 0.5, 0, 255).astype(np.uint8)
+            tile_alpha = alpha[top:bottom, left:right]
+            tile_alpha[tile_band] = inner[tile_band]
+
+    return Image.fromarray(alpha, mode="L")
+
+
+def _padded_box(box: Tuple[int, int, int, int], pad: int, size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    left, top, right, bottom = box
+    width, height = size
+    return (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
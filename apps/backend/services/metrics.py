@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+from contextlib import nullcontext
+from starlette.routing import Match
+from services.task_store import task_store
+
+logger = logging.getLogger(__name__)
+
+# Directory the gunicorn workers write their metrics to (set in gunicorn.conf.py);
+# /metrics then reports the sum over all workers, not just the one that answered.
+# prometheus_client reads it when imported, so it has to be in the environment first.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+# Try to import prometheus_client, metrics are recorded nowhere if not available
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess,
+    )
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST if PROMETHEUS_AVAILABLE else "text/plain"
+
+# Bucket upper bounds in seconds; sync routes and predictions can take minutes
+HTTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PREDICTION_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+INFERENCE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+ENCODE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Label for requests no route matched, so unknown paths don't each get a series
+UNMATCHED_ROUTE = "unmatched"
+
+
+class _NoopMetric:
+    """Stands in for a metric when prometheus_client isn't installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def time(self):
+        return nullcontext()
+
+
+def _histogram(name: str, documentation: str, labels: list, buckets: tuple):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return Histogram(name, documentation, labels, buckets=buckets)
+
+
+def _gauge(name: str, documentation: str, labels: list):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    # livesum: add up the workers that are still running
+    return Gauge(name, documentation, labels, multiprocess_mode="livesum")
+
+
+HTTP_REQUEST_SECONDS = _histogram(
+    "http_request_duration_seconds", "Time to answer a request, by route template", ["method", "route", "status"],
+    HTTP_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = _gauge("http_requests_in_flight", "Requests being answered, by route template", ["method", "route"])
+REPLICATE_PREDICTION_SECONDS = _histogram(
+    "replicate_prediction_duration_seconds", "Replicate predictions from create to finish, by model and outcome",
+    ["model", "outcome"], PREDICTION_BUCKETS,
+)
+CLOUDINARY_UPLOAD_SECONDS = _histogram(
+    "cloudinary_upload_duration_seconds", "Cloudinary image uploads", ["outcome"], UPLOAD_BUCKETS,
+)
+REMBG_INFERENCE_SECONDS = _histogram(
+    "rembg_inference_duration_seconds", "rembg background removal / mask prediction calls", ["model"],
+    INFERENCE_BUCKETS,
+)
+IMAGE_ENCODE_SECONDS = _histogram(
+    "image_encode_duration_seconds", "Encoding output images (PNG, WebP, alpha masks)", ["format"], ENCODE_BUCKETS,
+)
+
+
+def route_template(scope: dict) -> str:
+    """The path of the route a request will hit ("/upscale/status/{task_id}"), not the raw URL"""
+    router = getattr(scope.get("app"), "router", None)
+    partial = None
+    for route in getattr(router, "routes", []):
+        if not hasattr(route, "path"):
+            continue
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # Right path, wrong method (answered with a 405)
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    """
+    Records latency and in-flight requests per route template
+
+    A plain ASGI middleware, so streamed responses (downloads, ZIPs, SSE)
+    count as in flight until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROMETHEUS_AVAILABLE:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_SECONDS.labels(method, route, str(status)).observe(time.perf_counter() - start)
+
+
+class TaskStoreCollector:
+    """Task counts per kind and status, read from the shared task store at scrape time"""
+
+    def collect(self):
+        gauge = GaugeMetricFamily("task_store_tasks", "Tasks in the task store, by kind and status", labels=["kind", "status"])
+        try:
+            counts = task_store.all_counts()
+        except Exception as e:
+            logger.warning(f"Could not read task counts for metrics: {str(e)}")
+            counts = {}
+        for kind, statuses in sorted(counts.items()):
+            for status, n in sorted(statuses.items()):
+                gauge.add_metric([kind, status], n)
+        yield gauge
+
+
+if PROMETHEUS_AVAILABLE:
+    # Task counts come from the store itself, which every worker shares, so they're collected once
+    _task_registry = CollectorRegistry()
+    _task_registry.register(TaskStoreCollector())
+
+
+def render() -> bytes:
+    """Every metric in Prometheus' text format, summed over the workers in multiprocess mode (blocking)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(_task_registry)
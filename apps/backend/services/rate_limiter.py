@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from services.task_store import TASK_STORE_BACKEND, TASK_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Limits are "rate:burst" (tokens per second : bucket size, at least 1); rate 0 disables a bucket.
+# Prediction creates per API token (Replicate allows 600/min) and other API calls per token (3000/min)
+REPLICATE_CREATE_RATE_LIMIT = os.getenv("REPLICATE_CREATE_RATE_LIMIT", "8:16")
+REPLICATE_REQUEST_RATE_LIMIT = os.getenv("REPLICATE_REQUEST_RATE_LIMIT", "40:80")
+# Extra per-model create limits, e.g. "black-forest-labs/flux-kontext-dev=0.5:2,recraft-ai/recraft-crisp-upscale=2:4"
+REPLICATE_MODEL_RATE_LIMITS = os.getenv("REPLICATE_MODEL_RATE_LIMITS", "")
+
+
+def parse_limit(value: str) -> Tuple[float, float]:
+    """"rate:burst" -> (rate, burst); the burst defaults to one second's worth (at least 1)"""
+    rate, _, burst = value.strip().partition(":")
+    rate = float(rate or 0)
+    burst = float(burst) if burst else max(rate, 1.0)
+    if rate > 0 and burst < 1:
+        # A bucket that can't hold a whole token never hands one out
+        raise ValueError(f"Rate limit {value!r} needs a burst of at least 1")
+    return rate, burst
+
+
+def parse_model_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in value.split(","):
+        model, _, limit = item.strip().rpartition("=")
+        if model and limit:
+            limits[model] = parse_limit(limit)
+    return limits
+
+
+class RateLimiter:
+    """
+    Token buckets for outbound Replicate calls, shared by every worker on the host
+
+    Bucket state lives in the task store's SQLite file and is updated inside
+    BEGIN IMMEDIATE (in a thread, off the event loop), so all gunicorn workers
+    draw from the same buckets. With no path (memory task store) buckets are
+    per process. A caller that finds a bucket empty sleeps until the next
+    token is due instead of failing;
+    callers in a worker queue on a FIFO lock per bucket, so they are served
+    in arrival order.
+    """
+
+    def __init__(self, path: Optional[str] = TASK_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._memory: Dict[str, Tuple[float, float]] = {}
+        self._memory_lock = threading.Lock()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._granted = 0
+        self._throttled = 0
+        self._waited_seconds = 0.0
+
+        if self.path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+        return min(burst, tokens + max(now - updated_at, 0) * rate)
+
+    def try_take(self, name: str, rate: float, burst: float) -> float:
+        """
+        Take a token if one is available (blocking store access)
+
+        Returns 0 when a token was taken, otherwise the seconds until one is due.
+        """
+        now = time.time()
+        if not self.path:
+            with self._memory_lock:
+                tokens, updated_at = self._memory.get(name, (burst, now))
+                tokens = self._refill(tokens, updated_at, now, rate, burst)
+                taken = tokens >= 1
+                self._memory[name] = (tokens - 1 if taken else tokens, now)
+            return 0.0 if taken else (1 - tokens) / rate
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+            tokens = self._refill(row[0], row[1], now, rate, burst) if row else burst
+            taken = tokens >= 1
+            conn.execute(
+                "INSERT INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (name, tokens - 1 if taken else tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return 0.0 if taken else (1 - tokens) / rate
+
+    async def acquire(self, name: str, rate: float, burst: float):
+        """Wait for a token from a bucket (no-op when rate is 0)"""
+        if rate <= 0:
+            return
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+
+        started = None
+        async with lock:
+            while True:
+                try:
+                    if self.path:
+                        # BEGIN IMMEDIATE can wait on other workers, keep it off the event loop
+                        wait = await asyncio.to_thread(self.try_take, name, rate, burst)
+                    else:
+                        wait = self.try_take(name, rate, burst)
+                except sqlite3.Error as e:
+                    # Don't let a locked or broken store stop every Replicate call
+                    logger.warning(f"Rate limiter store error for {name}: {str(e)}")
+                    wait = 0.0
+                if wait <= 0:
+                    break
+                if started is None:
+                    started = time.monotonic()
+                    self._throttled += 1
+                await asyncio.sleep(wait)
+
+        self._granted += 1
+        if started is not None:
+            self._waited_seconds += time.monotonic() - started
+
+    def get_stats(self) -> dict:
+        return {
+            "shared": bool(self.path),
+            "granted": self._granted,
+            "throttled": self._throttled,
+            "waited_seconds": round(self._waited_seconds, 3),
+            "waiting": sum(1 for lock in self._locks.values() if lock.locked()),
+        }
+
+
+class ReplicateRateLimits:
+    """Bucket names and limits for Replicate API calls, keyed per API token and model"""
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        create_limit: Tuple[float, float],
+        request_limit: Tuple[float, float],
+        model_limits: Dict[str, Tuple[float, float]],
+    ):
+        self.limiter = limiter
+        self.create_limit = create_limit
+        self.request_limit = request_limit
+        self.model_limits = model_limits
+
+    @staticmethod
+    def _token_key(api_token: str) -> str:
+        # Never store the token itself
+        return hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+    async def before_create(self, api_token: str, model: str):
+        """Wait for the model's bucket, then the account's prediction bucket"""
+        if model in self.model_limits:
+            await self.limiter.acquire(f"replicate:model:{model}", *self.model_limits[model])
+        await self.limiter.acquire(f"replicate:create:{self._token_key(api_token)}", *self.create_limit)
+
+    async def before_request(self, api_token: str):
+        await self.limiter.acquire(f"replicate:request:{self._token_key(api_token)}", *self.request_limit)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.limiter.get_stats(),
+            "create_limit": self.create_limit,
+            "request_limit": self.request_limit,
+            "model_limits": self.model_limits,
+        }
+
+
+# Global limits for this worker, backed by the shared task store file
+rate_limiter = RateLimiter(TASK_STORE_PATH if TASK_STORE_BACKEND == "sqlite" else None)
+replicate_rate_limits = ReplicateRateLimits(
+    rate_limiter,
+    create_limit=parse_limit(REPLICATE_CREATE_RATE_LIMIT),
+    request_limit=parse_limit(REPLICATE_REQUEST_RATE_LIMIT),
+    model_limits=parse_model_limits(REPLICATE_MODEL_RATE_LIMITS),
+)
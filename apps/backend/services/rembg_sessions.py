@@ -0,0 +1,90 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Try to import rembg, sessions are unavailable without it
+try:
+    from rembg import new_session
+    REMBG_AVAILABLE = True
+except ImportError:
+    REMBG_AVAILABLE = False
+
+# Model used by /remove-bg and the cutout router unless a caller asks for another one
+DEFAULT_MODEL = os.getenv("REMBG_MODEL", "u2net")
+
+# Models loaded when the worker starts (comma-separated)
+WARM_MODELS = [m.strip() for m in os.getenv("REMBG_WARM_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+
+# Process-wide registry: one ONNX session per model name per worker
+_sessions: Dict[str, object] = {}
+_sessions_lock = threading.Lock()
+_warm_thread: Optional[threading.Thread] = None
+_warm_error: Optional[str] = None
+
+
+def get_session(model_name: str = DEFAULT_MODEL):
+    """
+    Return the shared rembg session for a model, creating it on first use
+    """
+    session = _sessions.get(model_name)
+    if session is not None:
+        return session
+
+    if not REMBG_AVAILABLE:
+        raise RuntimeError("rembg is not installed")
+
+    with _sessions_lock:
+        session = _sessions.get(model_name)
+        if session is None:
+            logger.info(f"Loading rembg session for model: {model_name}")
+            session = new_session(model_name)
+            _sessions[model_name] = session
+            logger.info(f"rembg session ready for model: {model_name}")
+
+    return session
+
+
+def warm_up(model_names: Optional[List[str]] = None):
+    """
+    Load sessions for the given models (blocking)
+    """
+    global _warm_error
+
+    for model_name in model_names or WARM_MODELS:
+        try:
+            get_session(model_name)
+        except Exception as e:
+            _warm_error = f"{model_name}: {str(e)}"
+            logger.error(f"Failed to warm rembg session {model_name}: {str(e)}")
+
+
+def start_warm_up():
+    """
+    Warm sessions in a background thread so worker boot is not blocked by model loading
+    """
+    global _warm_thread
+
+    if not REMBG_AVAILABLE or _warm_thread is not None:
+        return
+
+    _warm_thread = threading.Thread(target=warm_up, name="rembg-warm-up", daemon=True)
+    _warm_thread.start()
+
+
+def is_ready(model_name: str = DEFAULT_MODEL) -> bool:
+    """Check whether the session for a model has finished loading"""
+    return model_name in _sessions
+
+
+def get_status() -> dict:
+    """Get session registry status"""
+    return {
+        "rembg_available": REMBG_AVAILABLE,
+        "default_model": DEFAULT_MODEL,
+        "loaded_models": list(_sessions.keys()),
+        "warming": bool(_warm_thread and _warm_thread.is_alive()),
+        "warm_error": _warm_error,
+    }
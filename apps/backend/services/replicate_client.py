@@ -0,0 +1,278 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+import httpx
+import replicate
+from replicate.exceptions import ReplicateError
+from services.rate_limiter import replicate_rate_limits
+from services.metrics import REPLICATE_PREDICTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Concurrent predictions allowed per model in this worker; extra calls wait their turn
+REPLICATE_CONCURRENCY_PER_MODEL = int(os.getenv("REPLICATE_CONCURRENCY_PER_MODEL", "4"))
+REPLICATE_POLL_INTERVAL = float(os.getenv("REPLICATE_POLL_INTERVAL", "1.0"))
+REPLICATE_TIMEOUT = float(os.getenv("REPLICATE_TIMEOUT", "300"))
+# Point at a different API host (e.g. a local stand-in) instead of api.replicate.com
+REPLICATE_BASE_URL = os.getenv("REPLICATE_BASE_URL") or None
+# Tries per status poll when the API answers 429 or 5xx, and the longest wait between them
+REPLICATE_HTTP_MAX_ATTEMPTS = int(os.getenv("REPLICATE_HTTP_MAX_ATTEMPTS", "5"))
+REPLICATE_HTTP_MAX_BACKOFF = float(os.getenv("REPLICATE_HTTP_MAX_BACKOFF", "10"))
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class ReplicateTimeout(Exception):
+    """A prediction did not finish within its timeout (it has been cancelled)"""
+    pass
+
+
+def output_url(output: Any) -> str:
+    """Pull the result URL out of whatever shape the model returned"""
+    if isinstance(output, list) and output:
+        output = output[0]
+    if isinstance(output, str):
+        return output
+    if hasattr(output, "url"):
+        return output.url() if callable(output.url) else output.url
+    raise ValueError(f"Unexpected output format from Replicate: {type(output)}")
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """
+    Retries GETs answered with 429 or 5xx, backing off with asyncio.sleep
+
+    Replaces the replicate library's own retries, whose async path closes the
+    response with the sync close() (which raises) and waits with time.sleep.
+    Only GETs are retried, a repeated create could start a second prediction.
+    """
+
+    def __init__(
+        self,
+        wrapped: Optional[httpx.AsyncBaseTransport] = None,
+        max_attempts: int = REPLICATE_HTTP_MAX_ATTEMPTS,
+        max_backoff: float = REPLICATE_HTTP_MAX_BACKOFF,
+    ):
+        self._wrapped = wrapped or httpx.AsyncHTTPTransport()
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.retries = 0
+
+    def backoff(self, attempt: int, headers: httpx.Headers) -> float:
+        retry_after = headers.get("retry-after", "").strip()
+        if retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(0.25 * 2 ** (attempt - 1) * random.uniform(0.8, 1.2), self.max_backoff)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 1
+        while True:
+            response = await self._wrapped.handle_async_request(request)
+            if (request.method != "GET" or response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_attempts):
+                return response
+            await response.aclose()
+            delay = self.backoff(attempt, response.headers)
+            logger.warning(f"Replicate returned {response.status_code} for {request.url.path}, retrying in {delay:.1f}s")
+            self.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self._wrapped.aclose()
+
+
+class ReplicateClient:
+    """
+    Async Replicate client shared by every router that calls a model
+
+    Predictions are created and polled with the replicate library's async API,
+    so waiting on a model never blocks the event loop. Each model gets its own
+    semaphore, so one slow model can't take every slot.
+    """
+
+    def __init__(
+        self,
+        concurrency_per_model: int = REPLICATE_CONCURRENCY_PER_MODEL,
+        poll_interval: float = REPLICATE_POLL_INTERVAL,
+        timeout: float = REPLICATE_TIMEOUT,
+        base_url: Optional[str] = REPLICATE_BASE_URL,
+    ):
+        self.concurrency_per_model = concurrency_per_model
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.base_url = base_url
+
+        self._client: Optional[replicate.Client] = None
+        self._client_token: Optional[str] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[AsyncRetryTransport] = None
+        self._retired_retries = 0
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiting: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._completed = 0
+        self._failed = 0
+
+    async def _get_client(self) -> replicate.Client:
+        # The token is read per call, like the routers did, so it can be set after import
+        api_token = os.getenv("REPLICATE_API_TOKEN")
+        if not api_token:
+            raise ReplicateError("REPLICATE_API_TOKEN environment variable not configured")
+        if self._client is None or self._client_token != api_token:
+            previous, previous_transport = self._client, self._transport
+            # A transport (connection pool) per client, so closing the old one leaves the new one alone
+            self._transport = AsyncRetryTransport()
+            client = replicate.Client(api_token=api_token, base_url=self.base_url, transport=self._transport)
+            # The library wraps every transport in its own retrying one, turn that off (see AsyncRetryTransport)
+            library_retries = getattr(client._async_client, "_transport", None)
+            if hasattr(library_retries, "max_attempts"):
+                library_retries.max_attempts = 1
+            # Swapped before awaiting, so no other call picks up the client being closed
+            self._client, self._client_token = client, api_token
+            if previous is not None:
+                # The token changed: requests still running on the old one fail, like they would once it's revoked
+                self._retired_retries += previous_transport.retries
+                await self._close_client(previous)
+        return self._client
+
+    @staticmethod
+    async def _close_client(client: replicate.Client):
+        try:
+            await client._async_client.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close the previous Replicate client: {str(e)}")
+
+    def _get_semaphore(self, model: str) -> asyncio.Semaphore:
+        # Created lazily so it belongs to the worker's running event loop
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.concurrency_per_model)
+        return self._semaphores[model]
+
+    @staticmethod
+    def model_name(ref: str) -> str:
+        """"owner/name:version" -> "owner/name", the key concurrency is limited by"""
+        return ref.split(":", 1)[0]
+
+    async def create_prediction(self, ref: str, input: dict, **params):
+        """Start a prediction and return it without waiting for the output"""
+        client = await self._get_client()
+        model, _, version = ref.partition(":")
+        # Waits (doesn't fail) while this token or model is over its rate limit
+        await replicate_rate_limits.before_create(self._client_token, model)
+        if version and version != "latest":
+            return await client.predictions.async_create(version=version, input=input, **params)
+        # Official models run without a pinned version
+        return await client.models.predictions.async_create(model=model, input=input, **params)
+
+    async def get_prediction(self, prediction_id: str):
+        client = await self._get_client()
+        await replicate_rate_limits.before_request(self._client_token)
+        return await client.predictions.async_get(prediction_id)
+
+    async def cancel_prediction(self, prediction_id: str):
+        client = await self._get_client()
+        await replicate_rate_limits.before_request(self._client_token)
+        return await client.predictions.async_cancel(prediction_id)
+
+    async def _cancel_quietly(self, prediction_id: str):
+        try:
+            await self.cancel_prediction(prediction_id)
+            logger.info(f"Cancelled Replicate prediction {prediction_id}")
+        except Exception as e:
+            logger.warning(f"Failed to cancel prediction {prediction_id}: {str(e)}")
+
+    async def wait(self, prediction, timeout: Optional[float] = None):
+        """Poll a prediction until it finishes, cancelling it if it runs past the timeout"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        interval = min(0.25, self.poll_interval)
+
+        while prediction.status not in TERMINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                try:
+                    await self.cancel_prediction(prediction.id)
+                except Exception as e:
+                    logger.warning(f"Failed to cancel timed out prediction {prediction.id}: {str(e)}")
+                raise ReplicateTimeout(f"Prediction {prediction.id} timed out after {timeout or self.timeout:.0f}s")
+
+            await asyncio.sleep(interval)
+            # Poll quickly at first, most short jobs finish in a few seconds
+            interval = min(interval * 2, self.poll_interval)
+            prediction = await self.get_prediction(prediction.id)
+
+        if prediction.status != "succeeded":
+            raise ReplicateError(prediction.error or f"Prediction {prediction.id} {prediction.status}")
+        return prediction
+
+    async def run(self, ref: str, input: dict, timeout: Optional[float] = None) -> Any:
+        """Run a model and return its output, waiting for a free slot for that model first"""
+        model = self.model_name(ref)
+        self._waiting[model] = self._waiting.get(model, 0) + 1
+        acquired = False
+        try:
+            async with self._get_semaphore(model):
+                acquired = True
+                self._waiting[model] -= 1
+                self._running[model] = self._running.get(model, 0) + 1
+                prediction = None
+                outcome = "failed"
+                started = time.monotonic()
+                try:
+                    prediction = await self.create_prediction(ref, input)
+                    logger.info(f"Created Replicate prediction {prediction.id} for {model}")
+                    prediction = await self.wait(prediction, timeout)
+                    self._completed += 1
+                    outcome = "succeeded"
+                    return prediction.output
+                except asyncio.CancelledError:
+                    outcome = "canceled"
+                    # The caller gave up (job cancelled), don't leave the prediction running
+                    if prediction is not None:
+                        asyncio.ensure_future(self._cancel_quietly(prediction.id))
+                    raise
+                except Exception as e:
+                    if isinstance(e, ReplicateTimeout):
+                        outcome = "timeout"
+                    self._failed += 1
+                    raise
+                finally:
+                    self._running[model] -= 1
+                    REPLICATE_PREDICTION_SECONDS.labels(model, outcome).observe(time.monotonic() - started)
+        finally:
+            if not acquired:
+                self._waiting[model] -= 1
+
+    async def download(self, url: str) -> bytes:
+        """Fetch a prediction output without blocking the event loop"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True)
+        response = await self._http.get(url)
+        response.raise_for_status()
+        return response.content
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._client is not None:
+            await self._close_client(self._client)
+            self._client = None
+
+    def get_stats(self) -> dict:
+        return {
+            "concurrency_per_model": self.concurrency_per_model,
+            "running": {model: count for model, count in self._running.items() if count},
+            "waiting": {model: count for model, count in self._waiting.items() if count},
+            "completed": self._completed,
+            "failed": self._failed,
+            "http_retries": self._retired_retries + (self._transport.retries if self._transport else 0),
+            "base_url": self.base_url or "https://api.replicate.com",
+        }
+
+
+# Global client shared by all routers in this worker
+replicate_client = ReplicateClient()
@@ -0,0 +1,191 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+from datetime import datetime
+from typing import Mapping, Optional
+from services.task_store import task_store
+from services.replicate_client import replicate_client, output_url
+from services import single_flight
+from services.result_cache import result_cache
+from services.metrics import REPLICATE_PREDICTION_SECONDS
+from services.circuit_breaker import model_breakers
+
+logger = logging.getLogger(__name__)
+
+# Public base URL Replicate can reach (e.g. https://staticapi.kraftey.com). When
+# unset, tasks fall back to polling predictions from a background task.
+REPLICATE_WEBHOOK_BASE_URL = os.getenv("REPLICATE_WEBHOOK_BASE_URL", "").rstrip("/")
+# Signing secret from GET /v1/webhooks/default/secret ("whsec_...")
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+# Reject callbacks whose timestamp is further than this from our clock
+WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("REPLICATE_WEBHOOK_TOLERANCE", "300"))
+# A task still processing this long after its last check is reconciled by fetching the prediction
+RECONCILE_AFTER_SECONDS = int(os.getenv("REPLICATE_WEBHOOK_RECONCILE_AFTER", "60"))
+
+WEBHOOK_PATH = "/replicate/webhook"
+# Prediction id -> owning task, kept in the shared task store
+PREDICTION_KIND = "replicate_prediction"
+
+
+class WebhookVerificationError(Exception):
+    """Webhook signature, timestamp or headers are invalid"""
+    pass
+
+
+def webhooks_enabled() -> bool:
+    return bool(REPLICATE_WEBHOOK_BASE_URL and REPLICATE_WEBHOOK_SECRET)
+
+
+def webhook_url() -> str:
+    return REPLICATE_WEBHOOK_BASE_URL + WEBHOOK_PATH
+
+
+def sign(secret: str, webhook_id: str, timestamp: str, body: bytes) -> str:
+    """Signature in the "v1,<base64>" form Replicate sends in the webhook-signature header"""
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    digest = hmac.new(key, signed_content, hashlib.sha256).digest()
+    return "v1," + base64.b64encode(digest).decode()
+
+
+def verify_signature(headers: Mapping[str, str], body: bytes, secret: str = REPLICATE_WEBHOOK_SECRET):
+    """Raise WebhookVerificationError unless the request was signed with our secret"""
+    if not secret:
+        raise WebhookVerificationError("REPLICATE_WEBHOOK_SECRET not configured")
+
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not webhook_id or not timestamp or not signatures:
+        raise WebhookVerificationError("Missing webhook signature headers")
+
+    try:
+        if abs(time.time() - int(timestamp)) > WEBHOOK_TOLERANCE_SECONDS:
+            raise WebhookVerificationError("Webhook timestamp outside tolerance")
+    except ValueError:
+        raise WebhookVerificationError("Invalid webhook timestamp")
+
+    expected = sign(secret, webhook_id, timestamp, body)
+    # The header may carry several space separated signatures (secret rotation)
+    if not any(hmac.compare_digest(expected, candidate) for candidate in signatures.split()):
+        raise WebhookVerificationError("Invalid webhook signature")
+
+
+async def start_prediction(ref: str, input: dict, task_kind: str, task_id: str, output_field: str,
+                           breaker_trial: bool = False) -> str:
+    """
+    Create a prediction that reports back to the webhook, and link it to the task
+
+    Returns the prediction id. Nothing waits on the prediction afterwards; the
+    webhook (or a later status poll, see reconcile) completes the task. With
+    breaker_trial the prediction is this worker's half-open circuit breaker
+    trial, and its outcome decides the circuit.
+    """
+    prediction = await replicate_client.create_prediction(
+        ref, input, webhook=webhook_url(), webhook_events_filter=["completed"]
+    )
+    await task_store.acreate(PREDICTION_KIND, prediction.id, {
+        "status": "processing",
+        "task_kind": task_kind,
+        "task_id": task_id,
+        "output_field": output_field,
+        "model": replicate_client.model_name(ref),
+        "started_at": time.time(),
+        "breaker_trial": breaker_trial,
+        "worker_pid": os.getpid(),
+    })
+    await task_store.aupdate(task_kind, task_id, prediction_id=prediction.id, checked_at=time.time())
+    logger.info(f"Created Replicate prediction {prediction.id} for {task_kind} task {task_id} (webhook)")
+    return prediction.id
+
+
+async def complete_prediction(prediction: dict) -> Optional[dict]:
+    """
+    Apply a finished prediction to its task
+
+    Returns the updated task, or None if the prediction is unknown, still
+    running, or the task was already completed (duplicate deliveries are fine).
+    """
+    link = await task_store.aget(PREDICTION_KIND, prediction.get("id", ""))
+    if link is None:
+        return None
+
+    status = prediction.get("status")
+    if status == "succeeded":
+        try:
+            fields = {"status": "completed", link["output_field"]: output_url(prediction.get("output"))}
+        except ValueError as e:
+            fields = {"status": "failed", "error": str(e)}
+    elif status in ("failed", "canceled"):
+        fields = {"status": "failed", "error": prediction.get("error") or f"Prediction {status}"}
+    else:
+        return None
+
+    fields["completed_at"] = datetime.now().isoformat()
+    task = await task_store.run(single_flight.complete_task, link["task_kind"], link["task_id"], **fields)
+    await task_store.aupdate(PREDICTION_KIND, prediction["id"], status=fields["status"])
+    if link.get("status") == "processing":
+        # First delivery: the prediction's outcome and latency go to its model's breaker
+        record_outcome(link, status, fields.get("error"))
+    if task is not None:
+        if link.get("started_at"):
+            REPLICATE_PREDICTION_SECONDS.labels(link.get("model", ""), status).observe(time.time() - link["started_at"])
+        logger.info(f"Prediction {prediction['id']} {status}, {link['task_kind']} task {link['task_id']} {fields['status']}")
+        if fields["status"] == "completed":
+            await result_cache.store(task.get("cache_key"), fields[link["output_field"]])
+    return task
+
+
+def record_outcome(link: dict, status: str, error: Optional[str] = None):
+    """Feed a finished prediction to the circuit breaker of its model, if it has one"""
+    breaker = model_breakers.get(link.get("model", ""))
+    if breaker is None:
+        return
+    # Breakers are per worker, a trial only counts in the worker that started it
+    trial = bool(link.get("breaker_trial")) and link.get("worker_pid") == os.getpid()
+    if status == "canceled":
+        # Cancelled on our side, says nothing about Replicate's health
+        breaker.release(trial)
+        return
+    latency = time.time() - link.get("started_at", time.time())
+    breaker.record(latency, Exception(error) if error else None, trial)
+
+
+async def reconcile(task_kind: str, task_id: str, task: dict) -> dict:
+    """
+    Fetch the prediction for a task that has been processing for a while
+
+    Covers webhooks that never arrived (network issues, a deploy). Checks are
+    spaced RECONCILE_AFTER_SECONDS apart per task, so polling clients don't
+    turn into Replicate API calls.
+    """
+    if task.get("status") == "processing" and task.get("attached_to"):
+        # Tasks attached to an identical job finish along with its leader
+        leader = await task_store.aget(task_kind, task["attached_to"])
+        if leader is not None:
+            await reconcile(task_kind, task["attached_to"], leader)
+        return await task_store.aget(task_kind, task_id) or task
+
+    prediction_id = task.get("prediction_id")
+    if task.get("status") != "processing" or not prediction_id:
+        return task
+    if time.time() - task.get("checked_at", 0) < RECONCILE_AFTER_SECONDS:
+        return task
+
+    await task_store.aupdate(task_kind, task_id, checked_at=time.time())
+    try:
+        prediction = await replicate_client.get_prediction(prediction_id)
+    except Exception as e:
+        logger.warning(f"Failed to reconcile prediction {prediction_id}: {str(e)}")
+        return task
+
+    updated = await complete_prediction({
+        "id": prediction.id,
+        "status": prediction.status,
+        "output": prediction.output,
+        "error": prediction.error,
+    })
+    return updated or task
@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+from services.task_store import task_store
+from services.replicate_client import replicate_client
+from services.input_fetch import input_fetcher
+
+logger = logging.getLogger(__name__)
+
+# Index records in the shared task store, one per cached output
+RESULT_KIND = "replicate_result"
+# Must be inside uploads/ so the /uploads static mount serves the files
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "uploads/result-cache")
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", "1024"))
+# Inputs bigger than this are not hashed (and not cached)
+RESULT_CACHE_MAX_INPUT_MB = int(os.getenv("RESULT_CACHE_MAX_INPUT_MB", "25"))
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://staticapi.kraftey.com")
+
+
+class ResultCache:
+    """
+    Disk cache of finished Replicate outputs keyed by model version and input content
+
+    Replicate output URLs expire after an hour, so the output bytes are kept
+    under uploads/ and served from there. Each file has an index record in
+    the shared task store, which every worker sees and which expires after
+    the TTL. The directory is capped in size with least-recently-used eviction.
+    """
+
+    def __init__(self, cache_dir: str, ttl: int, max_bytes: int, max_input_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_input_bytes = max_input_bytes
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    async def input_key(self, model_ref: str, image_url: str) -> Optional[str]:
+        """
+        Cache key for running a model on an image: the model version plus the
+        SHA-256 of the image bytes, so the same image under another URL still hits
+
+        Returns None when the cache is off or the image can't be fetched. This
+        downloads the input, so jobs call it, not the routes taking requests.
+        """
+        if not self.enabled:
+            return None
+        try:
+            image_data = await input_fetcher.fetch(image_url)
+        except Exception as e:
+            logger.warning(f"Result cache could not fetch input {image_url}: {str(e)}")
+            return None
+        if len(image_data) > self.max_input_bytes:
+            return None
+        return self.content_key(model_ref, image_data)
+
+    @staticmethod
+    def content_key(model_ref: str, image_data: bytes) -> str:
+        """Cache key for input bytes already in hand"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        return hashlib.sha256(f"{model_ref}:{digest}".encode()).hexdigest()
+
+    def _public_url(self, path: Path) -> str:
+        relative = os.path.relpath(path, "uploads").replace(os.sep, "/")
+        return f"{SERVER_BASE_URL}/uploads/{relative}"
+
+    async def lookup(self, key: Optional[str]) -> Optional[str]:
+        """
+        Public URL of a cached output, or None on a miss
+        """
+        if key is None:
+            return None
+
+        record = await task_store.aget(RESULT_KIND, key)
+        path = self.cache_dir / record["file"] if record else None
+        if path is not None and await asyncio.get_running_loop().run_in_executor(None, self._touch, path):
+            with self._lock:
+                self._hits += 1
+            return self._public_url(path)
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    @staticmethod
+    def _touch(path: Path) -> bool:
+        """Bump the file's mtime so eviction is least-recently-used, False if it's gone"""
+        try:
+            os.utime(path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def store(self, key: Optional[str], output_url: str) -> Optional[str]:
+        """
+        Download a finished output into the cache, returns its public URL
+
+        Failures are logged and ignored, the task already has Replicate's URL.
+        """
+        if key is None or not output_url:
+            return None
+        try:
+            data = await replicate_client.download(output_url)
+        except Exception as e:
+            logger.warning(f"Result cache write failed for {key}: {str(e)}")
+            return None
+
+        extension = os.path.splitext(urlparse(output_url).path)[1] or ".png"
+        return await self.store_bytes(key, data, extension, output_url)
+
+    async def store_bytes(self, key: Optional[str], data: bytes, extension: str = ".png",
+                          source_url: Optional[str] = None) -> Optional[str]:
+        """
+        Cache output bytes produced on this server, returns their public URL
+        """
+        if key is None or not self.enabled or len(data) > self.max_bytes:
+            return None
+        filename = f"{key[:2]}/{key}{extension}"
+        path = self.cache_dir / filename
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, path, data)
+        except Exception as e:
+            logger.warning(f"Result cache write failed for {key}: {str(e)}")
+            return None
+        return await self._index(key, filename, len(data), source_url)
+
+    def temp_path(self, extension: str = ".png") -> Path:
+        """Scratch file inside the cache directory for store_file, so moving it in is atomic"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return self.cache_dir / f"{uuid.uuid4().hex}{extension}.tmp"
+
+    async def store_file(self, key: Optional[str], src_path: Path, extension: str = ".png",
+                         source_url: Optional[str] = None) -> Optional[str]:
+        """
+        Move a finished output file (from temp_path) into the cache, returns its public URL
+
+        For outputs too large to hold in memory. The file is deleted if it can't be cached.
+        """
+        src_path = Path(src_path)
+        size = src_path.stat().st_size
+        if key is None or not self.enabled or size > self.max_bytes:
+            src_path.unlink()
+            return None
+        filename = f"{key[:2]}/{key}{extension}"
+        path = self.cache_dir / filename
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src_path, path)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._account, size)
+        except Exception as e:
+            logger.warning(f"Result cache write failed for {key}: {str(e)}")
+            return None
+        return await self._index(key, filename, size, source_url)
+
+    async def _index(self, key: str, filename: str, size: int, source_url: Optional[str]) -> str:
+        await task_store.acreate(RESULT_KIND, key, {
+            "status": "stored",
+            "file": filename,
+            "size": size,
+            "source_url": source_url,
+            "stored_at": time.time(),
+        }, ttl=self.ttl)
+        with self._lock:
+            self._stores += 1
+        return self._public_url(self.cache_dir / filename)
+
+    def _write(self, path: Path, data: bytes):
+        """Atomically write a file, then evict if the directory is over its cap (blocking)"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._account(len(data))
+
+    def _account(self, size: int):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*") if p.suffix != ".tmp")
+            else:
+                self._disk_bytes += size
+            over_limit = self._disk_bytes > self.max_bytes
+
+        if over_limit:
+            self._evict()
+
+    def _evict(self):
+        """
+        Delete files whose index record expired, then the least recently used
+        until the directory is at 90% of its cap
+        """
+        entries = []
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            expired = task_store.get(RESULT_KIND, path.stem) is None
+            entries.append((not expired, stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for live, _, size, path in sorted(entries):
+            if live and total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            if live:
+                task_store.delete(RESULT_KIND, path.stem)
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters for this worker and the cache size"""
+        entries = task_store.count(RESULT_KIND)
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "disk_bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0,
+            }
+
+    async def aget_stats(self) -> dict:
+        """get_stats for async callers, counting entries on the store's threads"""
+        return await task_store.run(self.get_stats)
+
+
+# Global instance, the directory and index are shared by all workers
+result_cache = ResultCache(
+    cache_dir=RESULT_CACHE_DIR,
+    ttl=RESULT_CACHE_TTL_SECONDS,
+    max_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024,
+    max_input_bytes=RESULT_CACHE_MAX_INPUT_MB * 1024 * 1024,
+)
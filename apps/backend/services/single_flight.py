@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Optional
+from services.task_store import task_store
+
+logger = logging.getLogger(__name__)
+
+# One record per running job, keyed by dedupe key, in the shared task store
+FLIGHT_KIND = "replicate_flight"
+# A flight whose leader died (worker killed mid-job) stops attracting new tasks after this
+FLIGHT_TTL_SECONDS = int(os.getenv("SINGLE_FLIGHT_TTL_SECONDS", "900"))
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def make_key(model_ref: str, input: dict) -> str:
+    """Dedupe key for a job: model version plus its canonical input"""
+    payload = json.dumps({"model": model_ref, "input": input}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def join(dedupe_key: str, task_kind: str, task_id: str) -> bool:
+    """
+    Register a task for a job, return True if it should run the job (leader)
+
+    If an identical job is already running, the task is attached to it as a
+    follower and receives the leader's result when it finishes.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return True
+
+    # A join can race with the flight finishing, in which case start a new one
+    for _ in range(3):
+        if task_store.create_if_absent(FLIGHT_KIND, dedupe_key, {
+            "status": "processing",
+            "leader": [task_kind, task_id],
+            "followers": [],
+        }, ttl=FLIGHT_TTL_SECONDS):
+            return True
+
+        flight = task_store.get(FLIGHT_KIND, dedupe_key)
+        if flight is None or flight.get("status") != "processing":
+            continue
+        # transition re-checks the status, so the follower list can't miss a finish
+        followers = flight["followers"] + [[task_kind, task_id]]
+        if task_store.transition(FLIGHT_KIND, dedupe_key, ("processing",), followers=followers) is not None:
+            task_store.update(task_kind, task_id, attached_to=flight["leader"][1])
+            return False
+
+    return True
+
+
+def complete_task(task_kind: str, task_id: str, **fields) -> Optional[dict]:
+    """
+    Finish a processing task and every task attached to the same job
+
+    Returns the leader task, or None if it was no longer processing.
+    """
+    task = task_store.transition(task_kind, task_id, ("processing",), **fields)
+    # A cancelled leader still hands its result to the tasks attached to it
+    current = task or task_store.get(task_kind, task_id)
+    if current is None or not current.get("dedupe_key"):
+        return task
+
+    flight = task_store.get(FLIGHT_KIND, current["dedupe_key"])
+    if flight is None or flight.get("leader") != [task_kind, task_id]:
+        return task
+
+    # Mark the flight done first so no new follower joins after we read the list
+    flight = task_store.transition(FLIGHT_KIND, current["dedupe_key"], ("processing",), status=fields.get("status", "completed"))
+    task_store.delete(FLIGHT_KIND, current["dedupe_key"])
+    if flight is None:
+        return task
+
+    for follower_kind, follower_id in flight.get("followers", []):
+        task_store.transition(follower_kind, follower_id, ("processing",), **fields)
+    if flight.get("followers"):
+        logger.info(f"Task {task_id} finished {len(flight['followers'])} attached tasks")
+    return task
+
+
+def has_followers(task: dict, task_kind: str, task_id: str) -> bool:
+    """Whether other tasks are attached to the job this task leads"""
+    if not task.get("dedupe_key"):
+        return False
+    flight = task_store.get(FLIGHT_KIND, task["dedupe_key"])
+    return bool(flight and flight.get("leader") == [task_kind, task_id] and flight.get("followers"))
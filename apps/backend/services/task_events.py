@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Set, Tuple
+from services.task_store import task_store, TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting request re-reads the store for changes made by other workers
+TASK_EVENTS_POLL_INTERVAL = float(os.getenv("TASK_EVENTS_POLL_INTERVAL", "1.0"))
+# Upper bound for ?wait= on the status routes
+TASK_LONG_POLL_MAX_SECONDS = float(os.getenv("TASK_LONG_POLL_MAX_SECONDS", "25"))
+# SSE streams close after this long even if the task is still running (clients reconnect)
+TASK_EVENTS_MAX_SECONDS = float(os.getenv("TASK_EVENTS_MAX_SECONDS", "600"))
+TASK_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("TASK_EVENTS_KEEPALIVE_SECONDS", "15"))
+
+
+class TaskEvents:
+    """
+    Wait for task changes without clients polling the API
+
+    Changes made in this worker wake waiters immediately through a task store
+    listener. Changes made by other workers (or a webhook landing elsewhere)
+    are picked up by re-reading the task every poll_interval, a primary key
+    lookup in the shared store instead of a full HTTP request. The listener
+    can fire on the task store's threads, hence the lock around the waiters.
+    """
+
+    def __init__(self, poll_interval: float = TASK_EVENTS_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._waiters: Dict[Tuple[str, str], Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+        task_store.add_listener(self._on_change)
+
+    def _on_change(self, kind: str, task_id: str, task: Optional[dict]):
+        with self._lock:
+            waiters = list(self._waiters.get((kind, task_id), ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait_for_change(self, kind: str, task_id: str, task: Optional[dict], timeout: float) -> Optional[dict]:
+        """
+        Wait until the stored task differs from `task`
+
+        Returns the current task (None if it was deleted or expired), which is
+        unchanged if the timeout ran out first.
+        """
+        deadline = time.monotonic() + timeout
+        key = (kind, task_id)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(key, set()).add(waiter)
+        try:
+            while True:
+                current = await task_store.aget(kind, task_id)
+                remaining = deadline - time.monotonic()
+                if current != task or remaining <= 0:
+                    return current
+
+                waiter[1].clear()
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiters[key].discard(waiter)
+                if not self._waiters[key]:
+                    del self._waiters[key]
+
+    async def wait_for_status(self, kind: str, task_id: str, task: dict, status: Optional[str], wait: float) -> Optional[dict]:
+        """
+        Long-poll helper for the status routes
+
+        Returns as soon as the task's status differs from `status` (defaults to
+        the current one) or the task is finished, else after `wait` seconds.
+        """
+        status = status or task.get("status")
+        deadline = time.monotonic() + min(wait, TASK_LONG_POLL_MAX_SECONDS)
+        while task is not None and task.get("status") == status and task.get("status") not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            task = await self.wait_for_change(kind, task_id, task, remaining)
+        return task
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            watched, waiters = len(self._waiters), sum(len(waiters) for waiters in self._waiters.values())
+        return {
+            "watched_tasks": watched,
+            "waiters": waiters,
+            "poll_interval": self.poll_interval,
+        }
+
+
+# Global instance, one per worker
+task_events = TaskEvents()
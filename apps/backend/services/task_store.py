@@ -0,0 +1,676 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Backend and location of the shared task store. SQLite is shared by every
+# gunicorn worker on the host; "memory" is per-process and only for local runs.
+# Keep the file out of uploads/, which is served publicly at /uploads.
+TASK_STORE_BACKEND = os.getenv("TASK_STORE_BACKEND", "sqlite")
+TASK_STORE_PATH = os.getenv("TASK_STORE_PATH", "data/tasks.db")
+TASK_TTL_SECONDS = int(os.getenv("TASK_TTL_SECONDS", "86400"))
+# Finished tasks are dropped this long after their last update, or once a
+# kind has more than TASK_MAX_FINISHED_PER_KIND of them (oldest first)
+TASK_FINISHED_TTL_SECONDS = int(os.getenv("TASK_FINISHED_TTL_SECONDS", "21600"))
+TASK_MAX_FINISHED_PER_KIND = int(os.getenv("TASK_MAX_FINISHED_PER_KIND", "10000"))
+# How often each worker's sweeper thread runs
+TASK_SWEEP_INTERVAL_SECONDS = float(os.getenv("TASK_SWEEP_INTERVAL_SECONDS", "60"))
+# Threads per worker running SQLite calls for async code, off the event loop
+TASK_STORE_THREADS = int(os.getenv("TASK_STORE_THREADS", "4"))
+
+# Ids per query in SQLiteTaskStore.get_many
+GET_MANY_CHUNK = 500
+
+# Statuses after which a task won't change again
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def encode_cursor(created_at: float, task_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, task_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Raises ValueError for a cursor this store didn't issue"""
+    try:
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(created_at), str(task_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class TaskStore(ABC):
+    """
+    Task status storage shared by the async job routers
+
+    Tasks are plain dicts grouped by kind ("bg_removal", "upscale", ...). Every
+    task has a "status" key; transition() only applies an update while the task
+    is still in one of the expected statuses, so concurrent workers can't
+    overwrite each other's results.
+
+    The methods block; async code awaits the a-prefixed versions (aget,
+    atransition, ...) or run(), which keep blocking backends off the event loop.
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        self._listeners: List[Callable[[str, str, Optional[dict]], None]] = []
+        # None runs calls inline, for backends that don't block
+        self._executor = executor
+
+    def add_listener(self, listener: Callable[[str, str, Optional[dict]], None]):
+        """Call listener(kind, task_id, task) after every change made by this process (task is None when deleted)"""
+        self._listeners.append(listener)
+
+    def _notify(self, kind: str, task_id: str, task: Optional[dict]):
+        for listener in self._listeners:
+            try:
+                listener(kind, task_id, task)
+            except Exception as e:
+                logger.warning(f"Task listener failed: {str(e)}")
+
+    @abstractmethod
+    def create(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> dict:
+        pass
+
+    @abstractmethod
+    def create_if_absent(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> bool:
+        """Create the task unless a live one with that id exists, return whether it was created"""
+        pass
+
+    @abstractmethod
+    def get(self, kind: str, task_id: str) -> Optional[dict]:
+        pass
+
+    def get_many(self, kind: str, task_ids: Iterable[str]) -> Dict[str, dict]:
+        """Live tasks among task_ids, keyed by task id (missing ones are left out)"""
+        tasks = {}
+        for task_id in task_ids:
+            task = self.get(kind, task_id)
+            if task is not None:
+                tasks[task_id] = task
+        return tasks
+
+    @abstractmethod
+    def transition(
+        self,
+        kind: str,
+        task_id: str,
+        from_statuses: Optional[Iterable[str]],
+        **fields,
+    ) -> Optional[dict]:
+        """Merge fields into the task if its status is in from_statuses (None = any), return the new task"""
+        pass
+
+    def update(self, kind: str, task_id: str, **fields) -> Optional[dict]:
+        """Merge fields into the task whatever its status"""
+        return self.transition(kind, task_id, None, **fields)
+
+    @abstractmethod
+    def delete(self, kind: str, task_id: str) -> bool:
+        pass
+
+    def list(self, kind: str, limit: int = 100) -> Dict[str, dict]:
+        """Newest tasks first, keyed by task id"""
+        tasks, _ = self.list_page(kind, limit=limit)
+        return {task.pop("task_id"): task for task in tasks}
+
+    @abstractmethod
+    def list_page(
+        self,
+        kind: str,
+        status: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of tasks, newest first, each with its "task_id"
+
+        Returns the page and the cursor for the next one (None on the last
+        page). Pages are keyed on creation time, so tasks created while paging
+        don't shift or repeat entries.
+        """
+        pass
+
+    @abstractmethod
+    def counts(self, kind: str) -> Dict[str, int]:
+        """Task count per status, without scanning the tasks"""
+        pass
+
+    @abstractmethod
+    def all_counts(self) -> Dict[str, Dict[str, int]]:
+        """Task count per kind and status, for every kind"""
+        pass
+
+    def count(self, kind: str, status: Optional[str] = None) -> int:
+        counts = self.counts(kind)
+        return counts.get(status, 0) if status is not None else sum(counts.values())
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Remove expired tasks and surplus finished ones, return how many were removed"""
+        pass
+
+    def get_stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Await fn(*args, **kwargs), on the store's threads if it blocks (for multi-step store work)"""
+        if self._executor is None:
+            return fn(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def acreate(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> dict:
+        return await self.run(self.create, kind, task_id, task, ttl)
+
+    async def acreate_if_absent(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> bool:
+        return await self.run(self.create_if_absent, kind, task_id, task, ttl)
+
+    async def aget(self, kind: str, task_id: str) -> Optional[dict]:
+        return await self.run(self.get, kind, task_id)
+
+    async def aget_many(self, kind: str, task_ids: Iterable[str]) -> Dict[str, dict]:
+        return await self.run(self.get_many, kind, list(task_ids))
+
+    async def atransition(self, kind: str, task_id: str, from_statuses: Optional[Iterable[str]], **fields) -> Optional[dict]:
+        return await self.run(self.transition, kind, task_id, from_statuses, **fields)
+
+    async def aupdate(self, kind: str, task_id: str, **fields) -> Optional[dict]:
+        return await self.run(self.update, kind, task_id, **fields)
+
+    async def adelete(self, kind: str, task_id: str) -> bool:
+        return await self.run(self.delete, kind, task_id)
+
+    async def alist_page(self, kind: str, status: Optional[str] = None, limit: int = 50,
+                         cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        return await self.run(self.list_page, kind, status, limit, cursor)
+
+    async def acounts(self, kind: str) -> Dict[str, int]:
+        return await self.run(self.counts, kind)
+
+    async def acount(self, kind: str, status: Optional[str] = None) -> int:
+        return await self.run(self.count, kind, status)
+
+    async def aget_stats(self) -> dict:
+        return await self.run(self.get_stats)
+
+
+class MemoryTaskStore(TaskStore):
+    """Per-process store, for local development and single-worker runs"""
+
+    def __init__(
+        self,
+        ttl: int = TASK_TTL_SECONDS,
+        finished_ttl: int = TASK_FINISHED_TTL_SECONDS,
+        max_finished: int = TASK_MAX_FINISHED_PER_KIND,
+    ):
+        super().__init__()
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._tasks: Dict[tuple, dict] = {}
+        self._expires: Dict[tuple, float] = {}
+        self._created: Dict[tuple, float] = {}
+        self._updated: Dict[tuple, float] = {}
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, kind: str, status: Optional[str], delta: int):
+        key = (kind, status or "")
+        self._counts[key] = self._counts.get(key, 0) + delta
+
+    def _put(self, key: tuple, task: dict, ttl: Optional[int]):
+        now = time.time()
+        self._remove(key)
+        self._tasks[key] = dict(task)
+        self._expires[key] = now + (ttl or self.ttl)
+        self._created[key] = now
+        self._updated[key] = now
+        self._count(key[0], task.get("status"), 1)
+
+    def _remove(self, key: tuple):
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            del self._expires[key], self._created[key], self._updated[key]
+            self._count(key[0], task.get("status"), -1)
+
+    def _live(self, key: tuple) -> Optional[dict]:
+        if key in self._tasks and self._expires[key] <= time.time():
+            self._remove(key)
+        return self._tasks.get(key)
+
+    def create(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> dict:
+        with self._lock:
+            self._put((kind, task_id), task, ttl)
+        self._notify(kind, task_id, dict(task))
+        return dict(task)
+
+    def create_if_absent(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> bool:
+        with self._lock:
+            if self._live((kind, task_id)) is not None:
+                return False
+            self._put((kind, task_id), task, ttl)
+        self._notify(kind, task_id, dict(task))
+        return True
+
+    def get(self, kind: str, task_id: str) -> Optional[dict]:
+        with self._lock:
+            task = self._live((kind, task_id))
+            return dict(task) if task is not None else None
+
+    def get_many(self, kind: str, task_ids: Iterable[str]) -> Dict[str, dict]:
+        with self._lock:
+            tasks = {task_id: self._live((kind, task_id)) for task_id in task_ids}
+            return {task_id: dict(task) for task_id, task in tasks.items() if task is not None}
+
+    def transition(self, kind, task_id, from_statuses, **fields):
+        with self._lock:
+            task = self._live((kind, task_id))
+            if task is None or (from_statuses is not None and task.get("status") not in from_statuses):
+                return None
+            self._count(kind, task.get("status"), -1)
+            task.update(fields)
+            self._count(kind, task.get("status"), 1)
+            self._updated[(kind, task_id)] = time.time()
+            task = dict(task)
+        self._notify(kind, task_id, task)
+        return task
+
+    def delete(self, kind: str, task_id: str) -> bool:
+        with self._lock:
+            if self._live((kind, task_id)) is None:
+                return False
+            self._remove((kind, task_id))
+        self._notify(kind, task_id, None)
+        return True
+
+    def list_page(self, kind, status=None, limit=50, cursor=None):
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            keys = [
+                key for key in list(self._tasks)
+                if key[0] == kind and self._live(key) is not None
+                and (status is None or self._tasks[key].get("status") == status)
+                and (after is None or (self._created[key], key[1]) < after)
+            ]
+            keys.sort(key=lambda key: (self._created[key], key[1]), reverse=True)
+            page = [{"task_id": key[1], **self._tasks[key]} for key in keys[:limit]]
+            next_cursor = encode_cursor(self._created[keys[limit - 1]], keys[limit - 1][1]) if len(keys) > limit else None
+        return page, next_cursor
+
+    def counts(self, kind: str) -> Dict[str, int]:
+        with self._lock:
+            return {status: n for (k, status), n in self._counts.items() if k == kind and n > 0}
+
+    def all_counts(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for (kind, status), n in self._counts.items():
+                if n > 0:
+                    counts.setdefault(kind, {})[status] = n
+        return counts
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            removed = [
+                key for key, task in self._tasks.items()
+                if self._expires[key] <= now
+                or (task.get("status") in TERMINAL_STATUSES and self._updated[key] <= now - self.finished_ttl)
+            ]
+            for key in removed:
+                self._remove(key)
+
+            finished: Dict[str, List[tuple]] = {}
+            for key, task in self._tasks.items():
+                if task.get("status") in TERMINAL_STATUSES:
+                    finished.setdefault(key[0], []).append(key)
+            for keys in finished.values():
+                keys.sort(key=lambda key: self._created[key], reverse=True)
+                for key in keys[self.max_finished:]:
+                    self._remove(key)
+                    removed.append(key)
+        return len(removed)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"backend": type(self).__name__, "tasks": len(self._tasks), "ttl_seconds": self.ttl}
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Store backed by a SQLite database in WAL mode
+
+    All workers on the host open the same file. WAL lets readers run alongside
+    the single writer, and status transitions are done inside BEGIN IMMEDIATE
+    so the read-check-write is atomic across processes. Per-status counts are
+    kept in task_counts by triggers, so counting never scans the tasks; rows
+    that expired since the last sweep are still counted until it removes them.
+    Async callers go through a small thread pool, since a write can wait up to
+    busy_timeout for another worker's lock.
+    """
+
+    def __init__(
+        self,
+        path: str = TASK_STORE_PATH,
+        ttl: int = TASK_TTL_SECONDS,
+        finished_ttl: int = TASK_FINISHED_TTL_SECONDS,
+        max_finished: int = TASK_MAX_FINISHED_PER_KIND,
+        threads: int = TASK_STORE_THREADS,
+    ):
+        super().__init__(ThreadPoolExecutor(max_workers=threads, thread_name_prefix="task-store"))
+        self.path = path
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_kind_status ON tasks (kind, status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_kind_created ON tasks (kind, created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_kind_status_created ON tasks (kind, status, created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_status_updated ON tasks (status, updated_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_expires ON tasks (expires_at);
+        """)
+
+        # Counters and their triggers are created together with a backfill, so
+        # a database from before they existed starts with the right numbers
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_counts'"
+            ).fetchone()
+            if not exists:
+                conn.execute("""
+                    CREATE TABLE task_counts (
+                        kind TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        n INTEGER NOT NULL,
+                        PRIMARY KEY (kind, status)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TRIGGER tasks_count_insert AFTER INSERT ON tasks BEGIN
+                        INSERT INTO task_counts (kind, status, n) VALUES (NEW.kind, NEW.status, 1)
+                        ON CONFLICT (kind, status) DO UPDATE SET n = n + 1;
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER tasks_count_delete AFTER DELETE ON tasks BEGIN
+                        UPDATE task_counts SET n = n - 1 WHERE kind = OLD.kind AND status = OLD.status;
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER tasks_count_update AFTER UPDATE OF kind, status ON tasks
+                    WHEN OLD.kind IS NOT NEW.kind OR OLD.status IS NOT NEW.status BEGIN
+                        UPDATE task_counts SET n = n - 1 WHERE kind = OLD.kind AND status = OLD.status;
+                        INSERT INTO task_counts (kind, status, n) VALUES (NEW.kind, NEW.status, 1)
+                        ON CONFLICT (kind, status) DO UPDATE SET n = n + 1;
+                    END
+                """)
+                conn.execute(
+                    "INSERT INTO task_counts (kind, status, n) SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status"
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def create(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> dict:
+        now = time.time()
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the count triggers
+        self._connect().execute(
+            "INSERT INTO tasks (kind, id, status, data, created_at, updated_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, id) DO UPDATE SET status = excluded.status, data = excluded.data, "
+            "created_at = excluded.created_at, updated_at = excluded.updated_at, expires_at = excluded.expires_at",
+            (kind, task_id, task.get("status", ""), json.dumps(task), now, now, now + (ttl or self.ttl)),
+        )
+        self._notify(kind, task_id, dict(task))
+        return dict(task)
+
+    def create_if_absent(self, kind: str, task_id: str, task: dict, ttl: Optional[int] = None) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # An expired row still holds the primary key, clear it first
+            conn.execute("DELETE FROM tasks WHERE kind = ? AND id = ? AND expires_at <= ?", (kind, task_id, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (kind, id, status, data, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, task_id, task.get("status", ""), json.dumps(task), now, now, now + (ttl or self.ttl)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if cursor.rowcount > 0:
+            self._notify(kind, task_id, dict(task))
+        return cursor.rowcount > 0
+
+    def get(self, kind: str, task_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT data FROM tasks WHERE kind = ? AND id = ? AND expires_at > ?",
+            (kind, task_id, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, kind: str, task_ids: Iterable[str]) -> Dict[str, dict]:
+        task_ids = list(dict.fromkeys(task_ids))
+        conn = self._connect()
+        now = time.time()
+        tasks = {}
+        # Chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(task_ids), GET_MANY_CHUNK):
+            chunk = task_ids[start:start + GET_MANY_CHUNK]
+            rows = conn.execute(
+                f"SELECT id, data FROM tasks WHERE kind = ? AND id IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                (kind, *chunk, now),
+            ).fetchall()
+            tasks.update((task_id, json.loads(data)) for task_id, data in rows)
+        return tasks
+
+    def transition(self, kind, task_id, from_statuses, **fields):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT status, data FROM tasks WHERE kind = ? AND id = ? AND expires_at > ?",
+                (kind, task_id, now),
+            ).fetchone()
+            if row is None or (from_statuses is not None and row[0] not in from_statuses):
+                conn.execute("ROLLBACK")
+                return None
+
+            task = json.loads(row[1])
+            task.update(fields)
+            conn.execute(
+                "UPDATE tasks SET status = ?, data = ?, updated_at = ? WHERE kind = ? AND id = ?",
+                (task.get("status", ""), json.dumps(task), now, kind, task_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify(kind, task_id, task)
+        return task
+
+    def delete(self, kind: str, task_id: str) -> bool:
+        cursor = self._connect().execute("DELETE FROM tasks WHERE kind = ? AND id = ?", (kind, task_id))
+        if cursor.rowcount > 0:
+            self._notify(kind, task_id, None)
+        return cursor.rowcount > 0
+
+    def list_page(self, kind, status=None, limit=50, cursor=None):
+        query = "SELECT id, data, created_at FROM tasks WHERE kind = ? AND expires_at > ?"
+        params: list = [kind, time.time()]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if cursor:
+            created_at, task_id = decode_cursor(cursor)
+            query += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params += [created_at, created_at, task_id]
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        # One extra row tells whether there is a next page
+        params.append(limit + 1)
+
+        rows = self._connect().execute(query, params).fetchall()
+        page = [{"task_id": task_id, **json.loads(data)} for task_id, data, _ in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+        return page, next_cursor
+
+    def counts(self, kind: str) -> Dict[str, int]:
+        rows = self._connect().execute(
+            "SELECT status, n FROM task_counts WHERE kind = ? AND n > 0", (kind,)
+        ).fetchall()
+        return dict(rows)
+
+    def all_counts(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for kind, status, n in self._connect().execute("SELECT kind, status, n FROM task_counts WHERE n > 0"):
+            counts.setdefault(kind, {})[status] = n
+        return counts
+
+    def sweep(self) -> int:
+        conn = self._connect()
+        now = time.time()
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+
+        removed = conn.execute("DELETE FROM tasks WHERE expires_at <= ?", (now,)).rowcount
+        removed += conn.execute(
+            f"DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at <= ?",
+            (*TERMINAL_STATUSES, now - self.finished_ttl),
+        ).rowcount
+
+        # The counters say which kinds are over the cap without scanning them
+        over_cap = conn.execute(
+            f"SELECT kind FROM task_counts WHERE status IN ({placeholders}) GROUP BY kind HAVING SUM(n) > ?",
+            (*TERMINAL_STATUSES, self.max_finished),
+        ).fetchall()
+        for (kind,) in over_cap:
+            removed += conn.execute(
+                f"DELETE FROM tasks WHERE rowid IN ("
+                f"SELECT rowid FROM tasks WHERE kind = ? AND status IN ({placeholders}) "
+                f"ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (kind, *TERMINAL_STATUSES, self.max_finished),
+            ).rowcount
+
+        conn.execute("DELETE FROM task_counts WHERE n <= 0")
+        if removed:
+            logger.info(f"Swept {removed} expired or finished tasks")
+        return removed
+
+    def get_stats(self) -> dict:
+        rows = self._connect().execute("SELECT kind, status, n FROM task_counts WHERE n > 0").fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for kind, status, n in rows:
+            counts.setdefault(kind, {})[status] = n
+        return {
+            "backend": type(self).__name__,
+            "path": self.path,
+            "ttl_seconds": self.ttl,
+            "finished_ttl_seconds": self.finished_ttl,
+            "max_finished_per_kind": self.max_finished,
+            "counts": counts,
+        }
+
+
+class TaskSweeper:
+    """
+    Daemon thread that sweeps the store every interval
+
+    Each worker runs one. Sweeps are idempotent deletes on indexed columns,
+    so several workers sweeping the same SQLite file is harmless.
+    """
+
+    def __init__(self, store: TaskStore, interval: float = TASK_SWEEP_INTERVAL_SECONDS):
+        self.store = store
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_sweep_at: Optional[float] = None
+        self._last_removed = 0
+        self._total_removed = 0
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="task-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._last_removed = self.store.sweep()
+                self._total_removed += self._last_removed
+                self._last_sweep_at = time.time()
+            except Exception as e:
+                logger.warning(f"Task sweep failed: {str(e)}")
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "interval_seconds": self.interval,
+            "last_sweep_at": self._last_sweep_at,
+            "last_removed": self._last_removed,
+            "total_removed": self._total_removed,
+        }
+
+
+def create_task_store(backend: str = TASK_STORE_BACKEND) -> TaskStore:
+    """Build the store configured by TASK_STORE_BACKEND"""
+    if backend == "memory":
+        logger.warning("Using in-memory task store, task status is not shared between workers")
+        return MemoryTaskStore()
+    if backend == "sqlite":
+        return SQLiteTaskStore()
+    raise ValueError(f"Unknown task store backend: {backend}. Supported: sqlite, memory")
+
+
+# Global task store shared by the job routers
+task_store = create_task_store()
+task_sweeper = TaskSweeper(task_store)
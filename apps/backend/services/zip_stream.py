@@ -0,0 +1,60 @@
+import io
+import time
+import zipfile
+from typing import AsyncIterable, AsyncIterator, Optional, Tuple
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable sink that collects what zipfile writes until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_zip(
+    entries: AsyncIterable[Tuple[str, AsyncIterable[bytes], Optional[int]]],
+) -> AsyncIterator[bytes]:
+    """
+    Build a ZIP archive on the fly from (name, async byte chunks, size or None) entries
+
+    Nothing is buffered beyond the chunk being written: each entry uses a
+    data descriptor, so sizes and CRCs don't have to be known up front.
+    Entries are stored uncompressed, the images in them are compressed already.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for name, chunks, size in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            if size is not None:
+                info.file_size = size
+            # Sizes above 2 GiB (or unknown) need zip64 headers
+            with archive.open(info, mode="w", force_zip64=size is None or size > 2 ** 31) as entry:
+                async for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            # Data descriptor with the entry's CRC and sizes
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory, written on close
+    yield sink.drain()
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+# Services read their settings and open their stores when imported, so point
+# them at a scratch directory before any test module imports them
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("TASK_STORE_PATH", os.path.join(_scratch, "tasks.db"))
+os.environ.setdefault("CUTOUT_CACHE_DIR", os.path.join(_scratch, "cutout-cache"))
+os.environ.setdefault("CUTOUT_CACHE_DISK_MB", "0")
+os.environ.setdefault("CUTOUT_CACHE_MEMORY_MB", "0")
+os.environ.setdefault("RESULT_CACHE_DISK_MB", "0")
+os.environ.setdefault("DOWNLOAD_CACHE_DISK_MB", "0")
+os.environ.setdefault("REPLICATE_API_TOKEN", "r8_test")
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from services import circuit_breaker as circuit_breaker_module
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, model_breakers
+from routers import remove_bg_replicate
+from services.replicate_webhooks import record_outcome
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker_module.time, "monotonic", clock)
+    return clock
+
+
+def make_breaker(**options):
+    options = {"window": 4, "min_calls": 4, "failure_rate": 0.5, "slow_call_seconds": 10,
+               "open_seconds": 30, "trial_timeout": 60, **options}
+    return CircuitBreaker("test", **options)
+
+
+def trip(breaker):
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record(1, Exception("boom"))
+    assert breaker.state == OPEN
+
+
+def half_open(breaker, clock):
+    trip(breaker)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+
+
+def test_opens_at_the_failure_rate(clock):
+    breaker = make_breaker()
+    for failed in (True, False, False):
+        breaker.record(1, Exception("boom") if failed else None)
+    assert breaker.state == CLOSED
+    # Slow calls count as failures
+    breaker.record(11)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.get_stats()["rejected"] == 1
+
+
+def test_needs_min_calls_before_opening(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(1, Exception("boom"))
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    breaker.record(1, trial=True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_again(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    breaker.record(1, Exception("still down"), trial=True)
+    assert breaker.state == OPEN
+    assert breaker.get_stats()["times_opened"] == 2
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_only_the_trial_decides(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    # A call from before the circuit opened finishes during the trial
+    breaker.record(1)
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_released_trial_frees_the_slot_once(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    breaker.release(trial=True)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_trial_without_outcome_times_out(clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    assert breaker.allow()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_late_outcomes_are_ignored_while_open(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    breaker.record(1)
+    assert breaker.state == OPEN
+
+
+@pytest.fixture
+def model_breaker(monkeypatch, clock):
+    breaker = make_breaker()
+    monkeypatch.setitem(model_breakers, "owner/model", breaker)
+    return breaker
+
+
+def link(trial=True, pid=None):
+    return {"model": "owner/model", "started_at": time.time() - 1, "breaker_trial": trial,
+            "worker_pid": os.getpid() if pid is None else pid}
+
+
+def test_webhook_trial_outcome_closes(model_breaker, clock):
+    half_open(model_breaker, clock)
+    assert model_breaker.allow()
+    record_outcome(link(), "succeeded")
+    assert model_breaker.state == CLOSED
+
+
+def test_webhook_trial_failure_reopens(model_breaker, clock):
+    half_open(model_breaker, clock)
+    assert model_breaker.allow()
+    record_outcome(link(), "failed", "CUDA out of memory")
+    assert model_breaker.state == OPEN
+    assert model_breaker.get_stats()["last_error"] == "CUDA out of memory"
+
+
+def test_cancelled_webhook_trial_is_released(model_breaker, clock):
+    half_open(model_breaker, clock)
+    assert model_breaker.allow()
+    record_outcome(link(), "canceled")
+    assert model_breaker.state == HALF_OPEN
+    assert model_breaker.allow()
+    assert not model_breaker.allow()
+
+
+@pytest.mark.parametrize("other", [link(trial=False), link(pid=-1)])
+def test_other_webhook_outcomes_leave_the_trial_alone(model_breaker, clock, other):
+    half_open(model_breaker, clock)
+    assert model_breaker.allow()
+    record_outcome(other, "succeeded")
+    record_outcome(other, "canceled")
+    assert model_breaker.state == HALF_OPEN
+    assert not model_breaker.allow()
+
+
+def test_webhook_create_holds_the_trial(monkeypatch, clock):
+    breaker = make_breaker()
+    half_open(breaker, clock)
+    monkeypatch.setattr(remove_bg_replicate, "replicate_bg_removal_breaker", breaker)
+    trials = []
+
+    async def start_webhook_task(task_id, image_url, breaker_trial=False):
+        trials.append(breaker_trial)
+
+    monkeypatch.setattr(remove_bg_replicate, "start_webhook_task", start_webhook_task)
+    assert asyncio.run(remove_bg_replicate.run_bg_removal("https://img.test/a.png", webhook_task_id="t1")) is None
+    assert trials == [True]
+    # Still held: no second trial until the webhook reports back
+    assert not breaker.allow()
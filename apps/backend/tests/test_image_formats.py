@@ -0,0 +1,64 @@
+from io import BytesIO
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from routers import remove_bg
+from services import cutout_engine
+
+
+def make_png() -> bytes:
+    image = Image.new("RGB", (64, 64), "white")
+    image.paste((200, 30, 30), (16, 16, 48, 48))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # The colour-based fallback remover, so no rembg model has to be downloaded
+    monkeypatch.setattr(cutout_engine, "REMBG_AVAILABLE", False)
+    app = FastAPI()
+    app.include_router(remove_bg.router, prefix="/remove-bg")
+    return TestClient(app)
+
+
+def post_image(client, accept=None, **form):
+    headers = {"Accept": accept} if accept else {}
+    return client.post(
+        "/remove-bg/", files={"file": ("product.png", make_png(), "image/png")}, data=form, headers=headers
+    )
+
+
+def test_accept_png_returns_rgba_cutout(client):
+    response = post_image(client, "image/png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(BytesIO(response.content)).mode == "RGBA"
+
+
+def test_mask_only_through_output_format(client):
+    response = post_image(client, "image/png", output_format="mask")
+    assert response.status_code == 200
+    assert Image.open(BytesIO(response.content)).mode == "L"
+
+
+def test_accept_webp_returns_webp(client):
+    response = post_image(client, "image/webp")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert Image.open(BytesIO(response.content)).format == "WEBP"
+
+
+def test_no_accept_returns_base64_json(client):
+    response = post_image(client)
+    assert response.status_code == 200
+    assert "png_base64" in response.json()
+
+
+def test_unservable_accept_is_406(client):
+    response = post_image(client, "image/jpeg")
+    assert response.status_code == 406
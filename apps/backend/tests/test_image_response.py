@@ -0,0 +1,56 @@
+import pytest
+from fastapi import HTTPException
+
+from services.image_response import negotiate_image_format, resolve_output_format
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("", None),
+    ("application/json", None),
+    ("*/*", None),
+    ("image/png", "png"),
+    ("image/webp", "webp"),
+    ("IMAGE/PNG", "png"),
+    ("image/png;q=0.5, image/webp;q=0.9", "webp"),
+    ("image/webp;q=0.4, image/png", "png"),
+    ("image/png;q=0", None),
+    ("image/png;q=bogus, image/webp;q=0.1", "webp"),
+    ("image/jpeg", None),
+    ("image/*", "png"),
+    ("image/*, image/webp", "webp"),
+    ("text/html, image/webp;q=0.8, */*;q=0.5", "webp"),
+])
+def test_negotiate_image_format(accept, expected):
+    assert negotiate_image_format(accept) == expected
+
+
+@pytest.mark.parametrize("accept, output_format, expected", [
+    (None, None, ("png", False)),
+    ("application/json", None, ("png", False)),
+    ("*/*", "mask", ("mask", False)),
+    ("image/png", None, ("png", True)),
+    ("image/png", "mask", ("mask", True)),
+    ("image/webp", None, ("webp", True)),
+    ("image/png", "webp", ("webp", True)),
+    ("text/html, application/xhtml+xml, */*;q=0.8", None, ("png", False)),
+])
+def test_resolve_output_format(accept, output_format, expected):
+    assert resolve_output_format(accept, output_format) == expected
+
+
+def test_resolve_output_format_rejects_webp_as_json():
+    with pytest.raises(ValueError):
+        resolve_output_format("application/json", "webp")
+
+
+def test_resolve_output_format_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        resolve_output_format("image/png", "gif")
+
+
+@pytest.mark.parametrize("accept", ["image/jpeg", "text/html", "application/json;q=0, image/gif"])
+def test_resolve_output_format_not_acceptable(accept):
+    with pytest.raises(HTTPException) as raised:
+        resolve_output_format(accept)
+    assert raised.value.status_code == 406
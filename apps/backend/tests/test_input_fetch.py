@@ -0,0 +1,147 @@
+import asyncio
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import input_fetch
+from services.input_fetch import InputFetcher, InputFetchError
+
+IMAGE = b"\x89PNG fake image bytes"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/redirect-private":
+            self.send_response(302)
+            self.send_header("Location", "http://10.0.0.1/image.png")
+            self.end_headers()
+            return
+        body = IMAGE * 100 if self.path == "/big.png" else IMAGE
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+
+
+def fetch(url, allowed_hosts=(), max_bytes=1024):
+    fetcher = InputFetcher(max_bytes=max_bytes, max_redirects=2, timeout=2, allowed_hosts=list(allowed_hosts))
+
+    async def scenario():
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.close()
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/image.png",
+    "file:///etc/passwd",
+    "http://127.0.0.1/image.png",
+    "http://10.0.0.1/image.png",
+    "http://[::1]/image.png",
+    "http://169.254.169.254/latest/meta-data",
+    "http://localhost/image.png",
+])
+def test_refuses_non_public_urls(url):
+    with pytest.raises(InputFetchError):
+        fetch(url)
+
+
+def test_fetches_allowed_hosts(server):
+    assert fetch(f"http://127.0.0.1:{server}/image.png", allowed_hosts=[f"127.0.0.1:{server}"]) == IMAGE
+
+
+def test_caps_the_body_size(server):
+    with pytest.raises(InputFetchError, match="larger"):
+        fetch(f"http://127.0.0.1:{server}/big.png", allowed_hosts=["127.0.0.1"])
+
+
+def test_checks_every_redirect_hop(server):
+    with pytest.raises(InputFetchError, match="non-public"):
+        fetch(f"http://127.0.0.1:{server}/redirect-private", allowed_hosts=["127.0.0.1"])
+
+
+@pytest.fixture
+def rebinding_dns(monkeypatch, server):
+    """
+    rebind.test resolves to the test server once, then to a private address.
+    The test server counts as public here, standing in for a real image host.
+    """
+    lookups = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host != "rebind.test":
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        lookups.append(host)
+        address = "127.0.0.1" if len(lookups) == 1 else "10.255.255.1"
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    monkeypatch.setattr(input_fetch, "is_public_address", lambda address: address == "127.0.0.1")
+    return lookups
+
+
+def test_connects_to_the_checked_address(server, rebinding_dns):
+    assert fetch(f"http://rebind.test:{server}/image.png") == IMAGE
+    # Resolved once by the check, the connection didn't look the host up again
+    assert rebinding_dns == ["rebind.test"]
+
+
+def test_backend_refuses_hosts_that_were_not_checked():
+    backend = input_fetch.PinnedNetworkBackend(None)
+
+    async def scenario():
+        input_fetch._pinned.set(("images.example", ["93.184.216.34"]))
+        await backend.connect_tcp("other.example", 443)
+
+    with pytest.raises(input_fetch.httpcore.ConnectError):
+        asyncio.run(scenario())
+
+
+@pytest.fixture
+def uploads_fetcher(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    (uploads / "my photo.png").write_bytes(IMAGE)
+    (uploads / "big.png").write_bytes(IMAGE * 100)
+    (tmp_path / "secret.txt").write_text("not an upload")
+    fetcher = InputFetcher(max_bytes=1024, max_redirects=2, timeout=2, allowed_hosts=[])
+    fetcher.uploads_url = "https://api.invalid/uploads/"
+    fetcher.upload_dir = uploads
+    return fetcher
+
+
+def test_reads_own_uploads_from_disk(uploads_fetcher):
+    # api.invalid doesn't resolve, so this can only come from the upload directory
+    assert asyncio.run(uploads_fetcher.fetch("https://api.invalid/uploads/my%20photo.png?v=1")) == IMAGE
+    assert uploads_fetcher.get_stats()["read_locally"] == 1
+
+
+def test_caps_uploads_read_from_disk(uploads_fetcher):
+    with pytest.raises(InputFetchError, match="larger"):
+        asyncio.run(uploads_fetcher.fetch("https://api.invalid/uploads/big.png"))
+
+
+@pytest.mark.parametrize("path", ["..%2Fsecret.txt", "%2F..%2Fsecret.txt", "missing.png"])
+def test_never_reads_outside_the_upload_directory(uploads_fetcher, path):
+    # Not an upload, so it goes through the network checks (and api.invalid doesn't resolve)
+    with pytest.raises(InputFetchError, match="resolve"):
+        asyncio.run(uploads_fetcher.fetch(f"https://api.invalid/uploads/{path}"))
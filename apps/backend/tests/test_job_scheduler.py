@@ -0,0 +1,165 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from services.job_scheduler import JobCancelled, JobScheduler
+from services.task_store import task_store
+
+KIND = "upscale"
+MODEL = "owner/model"
+
+
+def make_scheduler(**options):
+    options = {"concurrency_per_model": 1, "retry_base_delay": 0.01, "cancel_check_interval": 0.02, **options}
+    return JobScheduler(**options)
+
+
+def new_task() -> str:
+    task_id = str(uuid.uuid4())
+    task_store.create(KIND, task_id, {"status": "processing"})
+    return task_id
+
+
+class Flaky:
+    """Job that fails with the given errors, then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"upscaled_url": "https://out/1.png"}
+
+
+def test_completes_the_task():
+    scheduler = make_scheduler()
+    task_id = new_task()
+    task = asyncio.run(scheduler.run(KIND, task_id, MODEL, Flaky()))
+    assert task["status"] == "completed"
+    assert task_store.get(KIND, task_id)["upscaled_url"] == "https://out/1.png"
+    assert scheduler.get_stats()["completed"] == 1
+
+
+def test_retries_transient_errors():
+    scheduler = make_scheduler()
+    task_id = new_task()
+    job = Flaky(httpx.ConnectError("refused"), httpx.ReadTimeout("slow"))
+
+    task = asyncio.run(scheduler.run(KIND, task_id, MODEL, job))
+    assert task["status"] == "completed"
+    assert task["attempts"] == 3
+    assert job.calls == 3
+    assert scheduler.get_stats()["retried"] == 2
+
+
+def test_does_not_retry_other_errors():
+    scheduler = make_scheduler()
+    task_id = new_task()
+    job = Flaky(ValueError("bad input"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.run(KIND, task_id, MODEL, job))
+    assert job.calls == 1
+    task = task_store.get(KIND, task_id)
+    assert task["status"] == "failed"
+    assert task["error"] == "bad input"
+
+
+def test_gives_up_after_max_attempts():
+    scheduler = make_scheduler(max_attempts=2)
+    task_id = new_task()
+    job = Flaky(*[httpx.ConnectError("refused")] * 5)
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(scheduler.run(KIND, task_id, MODEL, job))
+    assert job.calls == 2
+    assert task_store.get(KIND, task_id)["status"] == "failed"
+
+
+def test_handed_off_jobs_leave_the_task_processing():
+    scheduler = make_scheduler()
+    task_id = new_task()
+
+    async def hand_off():
+        return None
+
+    assert asyncio.run(scheduler.run(KIND, task_id, MODEL, hand_off)) is None
+    assert task_store.get(KIND, task_id)["status"] == "processing"
+    assert scheduler.get_stats()["handed_off"] == 1
+
+
+async def run_blocked(scheduler, task_id):
+    """Start a job that only finishes when cancelled, return its waiter once it runs"""
+    started = asyncio.Event()
+
+    async def block():
+        started.set()
+        await asyncio.Event().wait()
+
+    waiter = asyncio.ensure_future(scheduler.run(KIND, task_id, MODEL, block))
+    await asyncio.wait_for(started.wait(), 1)
+    return waiter
+
+
+def test_cancel_stops_a_running_job():
+    scheduler = make_scheduler()
+    task_id = new_task()
+
+    async def scenario():
+        waiter = await run_blocked(scheduler, task_id)
+        cancelled = await scheduler.cancel(KIND, task_id)
+        assert cancelled["status"] == "cancelled"
+        with pytest.raises(JobCancelled):
+            await asyncio.wait_for(waiter, 1)
+        assert await scheduler.cancel(KIND, task_id) is None
+
+    asyncio.run(scenario())
+    assert task_store.get(KIND, task_id)["status"] == "cancelled"
+    assert scheduler.get_stats()["cancelled"] == 1
+
+
+def test_cancel_drops_a_queued_job():
+    scheduler = make_scheduler()
+    running_id, queued_id = new_task(), new_task()
+    queued_job = Flaky()
+
+    async def scenario():
+        running = await run_blocked(scheduler, running_id)
+        queued = asyncio.ensure_future(scheduler.run(KIND, queued_id, MODEL, queued_job))
+        await asyncio.sleep(0)
+        await scheduler.cancel(KIND, queued_id)
+        await scheduler.cancel(KIND, running_id)
+        for waiter in (running, queued):
+            with pytest.raises(JobCancelled):
+                await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(scenario())
+    assert queued_job.calls == 0
+
+
+def test_watcher_aborts_jobs_cancelled_by_another_worker(monkeypatch):
+    scheduler = make_scheduler(concurrency_per_model=3)
+    task_ids = [new_task() for _ in range(3)]
+    reads = []
+    get_many = task_store.get_many
+    monkeypatch.setattr(task_store, "get_many", lambda kind, ids: reads.append(list(ids)) or get_many(kind, ids))
+
+    async def scenario():
+        waiters = [await run_blocked(scheduler, task_id) for task_id in task_ids]
+        # Another worker cancels through the store, without this scheduler's cancel()
+        task_store.transition(KIND, task_ids[0], ("processing",), status="cancelled")
+        with pytest.raises(JobCancelled):
+            await asyncio.wait_for(waiters[0], 1)
+        assert not waiters[1].done() and not waiters[2].done()
+        for task_id in task_ids[1:]:
+            await scheduler.cancel(KIND, task_id)
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(scenario())
+    # The first tick read every running job at once
+    assert sorted(reads[0]) == sorted(task_ids)
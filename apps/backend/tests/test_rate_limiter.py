@@ -0,0 +1,133 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from services import rate_limiter as rate_limiter_module
+from services.rate_limiter import RateLimiter, ReplicateRateLimits, parse_limit, parse_model_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, tmp_path):
+    def make():
+        return RateLimiter(str(tmp_path / "tasks.db") if request.param == "sqlite" else None)
+    return make
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("8:16", (8.0, 16.0)),
+    ("2", (2.0, 2.0)),
+    ("0.5", (0.5, 1.0)),
+    ("0.5:1", (0.5, 1.0)),
+    ("0", (0.0, 1.0)),
+    ("0:0", (0.0, 0.0)),
+])
+def test_parse_limit(value, expected):
+    assert parse_limit(value) == expected
+
+
+def test_parse_limit_rejects_buckets_smaller_than_a_token():
+    with pytest.raises(ValueError, match="burst"):
+        parse_limit("2:0.5")
+
+
+def test_parse_model_limits():
+    assert parse_model_limits("a/b=0.5:2, c/d=3,broken") == {"a/b": (0.5, 2.0), "c/d": (3.0, 3.0)}
+
+
+def test_burst_then_rejects(make_limiter, clock):
+    limiter = make_limiter()
+    assert [limiter.try_take("bucket", 2, 3) for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_take("bucket", 2, 3) == pytest.approx(0.5)
+
+
+def test_refills_at_the_rate(make_limiter, clock):
+    limiter = make_limiter()
+    for _ in range(3):
+        limiter.try_take("bucket", 2, 3)
+
+    clock.now += 0.75
+    assert limiter.try_take("bucket", 2, 3) == 0
+    assert limiter.try_take("bucket", 2, 3) == pytest.approx(0.25)
+
+
+def test_refill_stops_at_the_burst(make_limiter, clock):
+    limiter = make_limiter()
+    limiter.try_take("bucket", 2, 3)
+    clock.now += 3600
+    waits = [limiter.try_take("bucket", 2, 3) for _ in range(4)]
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3] > 0
+
+
+def test_buckets_are_independent(make_limiter, clock):
+    limiter = make_limiter()
+    limiter.try_take("a", 1, 1)
+    assert limiter.try_take("a", 1, 1) > 0
+    assert limiter.try_take("b", 1, 1) == 0
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path, clock):
+    path = str(tmp_path / "tasks.db")
+    first, second = RateLimiter(path), RateLimiter(path)
+    assert first.try_take("bucket", 1, 2) == 0
+    assert second.try_take("bucket", 1, 2) == 0
+    assert first.try_take("bucket", 1, 2) > 0
+
+
+def test_acquire_waits_for_the_next_token(make_limiter):
+    limiter = make_limiter()
+
+    async def scenario():
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire("bucket", 20, 1)
+        return time.monotonic() - started
+
+    # One token up front, the next two 50ms apart
+    assert asyncio.run(scenario()) >= 0.08
+    stats = limiter.get_stats()
+    assert stats["granted"] == 3
+    assert stats["throttled"] == 2
+
+
+def test_acquire_is_a_no_op_without_a_rate(make_limiter):
+    limiter = make_limiter()
+
+    async def scenario():
+        for _ in range(100):
+            await limiter.acquire("bucket", 0, 0)
+
+    asyncio.run(scenario())
+    assert limiter.get_stats()["throttled"] == 0
+
+
+def test_replicate_buckets_are_keyed_without_the_token(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "tasks.db"))
+    limits = ReplicateRateLimits(limiter, (10, 10), (10, 10), {"owner/model": (1, 1)})
+
+    async def scenario():
+        await limits.before_create("r8_secret", "owner/model")
+        await limits.before_request("r8_secret")
+
+    asyncio.run(scenario())
+    names = [row[0] for row in sqlite3.connect(limiter.path).execute("SELECT name FROM rate_buckets")]
+    assert len(names) == 3
+    assert "replicate:model:owner/model" in names
+    assert not any("r8_secret" in name for name in names)
@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.replicate_client import AsyncRetryTransport, ReplicateClient
+
+PREDICTION = {
+    "id": "p1", "model": "owner/model", "version": "v1", "status": "succeeded",
+    "input": {}, "output": "https://replicate.delivery/out.png", "logs": "", "error": None,
+    "metrics": {}, "created_at": "2024-01-01T00:00:00Z", "urls": {},
+}
+
+
+class Upstream:
+    """Answers from a list of status codes, then 200 with a prediction"""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        status = self.statuses.pop(0) if self.statuses else 200
+        return httpx.Response(status, json=PREDICTION if status == 200 else {"detail": "busy"})
+
+
+def send(transport, method="GET"):
+    async def scenario():
+        async with httpx.AsyncClient(transport=transport, base_url="https://api.test") as client:
+            return await client.request(method, "/v1/predictions/p1")
+    return asyncio.run(scenario())
+
+
+def test_retry_transport_retries_gets():
+    upstream = Upstream([503, 429])
+    transport = AsyncRetryTransport(httpx.MockTransport(upstream), max_attempts=5, max_backoff=0)
+    assert send(transport).status_code == 200
+    assert len(upstream.requests) == 3
+    assert transport.retries == 2
+
+
+def test_retry_transport_gives_up_after_max_attempts():
+    upstream = Upstream([503] * 10)
+    transport = AsyncRetryTransport(httpx.MockTransport(upstream), max_attempts=3, max_backoff=0)
+    assert send(transport).status_code == 503
+    assert len(upstream.requests) == 3
+
+
+def test_retry_transport_never_repeats_a_create():
+    upstream = Upstream([503])
+    transport = AsyncRetryTransport(httpx.MockTransport(upstream), max_attempts=5, max_backoff=0)
+    assert send(transport, "POST").status_code == 503
+    assert len(upstream.requests) == 1
+
+
+def test_retry_after_header_caps_at_max_backoff():
+    transport = AsyncRetryTransport(httpx.MockTransport(Upstream()), max_backoff=2)
+    assert transport.backoff(1, httpx.Headers({"retry-after": "1"})) == 1
+    assert transport.backoff(1, httpx.Headers({"retry-after": "30"})) == 2
+
+
+def test_requests_go_through_the_library_stack(monkeypatch):
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "r8_one")
+    client = ReplicateClient(base_url="https://api.test")
+    upstream = Upstream([502])
+
+    async def scenario():
+        library = await client._get_client()
+        # Only our transport retries, the library's own retrying wrapper is turned off
+        assert library._async_client._transport.max_attempts == 1
+        client._transport._wrapped = httpx.MockTransport(upstream)
+        client._transport.max_backoff = 0
+        prediction = await client.get_prediction("p1")
+        await client.close()
+        return prediction
+
+    prediction = asyncio.run(scenario())
+    assert prediction.status == "succeeded"
+    assert [r.headers["authorization"] for r in upstream.requests] == ["Token r8_one"] * 2
+    assert client.get_stats()["http_retries"] == 1
+
+
+def test_token_change_closes_the_previous_client(monkeypatch):
+    client = ReplicateClient(base_url="https://api.test")
+
+    async def scenario():
+        monkeypatch.setenv("REPLICATE_API_TOKEN", "r8_one")
+        first = await client._get_client()
+        assert await client._get_client() is first
+
+        monkeypatch.setenv("REPLICATE_API_TOKEN", "r8_two")
+        second = await client._get_client()
+        assert second is not first
+        assert first._async_client.is_closed
+        assert not second._async_client.is_closed
+
+        await client.close()
+        assert second._async_client.is_closed
+
+    asyncio.run(scenario())
+
+
+def test_missing_token(monkeypatch):
+    monkeypatch.delenv("REPLICATE_API_TOKEN", raising=False)
+    with pytest.raises(Exception, match="REPLICATE_API_TOKEN"):
+        asyncio.run(ReplicateClient()._get_client())
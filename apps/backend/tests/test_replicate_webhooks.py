@@ -0,0 +1,118 @@
+import base64
+import functools
+import json
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import replicate_webhook
+from services.replicate_webhooks import (
+    WEBHOOK_PATH,
+    WEBHOOK_TOLERANCE_SECONDS,
+    WebhookVerificationError,
+    sign,
+    verify_signature,
+)
+
+SECRET = "whsec_" + base64.b64encode(b"webhook-test-secret").decode()
+BODY = json.dumps({"id": "unknown-prediction", "status": "succeeded"}).encode()
+
+
+def signed_headers(body=BODY, secret=SECRET, timestamp=None, webhook_id="msg_1"):
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": sign(secret, webhook_id, timestamp, body),
+    }
+
+
+def test_accepts_a_valid_signature():
+    verify_signature(signed_headers(), BODY, SECRET)
+
+
+def test_secret_prefix_is_optional():
+    bare_secret = SECRET.split("_", 1)[1]
+    verify_signature(signed_headers(secret=bare_secret), BODY, SECRET)
+
+
+def test_accepts_any_of_several_signatures():
+    headers = signed_headers()
+    old = signed_headers(secret="whsec_" + base64.b64encode(b"rotated-out").decode())
+    headers["webhook-signature"] = f"{old['webhook-signature']} {headers['webhook-signature']}"
+    verify_signature(headers, BODY, SECRET)
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda h, b: (h, b + b" "),
+    lambda h, b: ({**h, "webhook-id": "msg_2"}, b),
+    lambda h, b: ({**h, "webhook-signature": "v1," + base64.b64encode(b"x" * 32).decode()}, b),
+])
+def test_rejects_tampered_requests(tamper):
+    headers, body = tamper(signed_headers(), BODY)
+    with pytest.raises(WebhookVerificationError, match="Invalid webhook signature"):
+        verify_signature(headers, body, SECRET)
+
+
+def test_rejects_another_secret():
+    other = "whsec_" + base64.b64encode(b"someone-else").decode()
+    with pytest.raises(WebhookVerificationError, match="Invalid webhook signature"):
+        verify_signature(signed_headers(secret=other), BODY, SECRET)
+
+
+@pytest.mark.parametrize("missing", ["webhook-id", "webhook-timestamp", "webhook-signature"])
+def test_rejects_missing_headers(missing):
+    headers = signed_headers()
+    del headers[missing]
+    with pytest.raises(WebhookVerificationError, match="Missing"):
+        verify_signature(headers, BODY, SECRET)
+
+
+@pytest.mark.parametrize("skew", [WEBHOOK_TOLERANCE_SECONDS + 5, -WEBHOOK_TOLERANCE_SECONDS - 5])
+def test_rejects_timestamps_outside_tolerance(skew):
+    # Signed correctly, but too old (replay) or too far in the future
+    headers = signed_headers(timestamp=int(time.time()) - skew)
+    with pytest.raises(WebhookVerificationError, match="tolerance"):
+        verify_signature(headers, BODY, SECRET)
+
+
+def test_accepts_timestamps_within_tolerance():
+    verify_signature(signed_headers(timestamp=int(time.time()) - WEBHOOK_TOLERANCE_SECONDS + 5), BODY, SECRET)
+
+
+def test_rejects_non_numeric_timestamp():
+    with pytest.raises(WebhookVerificationError, match="Invalid webhook timestamp"):
+        verify_signature(signed_headers(timestamp="yesterday"), BODY, SECRET)
+
+
+def test_rejects_everything_without_a_secret():
+    with pytest.raises(WebhookVerificationError, match="not configured"):
+        verify_signature(signed_headers(), BODY, "")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(replicate_webhook, "verify_signature", functools.partial(verify_signature, secret=SECRET))
+    app = FastAPI()
+    app.include_router(replicate_webhook.router)
+    return TestClient(app)
+
+
+def test_endpoint_rejects_unsigned_calls(client):
+    response = client.post(WEBHOOK_PATH, content=BODY)
+    assert response.status_code == 401
+
+
+def test_endpoint_rejects_stale_calls(client):
+    headers = signed_headers(timestamp=int(time.time()) - WEBHOOK_TOLERANCE_SECONDS - 60)
+    response = client.post(WEBHOOK_PATH, content=BODY, headers=headers)
+    assert response.status_code == 401
+
+
+def test_endpoint_acknowledges_verified_calls(client):
+    # Unknown predictions still get a 200 so Replicate doesn't keep retrying
+    response = client.post(WEBHOOK_PATH, content=BODY, headers=signed_headers())
+    assert response.status_code == 200
+    assert response.json() == {"received": True, "task_updated": False}
@@ -0,0 +1,220 @@
+import asyncio
+import time
+
+import pytest
+
+from services import task_store as task_store_module
+from services.task_store import MemoryTaskStore, SQLiteTaskStore
+
+
+class Clock:
+    """Stands in for time.time so expiry can be tested without sleeping"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(task_store_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**options):
+        if request.param == "memory":
+            return MemoryTaskStore(**options)
+        return SQLiteTaskStore(path=str(tmp_path / "tasks.db"), **options)
+    return make
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+def test_create_get_update_delete(store):
+    store.create("upscale", "a", {"status": "processing", "url": None})
+    assert store.get("upscale", "a") == {"status": "processing", "url": None}
+    assert store.get("bg_removal", "a") is None
+
+    updated = store.update("upscale", "a", status="completed", url="http://out")
+    assert updated == {"status": "completed", "url": "http://out"}
+    assert store.get("upscale", "a")["url"] == "http://out"
+
+    assert store.delete("upscale", "a") is True
+    assert store.delete("upscale", "a") is False
+    assert store.get("upscale", "a") is None
+    assert store.update("upscale", "a", status="failed") is None
+
+
+def test_get_many(store, clock, monkeypatch):
+    monkeypatch.setattr(task_store_module, "GET_MANY_CHUNK", 2)
+    for task_id in "abcde":
+        store.create("upscale", task_id, {"status": "processing", "n": task_id})
+    store.create("upscale", "short", {"status": "processing"}, ttl=10)
+    store.create("bg_removal", "f", {"status": "processing"})
+    clock.now += 20
+
+    tasks = store.get_many("upscale", ["a", "c", "e", "e", "missing", "short", "f"])
+    assert tasks == {task_id: {"status": "processing", "n": task_id} for task_id in "ace"}
+    assert store.get_many("upscale", []) == {}
+
+
+def test_transition_only_from_expected_status(store):
+    store.create("upscale", "a", {"status": "processing"})
+    assert store.transition("upscale", "a", ("pending",), status="completed") is None
+    assert store.transition("upscale", "a", ("processing",), status="cancelled")["status"] == "cancelled"
+    # A finished task can't be completed again
+    assert store.transition("upscale", "a", ("processing",), status="completed") is None
+    assert store.get("upscale", "a")["status"] == "cancelled"
+
+
+def test_create_if_absent(store, clock):
+    assert store.create_if_absent("lock", "k", {"status": "held"}, ttl=10) is True
+    assert store.create_if_absent("lock", "k", {"status": "other"}, ttl=10) is False
+    assert store.get("lock", "k")["status"] == "held"
+
+    # An expired task no longer blocks the id
+    clock.now += 11
+    assert store.get("lock", "k") is None
+    assert store.create_if_absent("lock", "k", {"status": "other"}, ttl=10) is True
+    assert store.counts("lock") == {"other": 1}
+
+
+def test_counts_follow_creates_transitions_and_deletes(store):
+    for task_id in "abc":
+        store.create("upscale", task_id, {"status": "processing"})
+    store.create("bg_removal", "x", {"status": "processing"})
+    assert store.counts("upscale") == {"processing": 3}
+
+    store.update("upscale", "a", status="completed")
+    store.update("upscale", "b", status="failed")
+    # Fields other than status leave the counts alone
+    store.update("upscale", "c", progress=50)
+    assert store.counts("upscale") == {"processing": 1, "completed": 1, "failed": 1}
+
+    # Re-creating an existing task replaces it instead of counting it twice
+    store.create("upscale", "a", {"status": "processing"})
+    assert store.counts("upscale") == {"processing": 2, "failed": 1}
+
+    store.delete("upscale", "b")
+    assert store.counts("upscale") == {"processing": 2}
+    assert store.count("upscale") == 2
+    assert store.count("upscale", "processing") == 2
+    assert store.count("upscale", "failed") == 0
+    assert store.all_counts() == {"upscale": {"processing": 2}, "bg_removal": {"processing": 1}}
+
+
+def test_sweep_removes_expired_and_old_finished_tasks(make_store, clock):
+    store = make_store(ttl=100, finished_ttl=50)
+    store.create("upscale", "running", {"status": "processing"})
+    store.create("upscale", "done", {"status": "completed"})
+    store.create("upscale", "short", {"status": "processing"}, ttl=10)
+
+    clock.now += 20
+    assert store.sweep() == 1
+    assert store.get("upscale", "short") is None
+
+    clock.now += 40
+    assert store.sweep() == 1
+    assert store.get("upscale", "done") is None
+    assert store.get("upscale", "running") is not None
+    assert store.counts("upscale") == {"processing": 1}
+
+    clock.now += 50
+    assert store.sweep() == 1
+    assert store.counts("upscale") == {}
+
+
+def test_sweep_caps_finished_tasks_per_kind(make_store, clock):
+    store = make_store(max_finished=2)
+    for i in range(4):
+        clock.now += 1
+        store.create("upscale", f"t{i}", {"status": "completed"})
+    store.create("upscale", "running", {"status": "processing"})
+
+    assert store.sweep() == 2
+    # The oldest finished ones go first, running tasks are never capped
+    assert store.get("upscale", "t0") is None and store.get("upscale", "t1") is None
+    assert store.get("upscale", "t3") is not None
+    assert store.counts("upscale") == {"completed": 2, "processing": 1}
+
+
+def test_cursor_pagination(store):
+    ids = [f"task-{i:02d}" for i in range(7)]
+    for task_id in ids:
+        store.create("upscale", task_id, {"status": "completed" if task_id != "task-03" else "failed"})
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = store.list_page("upscale", limit=3, cursor=cursor)
+        assert len(page) <= 3
+        seen += [task["task_id"] for task in page]
+        if cursor is None:
+            break
+    # Newest first, every task exactly once
+    assert seen == list(reversed(ids))
+
+    page, cursor = store.list_page("upscale", status="failed")
+    assert [task["task_id"] for task in page] == ["task-03"] and cursor is None
+
+
+def test_pages_are_stable_when_tasks_are_added(store, clock):
+    for i in range(4):
+        clock.now += 1
+        store.create("upscale", f"old-{i}", {"status": "completed"})
+    page, cursor = store.list_page("upscale", limit=2)
+    clock.now += 1
+    store.create("upscale", "new", {"status": "completed"})
+    rest, _ = store.list_page("upscale", limit=10, cursor=cursor)
+    assert [task["task_id"] for task in page + rest] == ["old-3", "old-2", "old-1", "old-0"]
+
+
+def test_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        store.list_page("upscale", cursor="not-a-cursor")
+
+
+def test_listeners_see_changes(store):
+    events = []
+    store.add_listener(lambda kind, task_id, task: events.append((kind, task_id, task and task["status"])))
+    store.create("upscale", "a", {"status": "processing"})
+    store.update("upscale", "a", status="completed")
+    store.transition("upscale", "a", ("processing",), status="failed")
+    store.delete("upscale", "a")
+    assert events == [("upscale", "a", "processing"), ("upscale", "a", "completed"), ("upscale", "a", None)]
+
+
+def test_async_methods(store):
+    async def scenario():
+        await store.acreate("upscale", "a", {"status": "processing"})
+        await store.aupdate("upscale", "a", status="completed")
+        assert (await store.aget("upscale", "a"))["status"] == "completed"
+        assert await store.acounts("upscale") == {"completed": 1}
+        page, _ = await store.alist_page("upscale")
+        assert [task["task_id"] for task in page] == ["a"]
+        assert await store.adelete("upscale", "a") is True
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_counts_are_backfilled_for_an_existing_database(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store = SQLiteTaskStore(path=path)
+    store.create("upscale", "a", {"status": "completed"})
+    store.create("upscale", "b", {"status": "processing"})
+    # A database from before the counters existed
+    conn = store._connect()
+    for trigger in ("tasks_count_insert", "tasks_count_delete", "tasks_count_update"):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE task_counts")
+
+    reopened = SQLiteTaskStore(path=path)
+    assert reopened.counts("upscale") == {"completed": 1, "processing": 1}
@@ -0,0 +1,52 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from routers import upscale
+from services.task_store import task_store
+
+
+@pytest.fixture
+def reconciled(monkeypatch):
+    calls = []
+
+    async def reconcile(task_kind, task_id, task):
+        calls.append(task_id)
+        return {**task, "status": "completed", "upscaled_url": f"https://out/{task_id}.png"}
+
+    monkeypatch.setattr(upscale.replicate_webhooks, "reconcile", reconcile)
+    return calls
+
+
+def make_batch(statuses):
+    """A batch whose items have tasks in the given statuses (None: not started yet)"""
+    items = [{"task_id": str(uuid.uuid4()), "original_url": f"https://img.test/{i}.png"} for i in range(len(statuses))]
+    for item, status in zip(items, statuses):
+        if status is not None:
+            task_store.create(upscale.TASK_KIND, item["task_id"], {"status": status})
+    batch_id = str(uuid.uuid4())
+    task_store.create(upscale.BATCH_KIND, batch_id, {"status": "processing", "items": items})
+    return batch_id, items
+
+
+def test_batch_tasks_are_read_at_once(monkeypatch, reconciled):
+    batch_id, items = make_batch(["processing", "completed", None, "failed", "processing"])
+    reads = []
+    get_many = task_store.get_many
+    monkeypatch.setattr(task_store, "get_many", lambda kind, ids: reads.append(list(ids)) or get_many(kind, ids))
+
+    batch, tasks = asyncio.run(upscale.get_batch_tasks(batch_id))
+
+    assert reads == [[item["task_id"] for item in items]]
+    # Only unfinished items are checked with Replicate
+    assert sorted(reconciled) == sorted([items[0]["task_id"], items[4]["task_id"]])
+    assert [task and task["status"] for task in tasks] == ["completed", "completed", None, "failed", "completed"]
+    assert upscale.batch_counts(tasks) == {"pending": 1, "processing": 0, "completed": 3, "failed": 1, "cancelled": 0}
+
+
+def test_unknown_batch():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(upscale.get_batch_tasks("missing"))
+    assert error.value.status_code == 404